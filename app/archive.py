@@ -0,0 +1,188 @@
+# app/archive.py
+"""
+Cold message history in compressed, append-only segment files.
+
+archive_messages.py moves messages older than MESSAGE_RETENTION_DAYS out of
+the `messages` table into
+
+    ARCHIVE_DIR/<chat_id>/<YYYY-MM>.seg   zlib blocks of JSON lines, appended
+    ARCHIVE_DIR/<chat_id>/index           one JSON line per block:
+                                          {"first", "last", "count", "segment", "offset", "length"}
+
+A block holds consecutive messages (ascending id) of one chat, in the same
+shape /messages/ returns, so /messages/ pages past the oldest row still in
+the table by reading the index and one or two blocks. Old history is
+dropped a month at a time by deleting segment files, never row by row.
+"""
+import json
+import os
+import threading
+import zlib
+
+from app.config import ARCHIVE_DIR
+
+_index_cache = {}   # chat_id -> (mtime_ns, [entry, ...])
+_lock = threading.Lock()
+
+
+def _chat_dir(chat_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, str(int(chat_id)))
+
+
+def load_index(chat_id: int) -> list:
+    """Blocks of a chat, oldest first; cached until the index file changes."""
+    path = os.path.join(_chat_dir(chat_id), "index")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    cached = _index_cache.get(chat_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue   # a torn line from a crash; the rows are still in the table
+    with _lock:
+        _index_cache[chat_id] = (mtime, entries)
+    return entries
+
+
+def exists() -> bool:
+    """Whether anything was ever archived (saves /messages/ a lookup otherwise)."""
+    return os.path.isdir(ARCHIVE_DIR)
+
+
+def last_archived_id(chat_id: int) -> int:
+    entries = load_index(chat_id)
+    return entries[-1]["last"] if entries else 0
+
+
+# ================== WRITE ==================
+
+def append_block(chat_id: int, messages: list, segment: str):
+    """
+    Append messages (ascending id, message_from_row shape) as one block of
+    `segment` and index it. Both files are fsynced before returning, so the
+    caller may delete the rows afterwards.
+    """
+    directory = _chat_dir(chat_id)
+    os.makedirs(directory, exist_ok=True)
+    data = zlib.compress("\n".join(json.dumps(m, ensure_ascii=False) for m in messages).encode("utf-8"), 6)
+
+    with open(os.path.join(directory, segment), "ab") as f:
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    entry = {
+        "first": messages[0]["id"], "last": messages[-1]["id"], "count": len(messages),
+        "segment": segment, "offset": offset, "length": len(data),
+    }
+    index_path = os.path.join(directory, "index")
+    _drop_torn_line(index_path)
+    with open(index_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _drop_torn_line(path: str):
+    """Cut a partial last line (crash mid-append) so the next entry starts on its own line."""
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            chunk = f.read(end - start)
+            if end == size and chunk.endswith(b"\n"):
+                return
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def drop_segments(before: str) -> int:
+    """
+    Delete whole segments older than period `before` ("YYYY-MM") and their
+    index entries. Returns the number of segment files removed.
+    """
+    removed = 0
+    if not os.path.isdir(ARCHIVE_DIR):
+        return 0
+    for name in os.listdir(ARCHIVE_DIR):
+        if not name.isdigit():
+            continue
+        chat_id = int(name)
+        entries = load_index(chat_id)
+        old = {e["segment"] for e in entries if e["segment"][:-len(".seg")] < before}
+        if not old:
+            continue
+        directory = _chat_dir(chat_id)
+        keep = [e for e in entries if e["segment"] not in old]
+        tmp = os.path.join(directory, "index.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(e) + "\n" for e in keep)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(directory, "index"))
+        for segment in old:
+            try:
+                os.unlink(os.path.join(directory, segment))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+# ================== READ ==================
+
+def has_older(chat_id: int, before_id=None) -> bool:
+    """Whether archived messages older than before_id (any if None) exist."""
+    return any(before_id is None or e["first"] < before_id for e in load_index(chat_id))
+
+
+def _read_block(chat_id: int, entry: dict) -> list:
+    with open(os.path.join(_chat_dir(chat_id), entry["segment"]), "rb") as f:
+        f.seek(entry["offset"])
+        data = zlib.decompress(f.read(entry["length"]))
+    return [json.loads(line) for line in data.decode("utf-8").split("\n")]
+
+
+def page(chat_id: int, limit: int, before_id=None):
+    """
+    Archived messages older than before_id (all if None), newest first,
+    like fetch_messages: (messages, has_more).
+    """
+    entries = load_index(chat_id)
+    messages = []
+    for i in range(len(entries) - 1, -1, -1):
+        entry = entries[i]
+        if before_id is not None and entry["first"] >= before_id:
+            continue
+        block = _read_block(chat_id, entry)
+        for message in reversed(block):
+            if before_id is None or message["id"] < before_id:
+                messages.append(message)
+        if len(messages) > limit:
+            return messages[:limit], True
+        if len(messages) == limit:
+            return messages, i > 0
+    return messages, False
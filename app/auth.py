@@ -1,9 +1,20 @@
 # app/auth.py
 
-from app.db import get_connection
+from app.db import get_connection, IntegrityError
+from app.executor import run_db
+from app.config import TOKEN_CACHE_SIZE, HASH_WORKERS, HASH_MAX_PENDING, HASH_MAX_QUEUE
 from passlib.context import CryptContext
-from jose import jwt
+from jose import jwt, JWTError
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import hashlib
+import threading
+import time
 import platform
 
 SECRET_KEY = "CHANGE_THIS_SECRET_LATER"
@@ -29,7 +40,159 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def register_user(username, password, email=None):
+# ================== TOKEN CACHE ==================
+
+class TokenCache:
+    """
+    Bounded LRU of already verified JWTs, keyed by the token's SHA-256.
+    Entries die at the token's own `exp`, and the whole cache is dropped
+    when SECRET_KEY / ALGORITHM change, so a hit is exactly as valid as a
+    fresh jwt.decode() would be.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()   # digest -> (exp, payload)
+        self._signer = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, digest: bytes, signer):
+        with self._lock:
+            if signer != self._signer:
+                self._entries.clear()
+                self._signer = signer
+                self.stats["misses"] += 1
+                return None
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry[0] <= time.time():
+                del self._entries[digest]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, digest: bytes, signer, payload: dict):
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)):
+            return   # tokens without exp are never cached
+        with self._lock:
+            if signer != self._signer:
+                self._entries.clear()
+                self._signer = signer
+            self._entries[digest] = (exp, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+def decode_token(token: str) -> dict:
+    """
+    jwt.decode با cache؛ مثل jwt.decode در صورت نامعتبر بودن JWTError می‌دهد
+    """
+    signer = (SECRET_KEY, ALGORITHM)
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest, signer)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(digest, signer, payload)
+    # callers get their own copy, the cached one stays untouched
+    return dict(payload)
+
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+    """FastAPI dependency: payload توکن معتبر یا 401 (async تا در threadpool اجرا نشود)"""
+    try:
+        return decode_token(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+# ================== PASSWORD HASHING POOL ==================
+# pbkdf2 is pure CPU: it runs in separate processes so logins scale with
+# cores and never hold the GIL of the event loop process. At most
+# HASH_MAX_PENDING hashes are submitted at once; later logins wait their
+# turn (queue time is recorded) and past HASH_MAX_QUEUE waiting they get 503.
+
+_hash_pool = None
+_hash_slots = asyncio.Semaphore(HASH_MAX_PENDING)
+hash_stats = {
+    "submitted": 0,
+    "rejected": 0,
+    "waiting": 0,
+    "queue_time_total": 0.0,
+    "queue_time_max": 0.0,
+    "hash_time_total": 0.0,
+    "hash_time_max": 0.0,
+}
+
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        # spawn: forking a process that already runs executor threads is unsafe
+        _hash_pool = ProcessPoolExecutor(
+            max_workers=HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _hash_pool
+
+
+async def run_hash(func, *args):
+    if hash_stats["waiting"] >= HASH_MAX_QUEUE:
+        hash_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Server busy, try again")
+
+    enqueued = time.monotonic()
+    hash_stats["waiting"] += 1
+    try:
+        await _hash_slots.acquire()
+    finally:
+        hash_stats["waiting"] -= 1
+
+    try:
+        started = time.monotonic()
+        waited = started - enqueued
+        hash_stats["submitted"] += 1
+        hash_stats["queue_time_total"] += waited
+        hash_stats["queue_time_max"] = max(hash_stats["queue_time_max"], waited)
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_get_hash_pool(), func, *args)
+
+        elapsed = time.monotonic() - started
+        hash_stats["hash_time_total"] += elapsed
+        hash_stats["hash_time_max"] = max(hash_stats["hash_time_max"], elapsed)
+        return result
+    finally:
+        _hash_slots.release()
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+
+# ================== USERS ==================
+
+def find_existing_user(username, email=None):
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
@@ -45,41 +208,58 @@ def register_user(username, password, email=None):
                     "SELECT id FROM users WHERE username=%s",
                     (username,)
                 )
+            return cursor.fetchone()
+    finally:
+        conn.close()
 
-            if cursor.fetchone():
-                return False, "Username or email exists"
-
-            hashed = hash_password(password)
 
-            # 🔑 اگر ایمیل خالی است، None (NULL) ذخیره کن
-            email_value = email if email else None
+def insert_user(username, email, hashed) -> bool:
+    # 🔑 اگر ایمیل خالی است، None (NULL) ذخیره کن
+    email_value = email if email else None
 
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
             cursor.execute(
                 "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
                 (username, email_value, hashed)
             )
             conn.commit()
-
+    except IntegrityError:
+        # registered concurrently between the check and the insert
+        return False
     finally:
         conn.close()
-
-    return True, "Registered"
-
+    return True
 
 
-def authenticate_user(username, password):
+def get_password_hash(username):
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("SELECT id, password FROM users WHERE username=%s", (username,))
-            row = cursor.fetchone()
+            return cursor.fetchone()
     finally:
         conn.close()
 
+
+async def register_user(username, password, email=None):
+    if await run_db(find_existing_user, username, email):
+        return False, "Username or email exists"
+
+    hashed = await run_hash(hash_password, password)
+
+    if not await run_db(insert_user, username, email, hashed):
+        return False, "Username or email exists"
+    return True, "Registered"
+
+
+async def authenticate_user(username, password):
+    row = await run_db(get_password_hash, username)
     if not row:
         return None
 
     user_id, hashed = row
-    if verify_password(password, hashed):
+    if await run_hash(verify_password, password, hashed):
         return user_id
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,219 @@
+# app/blobs.py
+"""
+Content-addressed storage behind the `files` table.
+
+Every upload is hashed (keyed BLAKE2b of the plaintext, see
+file_crypto.keyed_digest) before it is encrypted. A `blobs` row holds one
+encrypted copy per (digest, key_id) plus a refcount; each `files` row
+(one per upload, with its own name and mime type) points at a blob. A
+duplicate upload only adds a files row and bumps the refcount: nothing is
+written to disk.
+
+The digest is keyed with a secret derived from SECRET_KEY, so it says
+nothing about the content to someone who only sees the database. A blob
+written under an older key is shared too: the key ring can still read it,
+and app/reencrypt.py moves it onto the current key in the background.
+
+Where a blob lives and which key opens it (enc_path, key_id) is only ever
+read from the blobs row: the re-encrypt job changes both, and a copy in a
+files row could go stale. files.enc_path / files.key_id are left from
+before blobs and no longer used.
+
+Blobs are released by release_files(): a blob whose refcount reaches zero
+is deleted in the same transaction and its path (and its thumbnail's, see
+app/thumbnails.py) returned, for the caller to unlink after the commit.
+"""
+from app.db import get_connection, IntegrityError
+
+
+def find_blob(cursor, digest: str):
+    # newest copy first: after a key rotation that is the re-encrypted one
+    cursor.execute(
+        "SELECT id FROM blobs WHERE digest=%s ORDER BY id DESC LIMIT 1",
+        (digest,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def add_file(file_id, original_name, mime_type, digest: str):
+    """
+    Reference an existing blob from a new files row.
+    Returns False when there is no live blob with this digest (upload it).
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            blob_id = find_blob(cursor, digest)
+            if blob_id is None:
+                return False
+            # refcount 0 = being evicted right now; upload a fresh copy instead
+            cursor.execute("UPDATE blobs SET refcount = refcount + 1 WHERE id=%s AND refcount > 0", (blob_id,))
+            if cursor.rowcount != 1:
+                conn.rollback()
+                return False
+            insert_file_row(cursor, file_id, original_name, mime_type, blob_id)
+            conn.commit()
+            return True
+    finally:
+        conn.close()
+
+
+def add_blob(file_id, original_name, mime_type, digest: str, key_id: int, enc_path: str, size_bytes: int):
+    """
+    Store a freshly encrypted blob and its first files row; returns the blob id.
+    Returns None if a concurrent upload of the same content won the race;
+    the caller then removes enc_path and uses add_file().
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("""
+                    INSERT INTO blobs (digest, key_id, enc_path, size_bytes, refcount)
+                    VALUES (%s, %s, %s, %s, 1)
+                """, (digest, key_id, enc_path, size_bytes))
+            except IntegrityError:
+                conn.rollback()
+                return None
+            blob_id = cursor.lastrowid
+            insert_file_row(cursor, file_id, original_name, mime_type, blob_id, size_bytes)
+            conn.commit()
+            return blob_id
+    finally:
+        conn.close()
+
+
+def insert_file_row(cursor, file_id, original_name, mime_type, blob_id, size_bytes=0):
+    # size_bytes is only set on the row that created the blob; usage is summed from blobs.
+    # enc_path is NOT NULL from before blobs existed; the path is the blob's
+    cursor.execute("""
+        INSERT INTO files (id, original_name, mime_type, enc_path, blob_id, size_bytes, last_accessed_at)
+        VALUES (%s, %s, %s, '', %s, %s, CURRENT_TIMESTAMP)
+    """, (file_id, original_name, mime_type, blob_id, size_bytes))
+
+
+def set_file_key(file_id: str, key_id: int):
+    """Record the key found for an upload from before key_id was tracked."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE blobs SET key_id=%s
+                WHERE id = (SELECT blob_id FROM files WHERE id=%s) AND key_id IS NULL
+            """, (key_id, file_id))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+# ================== KEY ROTATION ==================
+
+def blobs_to_reencrypt(current_key_id: int, limit: int, skip=()):
+    """Blobs written under an older (or unknown) key: [(id, enc_path, key_id), ...]"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, enc_path, key_id FROM blobs
+                WHERE key_id IS NULL OR key_id <> %s
+                ORDER BY id
+                LIMIT %s
+            """, (current_key_id, limit + len(skip)))
+            return [row for row in cursor.fetchall() if row[0] not in skip][:limit]
+    finally:
+        conn.close()
+
+
+def move_blob(blob_id: int, old_path: str, new_path: str, key_id: int, size_bytes: int) -> list:
+    """
+    Point a blob at its re-encrypted copy. Returns the
+    paths that are no longer referenced: old_path once moved, new_path if
+    the blob went away meanwhile. If the same content already exists under
+    key_id, the two blobs are merged into that one. The thumbnail is
+    dropped too; it is rendered again under the current key when asked for.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT thumb_path FROM blobs WHERE id=%s AND enc_path=%s", (blob_id, old_path))
+            row = cursor.fetchone()
+            thumb = [row[0]] if row and row[0] else []
+            try:
+                cursor.execute("""
+                    UPDATE blobs SET key_id=%s, enc_path=%s, size_bytes=%s,
+                        thumb_path=NULL, thumb_key_id=NULL, thumb_mime=NULL
+                    WHERE id=%s AND enc_path=%s
+                """, (key_id, new_path, size_bytes, blob_id, old_path))
+            except IntegrityError:
+                conn.rollback()
+                return _merge_blob(conn, cursor, blob_id, old_path, new_path, key_id) + thumb
+            if cursor.rowcount != 1:
+                # evicted (or already moved) while it was being re-encrypted
+                conn.rollback()
+                return [new_path]
+            conn.commit()
+            return [old_path] + thumb
+    finally:
+        conn.close()
+
+
+def _merge_blob(conn, cursor, blob_id, old_path, new_path, key_id):
+    cursor.execute("SELECT digest, refcount FROM blobs WHERE id=%s AND enc_path=%s", (blob_id, old_path))
+    row = cursor.fetchone()
+    if not row:
+        return [new_path]
+    digest, refcount = row
+    cursor.execute("SELECT id FROM blobs WHERE digest=%s AND key_id=%s", (digest, key_id))
+    target = cursor.fetchone()
+    if not target:
+        # the other copy went away too; try again next round
+        return [new_path]
+    target_id = target[0]
+    cursor.execute("UPDATE files SET blob_id=%s WHERE blob_id=%s", (target_id, blob_id))
+    cursor.execute("UPDATE blobs SET refcount = refcount + %s WHERE id=%s", (refcount, target_id))
+    cursor.execute("DELETE FROM blobs WHERE id=%s", (blob_id,))
+    conn.commit()
+    return [old_path, new_path]
+
+
+def release_files(cursor, file_ids: list):
+    """
+    Delete files rows and drop their blob references, inside the caller's
+    transaction. Returns [(enc_path, size_bytes), ...] of blobs that are no
+    longer referenced, to unlink once the transaction is committed.
+    """
+    if not file_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(file_ids))
+    cursor.execute(f"SELECT blob_id FROM files WHERE id IN ({placeholders})", file_ids)
+    refs = {}
+    for (blob_id,) in cursor.fetchall():
+        if blob_id is not None:
+            refs[blob_id] = refs.get(blob_id, 0) + 1
+    cursor.execute(f"DELETE FROM files WHERE id IN ({placeholders})", file_ids)
+    if not refs:
+        return []
+
+    for blob_id, count in refs.items():
+        cursor.execute("UPDATE blobs SET refcount = refcount - %s WHERE id=%s", (count, blob_id))
+    blob_ids = list(refs)
+    placeholders = ", ".join(["%s"] * len(blob_ids))
+    cursor.execute(
+        f"SELECT id, enc_path, size_bytes, thumb_path FROM blobs WHERE id IN ({placeholders}) AND refcount <= 0",
+        blob_ids
+    )
+    dead = cursor.fetchall()
+    if dead:
+        placeholders = ", ".join(["%s"] * len(dead))
+        cursor.execute(f"DELETE FROM blobs WHERE id IN ({placeholders})", [row[0] for row in dead])
+    # thumbnails are not counted in size_bytes
+    unused = [(enc_path, size_bytes) for _, enc_path, size_bytes, _ in dead]
+    unused += [(thumb_path, 0) for _, _, _, thumb_path in dead if thumb_path]
+    return unused
+
+
+def stored_bytes(cursor) -> int:
+    """Bytes on disk for all uploads: each blob counted once."""
+    cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM blobs")
+    return int(cursor.fetchone()[0])
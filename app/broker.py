@@ -0,0 +1,448 @@
+# app/broker.py
+"""
+Pub/sub between uvicorn workers (and nodes) for chat messages and presence.
+
+    memory://                      single process (default)
+    unix:///run/mapsim_chat.sock   several workers on one box
+    redis://[:password@]host:port  several boxes (any Redis-protocol server)
+
+publish() delivers to every subscriber of the channel on every node,
+including the publishing one. Local subscribers are called directly; other
+nodes get the message through the backend and skip the copies they sent.
+
+incr() is a counter shared by all nodes (message seq numbers): Redis runs
+it as a script, the unix socket hub answers it from memory.
+"""
+import asyncio
+import json
+import os
+import uuid
+from urllib.parse import urlparse
+
+from app.config import BROKER_URL
+
+CHANNEL_PREFIX = "mapsim:"
+MAX_FRAME = 4 * 1024 * 1024
+# seconds to wait for the hub to answer an incr()
+INCR_TIMEOUT = 2.0
+# hub: a worker with this much unsent is dropped (it reconnects) rather
+# than buffered without limit
+MAX_PEER_BUFFER = 16 * MAX_FRAME
+
+
+class Broker:
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._handlers = {}
+        self.stats = {"published": 0, "received": 0, "handler_errors": 0, "reconnects": 0}
+
+    def subscribe(self, channel: str, handler):
+        """handler: async def handler(message: dict)"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    @property
+    def channels(self):
+        return list(self._handlers)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: dict):
+        self.stats["published"] += 1
+        await self._send(self._encode(channel, message))
+        await self._dispatch(channel, message)
+
+    async def incr(self, name: str, floor: int) -> int:
+        """
+        max(counter, floor) + 1, stored back, atomically across nodes.
+        `floor` is the highest number the caller knows was handed out, so a
+        counter lost with its backend (restart, hub failover) resumes past it.
+        Raises ConnectionError when the backend cannot answer.
+        """
+        raise ConnectionError("No shared counters on this broker")
+
+    # ---------- backend hooks ----------
+    async def _send(self, frame: bytes):
+        """Hand an encoded frame to the other nodes."""
+
+    # ---------- helpers ----------
+    def _encode(self, channel: str, message: dict) -> bytes:
+        return json.dumps({"o": self.node_id, "c": channel, "m": message}).encode()
+
+    async def _receive(self, frame: bytes):
+        try:
+            envelope = json.loads(frame)
+        except ValueError:
+            return
+        await self._deliver(envelope)
+
+    async def _deliver(self, envelope: dict):
+        if envelope.get("o") == self.node_id:
+            return
+        self.stats["received"] += 1
+        await self._dispatch(envelope.get("c"), envelope.get("m"))
+
+    async def _dispatch(self, channel, message):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                print(f"[BROKER] Handler for {channel} failed: {e}")
+
+
+class InMemoryBroker(Broker):
+    """Single process: publish() is just a local dispatch."""
+
+
+# ================== UNIX SOCKET ==================
+
+class UnixSocketBroker(Broker):
+    """
+    Workers on one machine. Whichever worker holds the flock on
+    `<path>.lock` runs a small hub on the Unix socket and relays every frame
+    to all other connected workers; the rest connect to it. If the hub
+    worker dies its lock is released and another worker takes over.
+    Frames are newline-delimited JSON. incr() requests ("q") are answered
+    by the hub to the asking worker only ("r"), never relayed.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock_fd = None
+        self._server = None
+        self._peers = set()          # hub: writers of connected workers
+        self._writer = None          # client: connection to the hub
+        self._task = None
+        self._ready = asyncio.Event()
+        self._counters = {}          # hub: name -> last value handed out
+        self._requests = {}          # client: request id -> Future
+        self.stats["slow_peers"] = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), 5)
+        except asyncio.TimeoutError:
+            print("[BROKER] Unix socket hub not reachable yet, retrying in background")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            self._writer.close()
+        for peer in list(self._peers):
+            peer.close()
+        if self._server:
+            self._server.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _send(self, frame: bytes):
+        line = frame + b"\n"
+        if self._server is not None:
+            self._relay(line, exclude=None)
+        elif self._writer is not None:
+            try:
+                self._writer.write(line)
+                await self._writer.drain()
+            except (ConnectionError, RuntimeError):
+                pass
+
+    async def incr(self, name: str, floor: int) -> int:
+        if self._server is not None:
+            return self._count(name, floor)
+        if self._writer is None:
+            raise ConnectionError("Not connected to the hub")
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+        try:
+            self._writer.write(json.dumps({"q": request_id, "n": name, "f": floor}).encode() + b"\n")
+            await self._writer.drain()
+            return await asyncio.wait_for(future, INCR_TIMEOUT)
+        except (RuntimeError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"Hub did not answer: {e!r}")
+        finally:
+            self._requests.pop(request_id, None)
+
+    def _count(self, name: str, floor: int) -> int:
+        value = self._counters[name] = max(self._counters.get(name, 0), floor) + 1
+        return value
+
+    async def _deliver(self, envelope: dict):
+        if "r" in envelope:
+            future = self._requests.get(envelope["r"])
+            if future is not None and not future.done():
+                future.set_result(envelope["v"])
+            return
+        await super()._deliver(envelope)
+
+    # ---------- hub election / client loop ----------
+    def _try_become_hub(self) -> bool:
+        import fcntl  # POSIX only, like Unix sockets themselves
+
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self):
+        delay = 0.1
+        while True:
+            if self._lock_fd is None and self._try_become_hub():
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self._server = await asyncio.start_unix_server(self._serve_peer, self.path, limit=MAX_FRAME)
+                os.chmod(self.path, 0o600)
+                self._ready.set()
+                await self._server.serve_forever()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+
+            delay = 0.1
+            self._writer = writer
+            self._ready.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self._receive(line)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                pass
+            self._writer = None
+            self.stats["reconnects"] += 1
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Hub connection lost"))
+
+    # ---------- hub side ----------
+    def _relay(self, line: bytes, exclude):
+        # write() never waits: a worker that stops reading only grows its own
+        # buffer, and past MAX_PEER_BUFFER it is disconnected (like a slow
+        # websocket in fanout.py)
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                self.stats["slow_peers"] += 1
+                print("[BROKER] Dropping a worker that is not reading the hub")
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            try:
+                peer.write(line)
+            except (ConnectionError, RuntimeError):
+                self._peers.discard(peer)
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    envelope = json.loads(line)
+                except ValueError:
+                    continue
+                if "q" in envelope:
+                    value = self._count(envelope["n"], envelope["f"])
+                    writer.write(json.dumps({"r": envelope["q"], "v": value}).encode() + b"\n")
+                    continue
+                self._relay(line, exclude=writer)
+                await self._deliver(envelope)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+# ================== REDIS (RESP) ==================
+
+def _resp_command(*parts) -> bytes:
+    out = [b"*%d\r\n" % len(parts)]
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(part), part))
+    return b"".join(out)
+
+
+async def _resp_read(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Redis connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise RuntimeError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _resp_read(reader) for _ in range(length)]
+    raise ValueError(f"Bad RESP reply: {line!r}")
+
+
+# max(counter, floor) + 1, see Broker.incr
+_INCR_SCRIPT = """
+local value = redis.call('INCR', KEYS[1])
+local floor = tonumber(ARGV[1])
+if value <= floor then
+    value = floor + 1
+    redis.call('SET', KEYS[1], value)
+end
+return value
+"""
+
+
+class RedisBroker(Broker):
+    """
+    Any Redis-protocol server (Redis, KeyDB, Valkey, ...). One connection for
+    PUBLISH, one for SUBSCRIBE; both reconnect on failure. No client library
+    needed, the handful of RESP commands is spoken directly.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self._pub = None
+        self._pub_lock = asyncio.Lock()
+        self._task = None
+        self._ready = asyncio.Event()
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_FRAME)
+        if self.password:
+            writer.write(_resp_command("AUTH", self.password))
+            await _resp_read(reader)
+        return reader, writer
+
+    async def start(self):
+        self._task = asyncio.create_task(self._subscribe_loop())
+        try:
+            await asyncio.wait_for(self._ready.wait(), 5)
+        except asyncio.TimeoutError:
+            print(f"[BROKER] Redis {self.host}:{self.port} not reachable yet, retrying in background")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pub:
+            self._pub[1].close()
+            self._pub = None
+
+    async def _send(self, frame: bytes):
+        channel = CHANNEL_PREFIX + "bus"
+        async with self._pub_lock:
+            for attempt in range(2):
+                try:
+                    if self._pub is None:
+                        self._pub = await self._open()
+                    reader, writer = self._pub
+                    writer.write(_resp_command("PUBLISH", channel, frame))
+                    await writer.drain()
+                    await _resp_read(reader)
+                    return
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, RuntimeError, ValueError) as e:
+                    # RuntimeError: an -ERR reply (e.g. NOAUTH after a Redis
+                    # restart); reconnect like for a dropped connection
+                    if self._pub:
+                        self._pub[1].close()
+                    self._pub = None
+                    if attempt:
+                        print(f"[BROKER] Redis publish failed ({e!r}), message delivered locally only")
+
+    async def incr(self, name: str, floor: int) -> int:
+        async with self._pub_lock:
+            try:
+                if self._pub is None:
+                    self._pub = await self._open()
+                reader, writer = self._pub
+                writer.write(_resp_command("EVAL", _INCR_SCRIPT, "1", CHANNEL_PREFIX + name, str(floor)))
+                await writer.drain()
+                return await _resp_read(reader)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                if self._pub:
+                    self._pub[1].close()
+                self._pub = None
+                raise ConnectionError(f"Redis incr failed: {e!r}")
+            except RuntimeError as e:
+                # -ERR reply (e.g. scripting disabled): the connection itself is fine
+                raise ConnectionError(f"Redis incr failed: {e}")
+
+    async def _subscribe_loop(self):
+        delay = 0.1
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._open()
+                writer.write(_resp_command("SUBSCRIBE", CHANNEL_PREFIX + "bus"))
+                await writer.drain()
+                await _resp_read(reader)   # subscribe confirmation
+                self._ready.set()
+                delay = 0.1
+                while True:
+                    reply = await _resp_read(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        await self._receive(reply[2])
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, RuntimeError, ValueError):
+                self.stats["reconnects"] += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+
+# ================== FACTORY ==================
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InMemoryBroker()
+    if scheme == "unix":
+        return UnixSocketBroker(urlparse(url).path)
+    if scheme == "redis":
+        return RedisBroker(url)
+    raise RuntimeError(f"Unsupported BROKER_URL: {url}")
+
+
+broker = create_broker()
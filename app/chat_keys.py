@@ -1,8 +1,15 @@
 # app/chat_keys.py
 import os
 import base64
+import hashlib
+import multiprocessing
+import socket
+import threading
+from datetime import datetime
+from nacl.exceptions import CryptoError
 from nacl.secret import SecretBox
-from app.db import get_connection
+from app.config import DEPLOY_ID
+from app.db import get_connection, IntegrityError
 
 # -----------------------------
 # MASTER_KEY باید در env باشد
@@ -12,19 +19,8 @@ if not MASTER_KEY_B64:
     raise RuntimeError("SECRET_KEY is not set")
 MASTER_KEY = base64.b64decode(MASTER_KEY_B64)
 
-# -----------------------------
-# ایجاد جدول key_versions اگر وجود ندارد
-# -----------------------------
-with get_connection() as conn:
-    with conn.cursor() as cursor:
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS key_versions (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            enc_key LONGBLOB NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        conn.commit()
+# کلید هش deduplication فایل‌ها (ثابت بین ریست‌ها، جدا از MASTER_KEY)
+FILE_DEDUP_KEY = hashlib.blake2b(MASTER_KEY, digest_size=32, person=b"mapsim-dedup").digest()
 
 # -----------------------------
 # تولید GLOBAL_KEY جدید (runtime)
@@ -36,7 +32,7 @@ def generate_global_key() -> bytes:
 # -----------------------------
 # ذخیره GLOBAL_KEY رمزگذاری شده
 # -----------------------------
-def store_key_version(global_key: bytes) -> int:
+def store_key_version(global_key: bytes, deploy_id: str = None) -> int:
     """GLOBAL_KEY را رمزگذاری و در جدول ثبت می‌کند"""
     box = SecretBox(MASTER_KEY)
     enc = box.encrypt(global_key)
@@ -44,12 +40,44 @@ def store_key_version(global_key: bytes) -> int:
     with get_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO key_versions(enc_key) VALUES (%s)",
-                (enc_bytes,)
+                "INSERT INTO key_versions(enc_key, deploy_id) VALUES (%s, %s)",
+                (enc_bytes, deploy_id)
             )
             conn.commit()  # مطمئن شو commit واقعی انجام می‌شود
             return cursor.lastrowid
 
+
+def find_deploy_key(deploy_id: str):
+    """key_versions id of the key another worker of this deploy already created, or None"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM key_versions WHERE deploy_id=%s", (deploy_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+
+def _start_time(pid: int) -> str:
+    """process start time (clock ticks since boot) on Linux, '' elsewhere"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return f.read().rsplit(b")", 1)[1].split()[19].decode()
+    except (OSError, IndexError):
+        return ""
+
+
+def current_deploy_id():
+    """
+    Identity shared by the workers of one server start: DEPLOY_ID if set,
+    else the uvicorn master (parent pid + start time) for a spawned worker.
+    A single process gets None: a new key on every start, as before.
+    """
+    if DEPLOY_ID:
+        return DEPLOY_ID
+    if multiprocessing.parent_process() is None:
+        return None
+    ppid = os.getppid()
+    return f"{socket.gethostname()}:{ppid}:{_start_time(ppid)}"
+
 # -----------------------------
 # بارگذاری آخرین GLOBAL_KEY
 # -----------------------------
@@ -68,18 +96,170 @@ def load_latest_global_key() -> bytes:
     return None
 
 # -----------------------------
-# GLOBAL_KEY runtime جدید برای کاربران
+# Key ring: همه نسخه‌های کلید، در حافظه
 # -----------------------------
-# همیشه یک کلید جدید بساز (برای هر ریست سرور)
-GLOBAL_CHAT_KEY = generate_global_key()
+class KeyRing:
+    """
+    Every key in key_versions, decrypted with MASTER_KEY once and kept in
+    memory, so files written under an earlier key (before a restart, or by
+    another worker) stay readable. Keys are loaded incrementally: an id this
+    process has not seen yet triggers one query for the newer rows.
 
-# ذخیره GLOBAL_KEY جدید در key_versions
-new_key_id = store_key_version(GLOBAL_CHAT_KEY)
+    `current` is this session's key: new uploads are encrypted with it and
+    it is what /chat/key hands out. All workers of one deploy use the same
+    one (clients on different workers read each other's messages); the
+    worker that created it (`owner`) runs the re-encryption job.
+    """
+
+    def __init__(self, master_key: bytes):
+        self._master = SecretBox(master_key)
+        self._keys = {}    # key_id -> 32 byte key
+        self._boxes = {}   # key_id -> SecretBox (legacy single-blob files)
+        self._lock = threading.Lock()
+        self._loaded_upto = 0   # highest key_versions id read by load()
+        self.current_id = None
+        self.owner = False
+
+    @property
+    def current(self) -> bytes:
+        return self._keys[self.current_id]
+
+    def start(self) -> int:
+        """
+        برای هر ریست سرور یک کلید جدید؛ workerهای یک deploy همان یک کلید را
+        به اشتراک می‌گذارند (اولی می‌سازد، بقیه از جدول می‌خوانند)
+        """
+        deploy_id = current_deploy_id()
+        key_id = find_deploy_key(deploy_id) if deploy_id else None
+        if key_id is None:
+            key = generate_global_key()
+
+            # محافظ حرفه‌ای
+            assert isinstance(key, (bytes, bytearray))
+            assert len(key) == 32
+
+            try:
+                key_id = store_key_version(key, deploy_id)
+                self.owner = True
+                with self._lock:
+                    self._keys[key_id] = key
+            except IntegrityError:
+                # another worker of this deploy stored its key first
+                key_id = find_deploy_key(deploy_id)
+
+        self.load()
+        self.get(key_id)
+        self.current_id = key_id
+        action = "generated and stored" if self.owner else "shared"
+        print(f"✅ GLOBAL_CHAT_KEY {action} (id={key_id}) for this session, {len(self._keys)} keys loaded")
+        return key_id
+
+    def load(self):
+        """key_versions rows newer than the ones already in memory"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, enc_key FROM key_versions WHERE id > %s ORDER BY id",
+                    (self._loaded_upto,)
+                )
+                rows = cursor.fetchall()
+        with self._lock:
+            for key_id, enc_key in rows:
+                self._loaded_upto = max(self._loaded_upto, key_id)
+                if key_id in self._keys:
+                    continue
+                try:
+                    self._keys[key_id] = self._master.decrypt(bytes(enc_key))
+                except CryptoError:
+                    # written under another SECRET_KEY; never readable here
+                    print(f"⚠️ key_versions id={key_id} cannot be decrypted with SECRET_KEY")
+
+    def get(self, key_id: int) -> bytes:
+        key = self._keys.get(key_id)
+        if key is None:
+            self.load()
+            key = self._keys.get(key_id)
+            if key is None:
+                raise KeyError(f"Unknown key version {key_id}")
+        return key
+
+    def box(self, key_id: int) -> SecretBox:
+        box = self._boxes.get(key_id)
+        if box is None:
+            box = self._boxes[key_id] = SecretBox(self.get(key_id))
+        return box
+
+    def is_newest(self) -> bool:
+        """
+        Whether this process created the latest key in key_versions (no
+        deploy started after us, and not one of the workers sharing it).
+        """
+        if not self.owner:
+            return False
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT MAX(id) FROM key_versions")
+                return cursor.fetchone()[0] == self.current_id
+
+    def forget(self, key_ids):
+        """drop retired key versions (retire_unused_keys) from memory"""
+        with self._lock:
+            for key_id in key_ids:
+                self._keys.pop(key_id, None)
+                self._boxes.pop(key_id, None)
+
+    def ids(self) -> list:
+        """newest first"""
+        return sorted(self._keys, reverse=True)
+
+    def stats(self) -> dict:
+        return {"keys": len(self._keys), "boxes": len(self._boxes), "current_id": self.current_id or 0}
+
+
+key_ring = KeyRing(MASTER_KEY)
+
+
+def _as_datetime(value):
+    # SQLite hands timestamps back as text
+    return datetime.fromisoformat(str(value)) if not isinstance(value, datetime) else value
+
+
+def retire_unused_keys(current_key_id: int, min_age: float) -> list:
+    """
+    Delete key versions older than current_key_id that no blob (or
+    thumbnail) is encrypted with any more, once the key that replaced them
+    is `min_age` seconds old: by then no worker of an older deploy should
+    still be writing with them. Nothing is retired while an upload of
+    unknown key (blobs.key_id NULL) is left, since any key may open it.
+    Returns the retired ids.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM blobs WHERE key_id IS NULL LIMIT 1")
+            if cursor.fetchone():
+                return []
+            cursor.execute("SELECT CURRENT_TIMESTAMP")
+            now = _as_datetime(cursor.fetchone()[0])
+            cursor.execute("SELECT id, created_at FROM key_versions WHERE id <= %s ORDER BY id", (current_key_id,))
+            versions = cursor.fetchall()
+            cursor.execute("SELECT key_id FROM blobs UNION SELECT thumb_key_id FROM blobs")
+            used = {row[0] for row in cursor.fetchall()}
+
+            retired = []
+            for (key_id, _), (_, replaced_at) in zip(versions, versions[1:]):
+                if key_id in used or (min_age > 0 and (now - _as_datetime(replaced_at)).total_seconds() < min_age):
+                    continue
+                retired.append(key_id)
+            if retired:
+                placeholders = ", ".join(["%s"] * len(retired))
+                cursor.execute(f"DELETE FROM key_versions WHERE id IN ({placeholders})", retired)
+                conn.commit()
+            return retired
 
-# -----------------------------
-# محافظ حرفه‌ای
-# -----------------------------
-assert isinstance(GLOBAL_CHAT_KEY, (bytes, bytearray))
-assert len(GLOBAL_CHAT_KEY) == 32
 
-print(f"✅ GLOBAL_CHAT_KEY generated and stored (id={new_key_id}) for this session")
+def start_session_key() -> int:
+    """
+    Called once per process from the app's lifespan; the table itself is
+    created with the rest of the schema (create_db.py).
+    """
+    return key_ring.start()
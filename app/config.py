@@ -9,6 +9,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # لود فایل .env
 load_dotenv(BASE_DIR / ".env")
 
+# ======================
+# Storage backend
+# ======================
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()   # mysql | sqlite
+
+if DB_BACKEND not in ("mysql", "sqlite"):
+    raise RuntimeError(f"Unsupported DB_BACKEND: {DB_BACKEND}")
+
 # ======================
 # تنظیمات دیتابیس MySQL
 # ======================
@@ -18,9 +26,99 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-if not all([DB_HOST, DB_NAME, DB_USER, DB_PASS]):
+if DB_BACKEND == "mysql" and not all([DB_HOST, DB_NAME, DB_USER, DB_PASS]):
     raise RuntimeError("Database configuration is missing in .env")
 
+# ======================
+# SQLite (DB_BACKEND=sqlite, single machine)
+# ======================
+SQLITE_PATH = os.getenv("SQLITE_PATH", str(BASE_DIR / "data" / "mapsim_chat.db"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()  # NORMAL: fsync at checkpoints only
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", 256))                  # memory-mapped reads
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))  # wait for other processes' writes
+
+# ======================
+# Connection pool
+# ======================
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", 3600))  # max connection lifetime (seconds)
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300))  # close extra idle connections after
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", 30))  # ping on checkout if idle longer than
+
+# ======================
+# Executors (blocking work off the event loop)
+# ======================
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", DB_POOL_MAX_SIZE))
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", 8))
+EXECUTOR_MAX_PENDING = int(os.getenv("EXECUTOR_MAX_PENDING", 256))
+
+# ======================
+# Message write-behind
+# ======================
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 200))
+MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", 50))
+MESSAGE_QUEUE_MAX = int(os.getenv("MESSAGE_QUEUE_MAX", 10000))
+MESSAGE_FLUSH_MAX_ATTEMPTS = int(os.getenv("MESSAGE_FLUSH_MAX_ATTEMPTS", 8))   # then the batch is dead-lettered
+MESSAGE_STOP_TIMEOUT = float(os.getenv("MESSAGE_STOP_TIMEOUT", 30))            # seconds to drain at shutdown
+MESSAGE_DEAD_LETTER_FILE = os.getenv("MESSAGE_DEAD_LETTER_FILE", "dead_letter_messages.jsonl")
+MESSAGE_MAX_BYTES = int(os.getenv("MESSAGE_MAX_BYTES", 65535))                 # messages.content is TEXT
+
+# ======================
+# Broadcast fanout
+# ======================
+FANOUT_QUEUE_MAX = int(os.getenv("FANOUT_QUEUE_MAX", 256))          # outbound frames per connection
+FANOUT_SLOW_POLICY = os.getenv("FANOUT_SLOW_POLICY", "disconnect")  # disconnect | drop
+
+# ======================
+# Cross-worker pub/sub
+# ======================
+# memory:// | unix:///run/mapsim_chat.sock | redis://[:password@]host:6379
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", 15))
+
+# ======================
+# Presence updates
+# ======================
+PRESENCE_DEBOUNCE_MS = int(os.getenv("PRESENCE_DEBOUNCE_MS", 250))            # join/leave coalescing window
+PRESENCE_SNAPSHOT_INTERVAL = float(os.getenv("PRESENCE_SNAPSHOT_INTERVAL", 120))  # full list resend
+
+# ======================
+# Chat membership cache
+# ======================
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", 60))
+MEMBERSHIP_CACHE_MAX_CHATS = int(os.getenv("MEMBERSHIP_CACHE_MAX_CHATS", 10000))
+
+# ======================
+# History pagination (/messages/)
+# ======================
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", 50))
+MESSAGES_PAGE_MAX = int(os.getenv("MESSAGES_PAGE_MAX", 200))
+
+# ======================
+# Recent messages cache
+# ======================
+HISTORY_CACHE_PER_CHAT = int(os.getenv("HISTORY_CACHE_PER_CHAT", 500))  # newest messages kept per chat
+HISTORY_CACHE_MAX_MB = int(os.getenv("HISTORY_CACHE_MAX_MB", 64))       # all chats together
+
+# ======================
+# Websocket resume (?resume_from=<seq>)
+# ======================
+RESUME_BUFFER_PER_CHAT = int(os.getenv("RESUME_BUFFER_PER_CHAT", 256))     # recent frames kept per chat
+RESUME_BUFFER_MAX_CHATS = int(os.getenv("RESUME_BUFFER_MAX_CHATS", 2000))
+RESUME_MAX_REPLAY = int(os.getenv("RESUME_MAX_REPLAY", 500))               # beyond this (or FANOUT_QUEUE_MAX): full reload
+
+# ======================
+# Message retention (archive_messages.py)
+# ======================
+# older messages move out of the table into compressed segments (app/archive.py)
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", 0))   # 0 = keep all in the table
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", str(BASE_DIR / "archive"))
+ARCHIVE_KEEP_MONTHS = int(os.getenv("ARCHIVE_KEEP_MONTHS", 0))         # 0 = keep archived history forever
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 5000))                  # rows per delete transaction
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 3600))            # seconds between runs
+
 # ======================
 # مسیر آپلود فایل‌ها
 # ======================
@@ -31,16 +129,64 @@ else:  # VPS / Linux
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+UPLOAD_MAX_FILE_MB = int(os.getenv("UPLOAD_MAX_FILE_MB", 1024))  # 0 = unlimited
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", 64 * 1024))   # plaintext bytes per encrypted chunk
+
+# auto_clear_uploads.py: over UPLOAD_MAX_SIZE_GB, evict least recently used
+# files in batches until usage is back under the low-water mark
+UPLOAD_LOW_WATER_PERCENT = int(os.getenv("UPLOAD_LOW_WATER_PERCENT", 80))
+UPLOAD_EVICT_BATCH = int(os.getenv("UPLOAD_EVICT_BATCH", 200))              # files per delete transaction
+FILE_TOUCH_INTERVAL = int(os.getenv("FILE_TOUCH_INTERVAL", 3600))           # seconds between last_accessed_at updates
+
 # ======================
 # تنظیمات JWT
 # ======================
 SECRET_KEY = os.getenv("SECRET_KEY")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))  # verified tokens kept in memory
+
+# ======================
+# Download caching (/file/{id}): uploads never change
+# ======================
+FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", 31536000))  # seconds (1 year)
+FILE_META_CACHE_SIZE = int(os.getenv("FILE_META_CACHE_SIZE", 10000))  # files kept in memory
+FILE_META_CACHE_TTL = int(os.getenv("FILE_META_CACHE_TTL", 300))       # seconds; an evicted upload may still get a 304 this long
+
+# ======================
+# Image thumbnails (Pillow)
+# ======================
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", 320))                     # longest side, pixels
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", 2))
+THUMB_MAX_SOURCE_MB = int(os.getenv("THUMB_MAX_SOURCE_MB", 30))    # larger images get no thumbnail
+THUMB_MAX_PIXELS = int(os.getenv("THUMB_MAX_PIXELS", 50_000_000))  # decompression bomb guard
+
+# ======================
+# Key rotation: re-encrypt uploads onto the current key in the background
+# ======================
+KEY_REENCRYPT_BATCH = int(os.getenv("KEY_REENCRYPT_BATCH", 20))        # files per round, 0 = off
+KEY_REENCRYPT_INTERVAL = float(os.getenv("KEY_REENCRYPT_INTERVAL", 30))  # seconds between rounds
+KEY_RETIRE_AFTER_HOURS = float(os.getenv("KEY_RETIRE_AFTER_HOURS", 24))   # unused keys this long replaced are deleted
+# workers started together (uvicorn --workers) share one session key; set
+# DEPLOY_ID to share it across processes started some other way
+DEPLOY_ID = os.getenv("DEPLOY_ID")
+
+# ======================
+# Password hashing (process pool)
+# ======================
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 2))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", HASH_WORKERS * 2))  # submitted to the pool at once
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", 1000))                  # waiting logins before 503
 
 if not SECRET_KEY:
     raise RuntimeError("SECRET_KEY is not set in .env")
 
+# ======================
+# Server (python -m app.main / PyInstaller binary)
+# ======================
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+
 # ======================
 # حالت Debug
 # ======================
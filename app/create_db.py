@@ -1,9 +1,50 @@
 # app/create_db.py
 import mysql.connector
 from mysql.connector import errorcode
-from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from app.config import DB_BACKEND, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS, SQLITE_PATH
+
+# seconds a starting worker waits for another one's migration (online DDL on
+# a large table can take a while)
+STARTUP_MIGRATION_WAIT = 3600
+
+def schema_is_current() -> bool:
+    """
+    One query against schema_version instead of the DDL below on every
+    process start (and every worker): False if the database, the table or
+    the latest migration is missing.
+    """
+    from app.db import get_connection
+    from app.migrations import LATEST_VERSION, current_version
+
+    try:
+        conn = get_connection()
+    except Exception:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            return current_version(cursor) >= LATEST_VERSION
+    except Exception:
+        return False
+    finally:
+        conn.close()
+
 
 def create_database():
+    if schema_is_current():
+        print("✅ Database schema is current")
+        return
+
+    if DB_BACKEND == "sqlite":
+        # the tables are created when the file is opened; being embedded,
+        # it is also migrated right away instead of by a deploy step
+        from app.db import get_sqlite
+        from app.migrations import migrate
+
+        get_sqlite()
+        migrate()
+        print(f"✅ SQLite database is ready: {SQLITE_PATH}")
+        return
+
     try:
         conn = mysql.connector.connect(
             host=DB_HOST,
@@ -95,6 +136,15 @@ def create_database():
             print("Something is wrong with your username or password")
         else:
             print(err)
+        return
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    # the code expects the latest schema (messages.seq, blobs, ...): a fresh
+    # database or a deploy that skipped `python -m app.migrations` is brought
+    # up to date here. Other workers wait on the migration lock meanwhile,
+    # and the app only reports ready (/readyz) once this returns
+    from app.migrations import migrate
+    migrate(lock_timeout=STARTUP_MIGRATION_WAIT)
+
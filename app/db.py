@@ -1,9 +1,36 @@
 # app/db.py
+import threading
+import time
+from collections import deque
+
+import sqlite3
+
 import mysql.connector
 from mysql.connector import Error
-from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from app.metrics import db_query_seconds
+from app.config import (
+    DB_BACKEND, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_IDLE_TIMEOUT, DB_POOL_PING_INTERVAL,
+    SQLITE_PATH, SQLITE_SYNCHRONOUS, SQLITE_MMAP_MB, SQLITE_BUSY_TIMEOUT_MS,
+)
 
-def get_connection():
+# "mysql" or "sqlite"; the few statements that differ between them check this
+DIALECT = DB_BACKEND
+
+# duplicate key etc., whichever backend is in use
+IntegrityError = (mysql.connector.IntegrityError, sqlite3.IntegrityError)
+
+# the database refuses the row itself (NULL in a NOT NULL column, value too
+# long, ...): retrying the same row cannot succeed
+RowError = IntegrityError + (mysql.connector.DataError, sqlite3.DataError)
+
+
+class PoolTimeout(RuntimeError):
+    """هیچ اتصال آزادی در زمان DB_POOL_TIMEOUT پیدا نشد"""
+
+
+def _connect():
     """
     بازگشت یک اتصال MySQL
     """
@@ -18,4 +45,340 @@ def get_connection():
         )
         return conn
     except Error as e:
-        raise RuntimeError(f"Can't connect to MySQL: {e}")
\ No newline at end of file
+        raise RuntimeError(f"Can't connect to MySQL: {e}")
+
+
+# ================== POOL ==================
+
+class _Entry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled connection. close() (or leaving a `with` block)
+    returns the connection to the pool instead of closing the socket, so
+    existing callers keep working unchanged.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise RuntimeError("Connection already returned to the pool")
+        return getattr(self._entry.conn, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._entry is None:
+            raise RuntimeError("Connection already returned to the pool")
+        return TimedCursor(self._entry.conn.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool._release(entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # اتصالی که close نشده را به pool برگردان
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class TimedCursor:
+    """Cursor proxy that records execute() latency in db_query_seconds."""
+
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+    def execute(self, *args, **kwargs):
+        with db_query_seconds.time():
+            return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with db_query_seconds.time():
+            return self._cursor.executemany(*args, **kwargs)
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size, max_size, timeout, recycle,
+                 idle_timeout, ping_interval):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._idle = deque()      # oldest idle on the left, newest on the right
+        self._size = 0            # idle + checked out + being opened
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._counters = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    # ---------- public ----------
+    def get(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        entry = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No MySQL connection available after {self.timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            waited = time.monotonic() - started
+            self._counters["checkouts"] += 1
+            self._counters["wait_time_total"] += waited
+            self._counters["wait_time_max"] = max(self._counters["wait_time_max"], waited)
+
+        if entry is None:
+            entry = self._open()
+        else:
+            entry = self._validate(entry)
+
+        entry.last_used = time.monotonic()
+        return PooledConnection(self, entry)
+
+    def stats(self) -> dict:
+        with self._cond:
+            idle = len(self._idle)
+            data = dict(self._counters)
+            data.update({
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "waiting": self._waiting,
+            })
+        return data
+
+    def fill(self):
+        """حداقل تعداد اتصال‌ها (min_size) را از قبل باز کن"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            entry = self._open()
+            with self._cond:
+                self._idle.appendleft(entry)
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_quietly(entry.conn)
+
+    # ---------- internals ----------
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters["created"] += 1
+        return _Entry(conn)
+
+    def _validate(self, entry):
+        now = time.monotonic()
+
+        # اتصال‌های قدیمی را بازسازی کن (wait_timeout سمت سرور، failover و ...)
+        if self.recycle and now - entry.created_at > self.recycle:
+            self._close_quietly(entry.conn)
+            with self._cond:
+                self._counters["recycled"] += 1
+            return self._reopen()
+
+        # Health-check only connections that sat idle for a while; a
+        # connection returned a moment ago is known good and a ping would
+        # just add a round trip to every query.
+        if now - entry.last_used > self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                self._close_quietly(entry.conn)
+                with self._cond:
+                    self._counters["discarded"] += 1
+                return self._reopen()
+
+        return entry
+
+    def _reopen(self):
+        # the slot is still reserved in _size, _open releases it on failure
+        return self._open()
+
+    def _release(self, entry):
+        conn = entry.conn
+        healthy = True
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            # End any implicit transaction so the next borrower does not
+            # inherit locks or a stale REPEATABLE READ snapshot.
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            healthy = False
+
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            if not healthy or self._closed:
+                self._size -= 1
+                self._counters["discarded"] += 1
+                expired.append(entry)
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+
+            # Shrink back towards min_size by closing connections that have
+            # been idle longer than idle_timeout.
+            while (self.idle_timeout and self._idle and self._size > self.min_size
+                   and now - self._idle[0].last_used > self.idle_timeout):
+                expired.append(self._idle.popleft())
+                self._size -= 1
+                self._counters["recycled"] += 1
+
+            self._cond.notify()
+
+        for old in expired:
+            self._close_quietly(old.conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    _connect,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    recycle=DB_POOL_RECYCLE,
+                    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                    ping_interval=DB_POOL_PING_INTERVAL,
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+def get_sqlite():
+    global _pool
+    if _pool is None:
+        from app.db_sqlite import SQLiteStore
+
+        with _pool_lock:
+            if _pool is None:
+                _pool = SQLiteStore(
+                    SQLITE_PATH,
+                    synchronous=SQLITE_SYNCHRONOUS,
+                    mmap_mb=SQLITE_MMAP_MB,
+                    busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+                )
+    return _pool
+
+
+def get_connection():
+    """
+    یک اتصال از pool بگیر؛ conn.close() آن را به pool برمی‌گرداند
+    (با DB_BACKEND=sqlite: اتصال به فایل SQLite، همان رابط)
+    """
+    if DIALECT == "sqlite":
+        return get_sqlite().connect()
+    return get_pool().get()
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
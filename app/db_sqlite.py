@@ -0,0 +1,286 @@
+# app/db_sqlite.py
+"""
+Embedded SQLite storage (DB_BACKEND=sqlite) for single-machine installs.
+
+The database is one file in WAL mode, so readers never block the writer
+and a commit is an append to the WAL (fsync only at checkpoints with
+synchronous=NORMAL) instead of a network round trip.
+
+Connections handed out by get_connection() look like the MySQL ones to
+the rest of the app (`%s` placeholders, cursor(), commit(), lastrowid):
+
+- SELECTs run on a per-thread read-only connection with memory-mapped I/O
+- the first other statement takes the single writer connection (a lock
+  within the process, BEGIN IMMEDIATE across worker processes) until
+  commit(), rollback() or close(); later SELECTs in that transaction also
+  go to the writer, so they see its own changes
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from app.metrics import db_query_seconds
+
+# DATETIME / TIMESTAMP columns come back as datetime, like mysql.connector
+sqlite3.register_converter("TIMESTAMP", lambda v: datetime.fromisoformat(v.decode()))
+sqlite3.register_converter("DATETIME", lambda v: datetime.fromisoformat(v.decode()))
+
+_NOW = "(strftime('%Y-%m-%d %H:%M:%f', 'now'))"
+
+# same tables as create_db.py; later columns and indexes come from migrations
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(255) UNIQUE NOT NULL,
+    email VARCHAR(255) UNIQUE,
+    password VARCHAR(255) NOT NULL,
+    created_at DATETIME DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(255),
+    is_group TINYINT DEFAULT 0,
+    is_private TINYINT DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS chat_members (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INT NOT NULL REFERENCES chats(id),
+    user_id INT NOT NULL REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INT NOT NULL REFERENCES chats(id),
+    user_id INT NOT NULL REFERENCES users(id),
+    type VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT {_NOW},
+    seen TINYINT DEFAULT 0,
+    seen_at DATETIME NULL,
+    deleted TINYINT DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id);
+
+CREATE TABLE IF NOT EXISTS files (
+    id VARCHAR(255) PRIMARY KEY,
+    original_name VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(100) NOT NULL,
+    enc_path VARCHAR(255) NOT NULL,
+    created_at DATETIME DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS key_versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    enc_key BLOB NOT NULL,
+    created_at TIMESTAMP DEFAULT {_NOW}
+);
+"""
+
+_READ_PREFIXES = ("SELECT", "WITH", "PRAGMA", "EXPLAIN")
+
+
+def _is_read(sql: str) -> bool:
+    return sql.lstrip().upper().startswith(_READ_PREFIXES)
+
+
+def _translate(sql: str) -> str:
+    return sql.replace("%s", "?")
+
+
+class SQLiteCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = None
+
+    def execute(self, sql, params=()):
+        # finish the previous statement: an unfinished read keeps its
+        # connection on an old snapshot
+        self.close()
+        with db_query_seconds.time():
+            self._cursor = self._conn._execute(_translate(sql), params)
+        return self._cursor
+
+    def executemany(self, sql, seq_of_params):
+        self.close()
+        with db_query_seconds.time():
+            db = self._conn._writer()
+            self._cursor = db.executemany(_translate(sql), seq_of_params)
+        return self._cursor
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid if self._cursor is not None else None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount if self._cursor is not None else -1
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SQLiteConnection:
+    """What get_connection() returns with DB_BACKEND=sqlite."""
+
+    def __init__(self, store):
+        self._store = store
+        self._writing = False
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._writing
+
+    def _execute(self, sql, params):
+        if self._writing or not _is_read(sql):
+            return self._writer().execute(sql, params)
+        return self._store._reader().execute(sql, params)
+
+    def _writer(self):
+        if not self._writing:
+            self._store._begin_write()
+            self._writing = True
+        return self._store._write_conn
+
+    def commit(self):
+        if self._writing:
+            self._writing = False
+            self._store._end_write("COMMIT")
+
+    def rollback(self):
+        if self._writing:
+            self._writing = False
+            self._store._end_write("ROLLBACK")
+
+    def close(self):
+        # like the MySQL pool: an uncommitted transaction is rolled back
+        self.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SQLiteStore:
+    def __init__(self, path: str, synchronous: str, mmap_mb: int, busy_timeout_ms: int):
+        self.path = path
+        self.synchronous = synchronous
+        self.mmap_bytes = mmap_mb * 1024 * 1024
+        self.busy_timeout = busy_timeout_ms / 1000
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._readers = []
+        self._closed = False
+        self._stats = {
+            "reads_opened": 0,
+            "write_transactions": 0,
+            "commits": 0,
+            "rollbacks": 0,
+            "write_wait_total": 0.0,
+            "write_wait_max": 0.0,
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._write_conn = self._open()
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.executescript(SCHEMA)
+
+    def _open(self, readonly: bool = False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,          # transactions are explicit
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_bytes}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    # ---------- public ----------
+    def connect(self) -> SQLiteConnection:
+        if self._closed:
+            raise RuntimeError("SQLite store is closed")
+        return SQLiteConnection(self)
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data["readers"] = len(self._readers)
+        data["writer_busy"] = int(self._write_lock.locked())
+        return data
+
+    def close(self):
+        self._closed = True
+        with self._write_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            self._write_conn.close()
+
+    # ---------- internals ----------
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open(readonly=True)
+            self._readers.append(conn)
+            self._stats["reads_opened"] += 1
+        return conn
+
+    def _begin_write(self):
+        started = time.monotonic()
+        self._write_lock.acquire()
+        try:
+            self._write_conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._write_lock.release()
+            raise
+        waited = time.monotonic() - started
+        self._stats["write_transactions"] += 1
+        self._stats["write_wait_total"] += waited
+        self._stats["write_wait_max"] = max(self._stats["write_wait_max"], waited)
+
+    def _end_write(self, statement: str):
+        try:
+            self._write_conn.execute(statement)
+        except Exception:
+            if self._write_conn.in_transaction:
+                self._write_conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._stats["commits" if statement == "COMMIT" else "rollbacks"] += 1
+            self._write_lock.release()
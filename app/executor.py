@@ -0,0 +1,112 @@
+# app/executor.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.config import DB_EXECUTOR_WORKERS, IO_EXECUTOR_WORKERS, EXECUTOR_MAX_PENDING, THUMB_WORKERS
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking work (mysql.connector, file I/O, digests) that
+    must never run on the event loop thread.
+
+    At most `max_pending` calls are admitted at once (running + queued);
+    further callers wait on the loop without blocking it, so a burst cannot
+    grow an unbounded backlog inside the pool.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "active": 0,
+            "pending": 0,
+            "queue_time_total": 0.0,
+            "queue_time_max": 0.0,
+            "run_time_total": 0.0,
+            "run_time_max": 0.0,
+        }
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = partial(func, *args, **kwargs)
+
+        async with self._slots:
+            enqueued = time.monotonic()
+            with self._lock:
+                self._stats["submitted"] += 1
+                self._stats["pending"] += 1
+
+            def job():
+                started = time.monotonic()
+                with self._lock:
+                    waited = started - enqueued
+                    self._stats["active"] += 1
+                    self._stats["queue_time_total"] += waited
+                    self._stats["queue_time_max"] = max(self._stats["queue_time_max"], waited)
+                ok = False
+                try:
+                    result = call()
+                    ok = True
+                    return result
+                finally:
+                    elapsed = time.monotonic() - started
+                    with self._lock:
+                        self._stats["active"] -= 1
+                        self._stats["pending"] -= 1
+                        self._stats["completed" if ok else "failed"] += 1
+                        self._stats["run_time_total"] += elapsed
+                        self._stats["run_time_max"] = max(self._stats["run_time_max"], elapsed)
+
+            return await loop.run_in_executor(self._pool, job)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data.update({"max_workers": self.max_workers, "max_pending": self.max_pending})
+        return data
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+# ================== EXECUTORS ==================
+# DB threads are sized to the connection pool so a worker never waits for a
+# connection; file I/O gets its own pool so slow disks cannot starve
+# queries (password hashing runs in auth's process pool). Thumbnail
+# rendering (CPU heavy, in the background) is kept to a few threads of its own.
+db_executor = BoundedExecutor("db", DB_EXECUTOR_WORKERS, EXECUTOR_MAX_PENDING)
+io_executor = BoundedExecutor("io", IO_EXECUTOR_WORKERS, EXECUTOR_MAX_PENDING)
+thumb_executor = BoundedExecutor("thumb", THUMB_WORKERS, EXECUTOR_MAX_PENDING)
+
+
+async def run_db(func, *args, **kwargs):
+    return await db_executor.run(func, *args, **kwargs)
+
+
+async def run_io(func, *args, **kwargs):
+    return await io_executor.run(func, *args, **kwargs)
+
+
+async def run_thumb(func, *args, **kwargs):
+    return await thumb_executor.run(func, *args, **kwargs)
+
+
+def executor_stats() -> dict:
+    return {"db": db_executor.stats(), "io": io_executor.stats(), "thumb": thumb_executor.stats()}
+
+
+def shutdown_executors(wait: bool = True):
+    thumb_executor.shutdown(wait=wait)
+    db_executor.shutdown(wait=wait)
+    io_executor.shutdown(wait=wait)
@@ -0,0 +1,130 @@
+# app/fanout.py
+import asyncio
+import json
+import time
+from collections import deque
+
+from app.config import FANOUT_QUEUE_MAX, FANOUT_SLOW_POLICY
+from app.metrics import broadcast_seconds, ws_frames_broadcast
+
+# close code sent to consumers that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+_stats = {
+    "broadcasts": 0,
+    "frames_enqueued": 0,
+    "frames_sent": 0,
+    "frames_dropped": 0,
+    "slow_disconnects": 0,
+    "send_errors": 0,
+    "fanout_time_total": 0.0,
+    "fanout_time_max": 0.0,
+    "delivery_latency_max": 0.0,
+}
+# recent enqueue -> sent latencies, for percentiles
+_latencies = deque(maxlen=2048)
+
+
+class Connection:
+    """
+    One websocket plus its bounded outbound queue, drained by its own writer
+    task. push() never awaits, so a slow client only fills its own queue;
+    past FANOUT_QUEUE_MAX frames it is either disconnected or its new frames
+    are dropped (FANOUT_SLOW_POLICY).
+    """
+
+    def __init__(self, ws, max_queue: int = FANOUT_QUEUE_MAX, slow_policy: str = FANOUT_SLOW_POLICY):
+        self.ws = ws
+        self.slow_policy = slow_policy
+        self.closed = False
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._writer = asyncio.create_task(self._drain())
+
+    def push(self, frame: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait((frame, time.monotonic()))
+        except asyncio.QueueFull:
+            if self.slow_policy == "drop":
+                _stats["frames_dropped"] += 1
+            else:
+                _stats["slow_disconnects"] += 1
+                self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+            return False
+        _stats["frames_enqueued"] += 1
+        return True
+
+    def room(self) -> int:
+        """Frames that can still be queued before the slow-consumer policy kicks in."""
+        return self._queue.maxsize - self._queue.qsize()
+
+    def send_json(self, payload) -> bool:
+        return self.push(json.dumps(payload))
+
+    def close(self, code: int = None):
+        """Stop the writer; with a code, also close the socket."""
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass
+
+    async def _drain(self):
+        while True:
+            frame, enqueued = await self._queue.get()
+            try:
+                await self.ws.send_text(frame)
+            except Exception:
+                # socket gone; the receive loop cleans up
+                _stats["send_errors"] += 1
+                self.closed = True
+                return
+            latency = time.monotonic() - enqueued
+            _stats["frames_sent"] += 1
+            _latencies.append(latency)
+            if latency > _stats["delivery_latency_max"]:
+                _stats["delivery_latency_max"] = latency
+
+
+def fanout(connections, payload, exclude=None) -> int:
+    """Encode the payload once and queue the same frame on every connection."""
+    started = time.perf_counter()
+    frame = json.dumps(payload)
+    delivered = 0
+    for conn in connections:
+        if conn is exclude:
+            continue
+        if conn.push(frame):
+            delivered += 1
+
+    elapsed = time.perf_counter() - started
+    _stats["broadcasts"] += 1
+    _stats["fanout_time_total"] += elapsed
+    if elapsed > _stats["fanout_time_max"]:
+        _stats["fanout_time_max"] = elapsed
+    broadcast_seconds.observe(elapsed)
+    ws_frames_broadcast.inc(amount=delivered)
+    return delivered
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def fanout_stats() -> dict:
+    data = dict(_stats)
+    recent = list(_latencies)
+    data["delivery_latency_p50"] = _percentile(recent, 0.50)
+    data["delivery_latency_p99"] = _percentile(recent, 0.99)
+    return data
@@ -0,0 +1,226 @@
+# app/file_crypto.py
+"""
+Chunked authenticated encryption for uploaded files.
+
+On-disk layout (".enc"):
+
+    header: MAGIC(4) | VERSION(1) | chunk_size(4, big endian) | nonce_prefix(16)
+    chunk*: XChaCha20-Poly1305(plain[i*chunk_size : (i+1)*chunk_size]) + tag(16)
+
+Chunk i uses nonce = nonce_prefix || i (8 bytes, big endian) and is
+authenticated together with the header, its index and a "last chunk" flag,
+so chunks cannot be reordered, swapped between files or truncated away.
+Every chunk is independent, which lets files be written and read a chunk at
+a time without holding the whole file in memory.
+
+Files written before this format (one SecretBox blob) are still readable;
+see is_chunked().
+"""
+import hashlib
+import io
+import os
+import struct
+
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+
+from nacl.bindings import (
+    crypto_aead_xchacha20poly1305_ietf_encrypt as _aead_encrypt,
+    crypto_aead_xchacha20poly1305_ietf_decrypt as _aead_decrypt,
+    crypto_aead_xchacha20poly1305_ietf_ABYTES as TAG_SIZE,
+)
+
+MAGIC = b"MSCF"
+VERSION = 1
+NONCE_PREFIX_SIZE = 16
+_HEADER = struct.Struct(">4sBI16s")
+HEADER_SIZE = _HEADER.size
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+# ================== HELPERS ==================
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(8, "big")
+
+
+def _aad(header: bytes, index: int, last: bool) -> bytes:
+    return header + index.to_bytes(8, "big") + (b"\x01" if last else b"\x00")
+
+
+def read_header(f):
+    header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise ValueError("Truncated file header")
+    magic, version, chunk_size, prefix = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or chunk_size <= 0:
+        raise ValueError("Unknown file format")
+    return header, chunk_size, prefix
+
+
+def is_chunked(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def plaintext_size(enc_size: int, chunk_size: int) -> int:
+    body = enc_size - HEADER_SIZE
+    stride = chunk_size + TAG_SIZE
+    chunks = -(-body // stride)
+    return body - chunks * TAG_SIZE
+
+
+# ================== DEDUP ==================
+
+def keyed_digest(src, key: bytes, chunk_size: int, max_size: int = 0):
+    """
+    Keyed BLAKE2b of src's plaintext, read chunk by chunk from the start.
+    Returns (hex digest, size); raises FileTooLarge past `max_size` bytes.
+    """
+    h = hashlib.blake2b(key=key, digest_size=32)
+    total = 0
+    src.seek(0)
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_size and total > max_size:
+            raise FileTooLarge(f"File exceeds {max_size} bytes")
+        h.update(chunk)
+    src.seek(0)
+    return h.hexdigest(), total
+
+
+# ================== ENCRYPT ==================
+
+def encrypt_stream(src, dst_path: str, key: bytes, chunk_size: int, max_size: int = 0) -> int:
+    """
+    src را تکه‌تکه می‌خواند، رمز می‌کند و در dst_path می‌نویسد.
+    Returns the plaintext size; raises FileTooLarge past `max_size` bytes.
+    The file appears at dst_path only once it is complete.
+    """
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = _HEADER.pack(MAGIC, VERSION, chunk_size, prefix)
+    tmp_path = dst_path + ".part"
+    total = 0
+    index = 0
+
+    try:
+        with open(tmp_path, "wb") as out:
+            out.write(header)
+
+            # read one chunk ahead so the last chunk can be flagged as such
+            chunk = src.read(chunk_size)
+            while chunk:
+                total += len(chunk)
+                if max_size and total > max_size:
+                    raise FileTooLarge(f"File exceeds {max_size} bytes")
+                following = src.read(chunk_size)
+                last = not following
+                out.write(_aead_encrypt(chunk, _aad(header, index, last), _nonce(prefix, index), key))
+                index += 1
+                chunk = following
+
+        if total:
+            os.replace(tmp_path, dst_path)
+        else:
+            os.unlink(tmp_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return total
+
+
+# ================== DECRYPT ==================
+
+def plain_size_of(path: str) -> int:
+    """اندازه فایل اصلی (بدون رمزگشایی) از روی اندازه فایل .enc"""
+    with open(path, "rb") as f:
+        _, chunk_size, _ = read_header(f)
+        return plaintext_size(os.fstat(f.fileno()).st_size, chunk_size)
+
+
+def decrypt_chunks(path: str, key: bytes, start: int = 0, end: int = None):
+    """
+    Yield the plaintext bytes start..end (inclusive) of a chunked .enc file.
+
+    Only the chunks covering the range are read and decrypted, one at a time,
+    so memory stays at one chunk whatever the file or range size.
+    """
+    with open(path, "rb") as f:
+        header, chunk_size, prefix = read_header(f)
+        enc_size = os.fstat(f.fileno()).st_size
+        size = plaintext_size(enc_size, chunk_size)
+        if end is None or end >= size:
+            end = size - 1
+        if start > end:
+            return
+
+        stride = chunk_size + TAG_SIZE
+        count = -(-(enc_size - HEADER_SIZE) // stride)
+        first = start // chunk_size
+        last = end // chunk_size
+
+        f.seek(HEADER_SIZE + first * stride)
+        for index in range(first, last + 1):
+            sealed = f.read(stride)
+            plain = _aead_decrypt(sealed, _aad(header, index, index == count - 1), _nonce(prefix, index), key)
+            offset = index * chunk_size
+            lo = start - offset if index == first else 0
+            hi = end - offset + 1 if index == last else len(plain)
+            yield plain[lo:hi]
+
+
+# ================== KEY ROTATION ==================
+
+class _ChunkReader:
+    """file-like read(n) over an iterator of byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def read(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def opens_with(path: str, key: bytes) -> bool:
+    """Whether `key` is the key path was encrypted with (first chunk only, for chunked files)."""
+    try:
+        if is_chunked(path):
+            for _ in decrypt_chunks(path, key, 0, 0):
+                pass
+        else:
+            with open(path, "rb") as f:
+                SecretBox(key).decrypt(f.read())
+        return True
+    except (CryptoError, ValueError):
+        return False
+
+
+def reencrypt_file(src_path: str, dst_path: str, old_key: bytes, new_key: bytes, chunk_size: int) -> int:
+    """
+    Decrypt src_path with old_key and write it to dst_path under new_key,
+    a chunk at a time (legacy single-blob files are read whole, as on
+    download). Returns the plaintext size.
+    """
+    if is_chunked(src_path):
+        src = _ChunkReader(decrypt_chunks(src_path, old_key))
+    else:
+        with open(src_path, "rb") as f:
+            src = io.BytesIO(SecretBox(old_key).decrypt(f.read()))
+    return encrypt_stream(src, dst_path, new_key, chunk_size)
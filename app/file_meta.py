@@ -0,0 +1,91 @@
+# app/file_meta.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import FILE_META_CACHE_SIZE, FILE_META_CACHE_TTL
+
+
+class FileMetaCache:
+    """
+    file_id -> (original_name, mime_type, etag) for /file/{id}.
+
+    An upload never changes once stored (its id is random and the content
+    is never rewritten), so a revalidation (If-None-Match) is answered from
+    here without a query. Only its existence changes: auto_clear_uploads.py
+    evicts files from another process, so entries expire after `ttl`
+    seconds and an evicted file stops answering 304 within that. The parts
+    that do change (enc_path, key_id: key rotation) are not cached. Least
+    recently used files are evicted past `max_files`.
+
+    Thread-safe like MembershipCache.
+    """
+
+    def __init__(self, max_files: int, ttl: float):
+        self.max_files = max_files
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, file_id):
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(file_id)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def store(self, file_id, original_name, mime_type, etag):
+        entry = (original_name, mime_type, etag)
+        with self._lock:
+            self._entries[file_id] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_files:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["files"] = len(self._entries)
+        return data
+
+
+def etag_for(file_id: str, digest) -> str:
+    """
+    Strong ETag of an upload: a hash of the blob's content digest and the
+    file id. The dedup digest itself is not sent, or anyone could tell that
+    two users uploaded the same content. Uploads from before deduplication
+    (no digest) hash their id alone, which is just as immutable.
+    """
+    h = hashlib.blake2b(f"{digest or ''}:{file_id}".encode(), digest_size=16)
+    return f'"{h.hexdigest()}"'
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    """If-None-Match (weak comparison) / If-Range (strong) against our ETag."""
+    if header.strip() == "*":
+        return weak
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def create_file_meta_cache() -> FileMetaCache:
+    return FileMetaCache(max_files=FILE_META_CACHE_SIZE, ttl=FILE_META_CACHE_TTL)
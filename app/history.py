@@ -0,0 +1,246 @@
+# app/history.py
+import bisect
+from collections import OrderedDict
+
+from app.config import HISTORY_CACHE_PER_CHAT, HISTORY_CACHE_MAX_MB, RESUME_BUFFER_PER_CHAT, RESUME_BUFFER_MAX_CHATS
+from app.executor import run_db
+
+# rough per-message overhead of the dict and its strings, on top of the text
+_MESSAGE_OVERHEAD = 300
+
+
+def message_from_row(row) -> dict:
+    """
+    (id, username, type, content, timestamp, seq, mime) → the message dict
+    of /messages/, the caches and the archive segments.
+    """
+    return {
+        "id": row[0], "username": row[1], "type": row[2], "text": row[3],
+        "timestamp": row[4].strftime("%Y-%m-%d %H:%M:%S.%f"), "seq": row[5],
+        "mime": row[6],
+    }
+
+
+def _message_size(message: dict) -> int:
+    return _MESSAGE_OVERHEAD + len(message.get("text") or "")
+
+
+class _ChatHistory:
+    """
+    The newest messages of one chat, oldest first. Every message with an id
+    of at least ids[0] is present; `complete` means nothing older exists.
+    """
+
+    __slots__ = ("ids", "messages", "complete", "size")
+
+    def __init__(self, messages: list, complete: bool):
+        self.ids = [m["id"] for m in messages]
+        self.messages = list(messages)
+        self.complete = complete
+        self.size = sum(_message_size(m) for m in messages)
+
+    def add(self, message: dict, limit: int):
+        pos = bisect.bisect_left(self.ids, message["id"])
+        if pos < len(self.ids) and self.ids[pos] == message["id"]:
+            return
+        self.ids.insert(pos, message["id"])
+        self.messages.insert(pos, message)
+        self.size += _message_size(message)
+        while len(self.ids) > limit:
+            self.ids.pop(0)
+            self.size -= _message_size(self.messages.pop(0))
+            self.complete = False
+
+
+class RecentMessages:
+    """
+    Ring buffer of the newest messages per chat, so the first page of
+    /messages/ and reconnect catch-up (after_id) are answered from memory.
+
+    A chat is warmed from MySQL with `loader` the first time it is asked for
+    and then kept current with add(), fed with every message once it has
+    been written (and so has its id), from this worker and the others.
+    At most `per_chat` messages are kept per chat; past `max_bytes` in total
+    the least recently used chats are dropped. page() returns None whenever
+    memory alone cannot answer, and the caller goes to MySQL.
+    """
+
+    def __init__(self, loader, resolver, per_chat: int, max_bytes: int):
+        self.loader = loader        # loader(chat_id, limit) -> (newest first, has_more)
+        self.resolver = resolver    # resolver(name) -> chat_id or None
+        self.per_chat = per_chat
+        self.max_bytes = max_bytes
+        self._chats = OrderedDict()  # chat_id -> _ChatHistory
+        self._warming = {}           # chat_id -> messages added while loading
+        self._names = {}             # chat name -> chat_id (names never change)
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "warms": 0, "evictions": 0}
+
+    # ---------- writes ----------
+    def remember_chat(self, name: str, chat_id: int):
+        self._names[name] = chat_id
+
+    def add(self, chat_id: int, messages: list):
+        pending = self._warming.get(chat_id)
+        if pending is not None:
+            pending.extend(messages)
+            return
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return
+        before = chat.size
+        for message in messages:
+            chat.add(message, self.per_chat)
+        self._size += chat.size - before
+        self._shrink()
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self._chats.clear()
+            self._size = 0
+        else:
+            chat = self._chats.pop(chat_id, None)
+            if chat is not None:
+                self._size -= chat.size
+        # a load already in flight may predate the change
+        for pending in self._warming:
+            if chat_id is None or pending == chat_id:
+                self._warming[pending] = None
+
+    # ---------- reads ----------
+    async def page(self, chat, limit: int, before_id=None, after_id=None):
+        """(messages newest first, has_more) like fetch_messages, or None"""
+        chat_id = await self.resolve(chat)
+        if chat_id is None:
+            return None
+
+        history = self._chats.get(chat_id)
+        if history is None and before_id is None:
+            history = await self._warm(chat_id)
+        if history is None:
+            self._stats["misses"] += 1
+            return None
+        self._chats.move_to_end(chat_id)
+
+        ids, messages = history.ids, history.messages
+        if after_id is not None:
+            if not history.complete and (not ids or after_id < ids[0]):
+                self._stats["misses"] += 1
+                return None
+            lo = bisect.bisect_right(ids, after_id)
+            found = messages[lo:lo + limit]
+            has_more = len(ids) - lo > limit
+        else:
+            hi = len(ids) if before_id is None else bisect.bisect_left(ids, before_id)
+            if hi <= limit and not history.complete:
+                self._stats["misses"] += 1
+                return None
+            found = messages[max(0, hi - limit):hi]
+            has_more = hi > limit
+
+        self._stats["hits"] += 1
+        return found[::-1], has_more
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data["chats"] = len(self._chats)
+        data["bytes"] = self._size
+        return data
+
+    # ---------- internals ----------
+    async def resolve(self, chat):
+        """chat id or name -> chat id (names cached); None if there is no such chat"""
+        if isinstance(chat, int):
+            return chat
+        if chat.isdigit():
+            return int(chat)
+        chat_id = self._names.get(chat)
+        if chat_id is None:
+            chat_id = await run_db(self.resolver, chat)
+            if chat_id is not None:
+                self._names[chat] = chat_id
+        return chat_id
+
+    async def _warm(self, chat_id: int):
+        if chat_id in self._warming:
+            return None
+        self._warming[chat_id] = []
+        try:
+            newest, has_more = await run_db(self.loader, chat_id, self.per_chat)
+        finally:
+            arrived = self._warming.pop(chat_id)
+        if arrived is None:
+            return None
+
+        self._stats["warms"] += 1
+        history = _ChatHistory(newest[::-1], complete=not has_more)
+        for message in arrived:
+            history.add(message, self.per_chat)
+        self._chats[chat_id] = history
+        self._size += history.size
+        self._shrink()
+        return self._chats.get(chat_id)
+
+    def _shrink(self):
+        while self._size > self.max_bytes and len(self._chats) > 1:
+            _, history = self._chats.popitem(last=False)
+            self._size -= history.size
+            self._stats["evictions"] += 1
+
+
+class LiveTail:
+    """
+    The last `per_chat` message payloads of each chat, by seq, as they are
+    broadcast (before they are written to MySQL), for websocket resume.
+    Up to `max_chats` chats are kept, least recently active dropped first.
+    """
+
+    def __init__(self, per_chat: int, max_chats: int):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> ([seq, ...], [payload, ...])
+
+    def add(self, chat_id: int, payload: dict):
+        seq = payload.get("seq")
+        if seq is None:
+            return
+        seqs, payloads = self._chats.get(chat_id) or ([], [])
+        self._chats[chat_id] = (seqs, payloads)
+        self._chats.move_to_end(chat_id)
+
+        pos = bisect.bisect_left(seqs, seq)
+        if pos < len(seqs) and seqs[pos] == seq:
+            return
+        seqs.insert(pos, seq)
+        payloads.insert(pos, payload)
+        if len(seqs) > self.per_chat:
+            del seqs[0], payloads[0]
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def since(self, chat_id: int, seq: int):
+        """Payloads after `seq`, oldest first, or None if some may be missing."""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return None
+        seqs, payloads = entry
+        lo = bisect.bisect_right(seqs, seq)
+        newer = seqs[lo:]
+        # seqs are consecutive per chat; a hole means a frame has not arrived
+        # (or was never kept) and memory alone cannot answer
+        if newer and (newer[0] != seq + 1 or newer[-1] - newer[0] != len(newer) - 1):
+            return None
+        return payloads[lo:]
+
+
+def create_recent_messages(loader, resolver) -> RecentMessages:
+    return RecentMessages(
+        loader,
+        resolver,
+        per_chat=HISTORY_CACHE_PER_CHAT,
+        max_bytes=HISTORY_CACHE_MAX_MB * 1024 * 1024,
+    )
+
+
+def create_live_tail() -> LiveTail:
+    return LiveTail(per_chat=RESUME_BUFFER_PER_CHAT, max_chats=RESUME_BUFFER_MAX_CHATS)
@@ -1,21 +1,34 @@
 # app/main.py
-from fastapi import FastAPI, HTTPException, Form, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, Form, UploadFile, File, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.security import OAuth2PasswordBearer
 
-from app.chat_keys import GLOBAL_CHAT_KEY
-from jose import jwt, JWTError
-from app.db import get_connection
+from app import chat_keys
+from app.chat_keys import FILE_DEDUP_KEY, key_ring
+from jose import JWTError
+from app.db import get_connection, close_pool, pool_stats
+from app.executor import run_db, run_io, shutdown_executors, executor_stats
+from app.fanout import fanout_stats
+from app import metrics
+from app.config import MESSAGES_PAGE_SIZE, MESSAGES_PAGE_MAX, FILE_CHUNK_SIZE, UPLOAD_MAX_FILE_MB, FILE_TOUCH_INTERVAL
+from app.config import SERVER_HOST, SERVER_PORT, FILE_CACHE_MAX_AGE
+from app.file_crypto import encrypt_stream, decrypt_chunks, is_chunked, plain_size_of, keyed_digest, FileTooLarge
+from app import blobs, archive, thumbnails
+from app.file_meta import create_file_meta_cache, etag_for, etag_matches
+from app.reencrypt import reencrypt_loop, reencrypt_stats, find_file_key
 import os
 import sys
 import uuid
 import base64
 from datetime import datetime
 from dotenv import load_dotenv
-from nacl.secret import SecretBox
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 import io
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from itertools import chain
 
 # -----------------------------
 # Load .env
@@ -48,18 +61,46 @@ if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
 # -----------------------------
-# 1️⃣ ساخت دیتابیس و جداول قبل از هر چیز
-# -----------------------------
-from app.create_db import create_database
-create_database()
-
-# -----------------------------
-from app.auth import register_user, authenticate_user, create_access_token, SECRET_KEY, ALGORITHM
-from app.websocket import router as chat_router
+from app.auth import register_user, authenticate_user, create_access_token, decode_token, get_current_user, oauth2_scheme, shutdown_hash_pool, hash_stats, token_cache
+from app.websocket import router as chat_router, message_writer, presence_heartbeat, publish_presence, fetch_messages, recent_messages, membership_cache
+from app.broker import broker
 # ----------------------------
 
-app = FastAPI()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# True between the end of startup and the start of shutdown (/readyz)
+_ready = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ready
+    # 1️⃣ دیتابیس و کلید این نشست: یک بار در هر process، نه هنگام import
+    from app.create_db import create_database
+    await run_db(create_database)
+    await run_db(chat_keys.start_session_key)
+
+    await broker.start()
+    heartbeat = asyncio.create_task(presence_heartbeat())
+    reencrypt = asyncio.create_task(reencrypt_loop())
+    message_writer.start()
+    _ready = True
+    yield
+    _ready = False
+    heartbeat.cancel()
+    reencrypt.cancel()
+    thumbnails.cancel_pending()
+    # به بقیه workerها بگو کاربران این worker دیگر آنلاین نیستند
+    await publish_presence([])
+    # اول پیام‌های در صف ذخیره شوند (و به history بقیه workerها برسند)،
+    # بعد broker، executor و pool بسته شوند
+    await message_writer.stop()
+    await broker.stop()
+    # the re-encrypt job finishes its current file and removes what it replaced
+    await asyncio.gather(reencrypt, return_exceptions=True)
+    shutdown_hash_pool()
+    shutdown_executors()
+    close_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # Middleware
 app.add_middleware(
@@ -69,6 +110,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Routers
 app.include_router(chat_router)
@@ -81,9 +123,23 @@ if not os.path.exists(UPLOAD_DIR):
 
 # ========= دریافت پیام‌های قبلی =========
 @app.get("/messages/")
-async def get_messages(token: str = Depends(oauth2_scheme), chat_id: str = "global"):
+async def get_messages(
+    token: str = Depends(oauth2_scheme),
+    chat_id: str = "global",
+    limit: int = MESSAGES_PAGE_SIZE,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+):
+    """
+    Keyset pagination, newest message first.
+
+    - no cursor: newest `limit` messages
+    - before_id: next older page (pass the previous `next_cursor`)
+    - after_id: messages newer than a known id (catch-up); `next_cursor` is
+      then the newest id returned, to be passed again as `after_id`
+    """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username = payload.get("username")
         user_id = payload.get("sub")
         if not username or not user_id:
@@ -91,77 +147,110 @@ async def get_messages(token: str = Depends(oauth2_scheme), chat_id: str = "glob
     except JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            if chat_id.isdigit():
-                real_chat_id = int(chat_id)
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id")
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+
+    # the newest pages of active chats are served from memory
+    page = await recent_messages.page(chat_id, limit, before_id, after_id)
+    if page is None:
+        page = await run_db(fetch_messages, chat_id, limit, before_id, after_id)
+    messages, has_more = page
+
+    # past the oldest message still in the table: archived history
+    if not has_more and after_id is None and archive.exists():
+        chat = await recent_messages.resolve(chat_id)
+        if chat is not None:
+            oldest = messages[-1]["id"] if messages else before_id
+            if len(messages) < limit:
+                older, has_more = await run_io(archive.page, chat, limit - len(messages), oldest)
+                messages = messages + older
             else:
-                cursor.execute("SELECT id FROM chats WHERE name=%s", (chat_id,))
-                row = cursor.fetchone()
-                if not row:
-                    return {"messages": []}
-                real_chat_id = row[0]
+                # the table ran out exactly at this page: keep the client paging
+                has_more = await run_io(archive.has_older, chat, oldest)
 
-            cursor.execute("""
-                SELECT m.id, u.username, m.type, m.content, m.timestamp
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
-                WHERE m.chat_id=%s
-                ORDER BY m.timestamp ASC
-            """, (real_chat_id,))
-            
-            messages = [
-                {"id": row[0], "username": row[1], "type": row[2], "text": row[3], "timestamp": row[4].strftime("%Y-%m-%d %H:%M:%S.%f")}
-                for row in cursor.fetchall()
-            ]
-    finally:
-        conn.close()
+    next_cursor = None
+    if has_more and messages:
+        next_cursor = messages[0]["id"] if after_id is not None else messages[-1]["id"]
+
+    return {"messages": messages, "next_cursor": next_cursor}
 
-    return {"messages": messages}
 
 # ========= آپلود فایل =========
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...), token: str = Depends(oauth2_scheme)):
-    try:
-        jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file")
-
+async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    max_size = UPLOAD_MAX_FILE_MB * 1024 * 1024
     file_id = uuid.uuid4().hex
-    enc_path = os.path.join(UPLOAD_DIR, f"{file_id}.enc")
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-    box = SecretBox(GLOBAL_CHAT_KEY)
-    encrypted = box.encrypt(raw)
 
-    with open(enc_path, "wb") as f:
-        f.write(encrypted)
-
-    conn = get_connection()
+    # pass 1: keyed hash of the spooled upload; a known file is just referenced
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO files (id, original_name, mime_type, enc_path)
-                VALUES (%s, %s, %s, %s)
-            """, (file_id, file.filename, file.content_type, enc_path))
-            conn.commit()
-    finally:
-        conn.close()
+        digest, size = await run_io(keyed_digest, file.file, FILE_DEDUP_KEY, FILE_CHUNK_SIZE, max_size)
+    except FileTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    if not size:
+        raise HTTPException(status_code=400, detail="Empty file")
+
+    if not await run_db(blobs.add_file, file_id, file.filename, file.content_type, digest):
+        # pass 2: new content → encrypt it once into its own blob
+        enc_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.enc")
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+        # stream the multipart spool through the cipher chunk by chunk, off the loop
+        try:
+            await run_io(encrypt_upload, file.file, enc_path, max_size)
+        except FileTooLarge:
+            raise HTTPException(status_code=413, detail="File too large")
+
+        key_id = key_ring.current_id
+        blob_id = await store_blob(file_id, file.filename, file.content_type, digest, key_id, enc_path)
+        if blob_id is None:
+            await run_io(os.unlink, enc_path)
+            raise HTTPException(status_code=500, detail="Failed to store file")
+        if blob_id:
+            # پیش‌نمایش تصویر در پس‌زمینه؛ پاسخ آپلود منتظر آن نمی‌ماند
+            thumbnails.schedule(blob_id, enc_path, key_id, file.content_type)
 
     return {
         "file_id": file_id,
         "file_url": f"/file/{file_id}"
 }
 
+
+async def store_blob(file_id, original_name, mime_type, digest, key_id, enc_path, attempts=6):
+    """
+    Record a freshly encrypted upload. Returns its new blob id; 0 if the
+    same content was stored concurrently and is referenced instead (enc_path
+    is then removed); None if neither worked out.
+    """
+    size_bytes = await run_io(os.path.getsize, enc_path)
+    delay = 0.05
+    for _ in range(attempts):
+        blob_id = await run_db(blobs.add_blob, file_id, original_name, mime_type, digest, key_id, enc_path, size_bytes)
+        if blob_id:
+            return blob_id
+        # the same content was uploaded concurrently and stored first
+        if await run_db(blobs.add_file, file_id, original_name, mime_type, digest):
+            await run_io(os.unlink, enc_path)
+            return 0
+        # ... or its blob is at refcount 0, being evicted right now: once
+        # that commits the row is gone and ours can take its place
+        await asyncio.sleep(delay)
+        delay *= 2
+    return None
+
+
+def encrypt_upload(src, enc_path: str, max_size: int) -> int:
+    src.seek(0)
+    started = time.perf_counter()
+    size = encrypt_stream(src, enc_path, key_ring.current, FILE_CHUNK_SIZE, max_size)
+    metrics.crypto_seconds.inc("encrypt", amount=time.perf_counter() - started)
+    metrics.crypto_bytes.inc("encrypt", amount=size)
+    return size
+
 # ========= ثبت نام =========
 @app.post("/register/")
 async def api_register(username: str = Form(...), password: str = Form(...), email: str = Form(None)):
-    success, msg = register_user(username, password, email)
+    success, msg = await register_user(username, password, email)
     if success:
         return {"message": msg}
     raise HTTPException(status_code=400, detail=msg)
@@ -169,7 +258,7 @@ async def api_register(username: str = Form(...), password: str = Form(...), ema
 # ========= ورود =========
 @app.post("/login/")
 async def api_login(username: str = Form(...), password: str = Form(...)):
-    user_id = authenticate_user(username, password)
+    user_id = await authenticate_user(username, password)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": str(user_id), "username": username})
@@ -177,51 +266,293 @@ async def api_login(username: str = Form(...), password: str = Form(...)):
 
 # ========= کلید چت =========
 @app.get("/chat/key")
-async def get_global_chat_key(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=401)
-
+async def get_global_chat_key(user: dict = Depends(get_current_user)):
     return {
-        "key": base64.b64encode(GLOBAL_CHAT_KEY).decode("utf-8"),
+        "key": base64.b64encode(key_ring.current).decode("utf-8"),
         "chat": "global"
     }
 
 # ========= رمز گشایی فایل=========
+# فایل‌ها تغییرناپذیرند: نام، نوع و ETag هر فایل در حافظه می‌ماند
+file_meta = create_file_meta_cache()
+
+
 @app.get("/file/{file_id}")
-async def download_file(file_id: str, token: str = Depends(oauth2_scheme)):
+async def download_file(
+    file_id: str,
+    user: dict = Depends(get_current_user),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    row = None
+    meta = file_meta.lookup(file_id)
+    if meta is None:
+        row = await run_db(get_file_row, file_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="File not found")
+        meta = file_meta.store(file_id, row[0], row[1], row[4])
+
+    original_name, mime_type, etag = meta
+
+    headers = {
+        "Content-Disposition": f'inline; filename="{original_name}"',
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={FILE_CACHE_MAX_AGE}, immutable",
+    }
+    if if_none_match and etag_matches(if_none_match, etag):
+        # the browser already has it: no query, no decryption
+        del headers["Content-Disposition"]
+        return Response(status_code=304, headers=headers)
+
+    if row is None:
+        row = await run_db(get_file_row, file_id)
+        if not row:
+            file_meta.invalidate(file_id)
+            raise HTTPException(status_code=404, detail="File not found")
+    enc_path, key_id = row[2], row[3]
+    # only downloads count for eviction order, a 304 above stays read-free
+    await touch_file(file_id)
+
     try:
-        jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+        if key_id is None:
+            # آپلود قبل از ثبت key_id: کلید را از key ring پیدا و ثبت کن
+            key_id = await run_io(find_file_key, enc_path)
+            if key_id is None:
+                raise ValueError("No key for file")
+            await run_db(blobs.set_file_key, file_id, key_id)
+        key = await run_db(key_ring.get, key_id)
+
+        if not await run_io(is_chunked, enc_path):
+            # فایل‌های قدیمی (یک SecretBox کامل) از Range پشتیبانی نمی‌کنند
+            decrypted = await run_io(decrypt_legacy_file, enc_path, key_id)
+            return StreamingResponse(io.BytesIO(decrypted), media_type=mime_type, headers=headers)
+
+        size = await run_io(plain_size_of, enc_path)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to decrypt file")
+
+    headers["Accept-Ranges"] = "bytes"
+    status_code = 200
+    start, end = 0, size - 1
+
+    if if_range and not etag_matches(if_range, etag, weak=False):
+        range_header = None   # the client's partial copy is not this file: send all of it
+    byte_range = parse_range(range_header, size) if range_header else None
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    try:
+        # decrypt the first chunk up front so a wrong key or corrupt file is
+        # still reported as a 500 instead of a truncated 200/206
+        chunks = metrics.metered_chunks(decrypt_chunks(enc_path, key, start, end), "decrypt")
+        first = await run_io(next, chunks, b"")
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to decrypt file")
 
+    return StreamingResponse(
+        chain([first], chunks),
+        status_code=status_code,
+        media_type=mime_type,
+        headers=headers
+    )
+
+
+def parse_range(value: str, size: int):
+    """
+    Parse a single `bytes=` range into (start, end) inclusive.
+    Returns None to serve the whole file (unsupported or multi-range header)
+    and "unsatisfiable" when the range lies outside the file.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            if start >= size:
+                return "unsatisfiable"
+            end = int(last) if last else size - 1
+            if end < start:
+                return None
+        else:
+            # suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return "unsatisfiable"
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+# ========= پیش‌نمایش تصویر =========
+@app.get("/file/{file_id}/thumb")
+async def download_thumbnail(file_id: str, user: dict = Depends(get_current_user)):
+    """
+    Small JPEG/PNG preview of an image upload. 404 while there is none (not
+    an image, Pillow missing, or still being rendered): load /file/{id}.
+    """
+    row = await run_db(thumbnails.get_thumb_row, file_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    mime_type, blob_id, enc_path, key_id, thumb_path, thumb_key_id, thumb_mime = row
+    if not thumb_path:
+        if thumb_mime is None:
+            # older upload or re-encrypted blob: render it for next time
+            thumbnails.schedule(blob_id, enc_path, key_id, mime_type)
+        raise HTTPException(status_code=404, detail="No thumbnail")
+
+    try:
+        data = await run_io(thumbnails.read_thumbnail, thumb_path, thumb_key_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="No thumbnail")
+    return Response(data, media_type=thumb_mime, headers={"Cache-Control": "private, max-age=86400"})
+
+
+def get_file_row(file_id: str):
+    """(original_name, mime_type, enc_path, key_id, etag) or None"""
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
             cursor.execute("""
-                SELECT original_name, mime_type, enc_path
-                FROM files WHERE id=%s
+                SELECT f.original_name, f.mime_type, b.enc_path, b.key_id, b.digest
+                FROM files f JOIN blobs b ON b.id = f.blob_id
+                WHERE f.id=%s
             """, (file_id,))
             row = cursor.fetchone()
     finally:
         conn.close()
-
     if not row:
-        raise HTTPException(status_code=404, detail="File not found")
+        return None
+    return row[:4] + (etag_for(file_id, row[4]),)
+
+
+# file_id -> monotonic time of the last last_accessed_at update
+_touched = {}
+
+
+async def touch_file(file_id: str):
+    """
+    Bump last_accessed_at (the LRU order for eviction), at most once per
+    FILE_TOUCH_INTERVAL per file and worker, so downloads stay read-only.
+    """
+    now = time.monotonic()
+    if now - _touched.get(file_id, float("-inf")) < FILE_TOUCH_INTERVAL:
+        return
+    if len(_touched) > 10000:
+        _touched.clear()
+    _touched[file_id] = now
+    try:
+        await run_db(update_file_access, file_id)
+    except Exception as e:
+        print(f"[FILES] Failed to update last access of {file_id}: {e}")
 
-    original_name, mime_type, enc_path = row
 
+def update_file_access(file_id: str):
+    conn = get_connection()
     try:
-        with open(enc_path, "rb") as f:
-            encrypted = f.read()
-        box = SecretBox(GLOBAL_CHAT_KEY)
-        decrypted = box.decrypt(encrypted)
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE files SET last_accessed_at=CURRENT_TIMESTAMP WHERE id=%s", (file_id,))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def decrypt_legacy_file(enc_path: str, key_id: int) -> bytes:
+    with open(enc_path, "rb") as f:
+        encrypted = f.read()
+    box = key_ring.box(key_id)
+    return box.decrypt(encrypted)
+
+
+# ========= سلامت سرویس =========
+@app.get("/healthz")
+async def healthz():
+    """liveness: the process and its event loop respond"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """readiness: startup finished, not shutting down, and the database answers"""
+    if not _ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(run_db(ping_database), timeout=2)
     except Exception:
-        raise HTTPException(status_code=500, detail="Failed to decrypt file")
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    return {"status": "ready"}
 
-    return StreamingResponse(
-        io.BytesIO(decrypted),
-        media_type=mime_type,
-        headers={"Content-Disposition": f'inline; filename="{original_name}"'}
-    )
\ No newline at end of file
+
+def ping_database():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+    finally:
+        conn.close()
+
+
+# ========= متریک‌ها (Prometheus) =========
+@app.get("/metrics")
+async def get_metrics():
+    # walking uploads/ is disk I/O: refresh it off the loop, the collector reads the result
+    await run_io(metrics.directory_size, UPLOAD_DIR)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@metrics.collector
+def component_metrics():
+    upload_bytes, upload_files = metrics.last_directory_size(UPLOAD_DIR)
+    executors = executor_stats()
+    return [
+        metrics.stats_family("mapsim_db_pool", "MySQL connection pool", pool_stats()),
+        metrics.stats_family("mapsim_db_executor", "DB thread executor", executors["db"]),
+        metrics.stats_family("mapsim_io_executor", "File I/O thread executor", executors["io"]),
+        metrics.stats_family("mapsim_message_writer", "Write-behind message writer", message_writer.stats()),
+        metrics.stats_family("mapsim_fanout", "Websocket fanout", fanout_stats()),
+        metrics.stats_family("mapsim_membership_cache", "Chat membership cache", membership_cache.stats()),
+        metrics.stats_family("mapsim_history_cache", "Recent messages cache", recent_messages.stats()),
+        metrics.stats_family("mapsim_token_cache", "Verified JWT cache", token_cache.stats),
+        metrics.stats_family("mapsim_file_meta_cache", "Download metadata cache (/file/{id})", file_meta.stats()),
+        metrics.stats_family("mapsim_password_hash", "Password hashing pool", hash_stats),
+        metrics.stats_family("mapsim_key_ring", "File encryption key ring", key_ring.stats()),
+        metrics.stats_family("mapsim_reencrypt", "Background re-encryption onto the current key", reencrypt_stats()),
+        metrics.stats_family("mapsim_thumb_executor", "Thumbnail thread executor", executors["thumb"]),
+        metrics.stats_family("mapsim_thumbnails", "Image thumbnails", thumbnails.thumbnail_stats()),
+        ("mapsim_upload_dir_bytes", "gauge", "Size of the uploads directory", [({}, upload_bytes)]),
+        ("mapsim_upload_dir_files", "gauge", "Files in the uploads directory", [({}, upload_files)]),
+    ]
+
+
+if __name__ == "__main__":
+    # python -m app.main, and the PyInstaller binary (see pyinstaller.ini);
+    # freeze_support lets the frozen binary start the password hashing
+    # worker processes
+    import multiprocessing
+    import uvicorn
+
+    multiprocessing.freeze_support()
+    if "--migrate" in sys.argv:
+        # the binary has no `python -m app.migrations`: same thing, then exit
+        from app.create_db import create_database
+        from app.migrations import migrate
+
+        create_database()
+        migrate()
+        sys.exit(0)
+    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
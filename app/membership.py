@@ -0,0 +1,73 @@
+# app/membership.py
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_MAX_CHATS
+from app.executor import run_db
+
+
+class MembershipCache:
+    """
+    chat_id -> set of member user_ids, loaded once per chat with `loader`
+    and kept for `ttl` seconds; least recently used chats are evicted past
+    `max_chats`. Whoever writes to chat_members calls invalidate(chat_id);
+    today that is only get_or_create_private_chat, which writes a new
+    chat's members with the chat itself, so no other worker can have it
+    cached yet.
+
+    Thread-safe: invalidate() is called from DB executor threads.
+    """
+
+    def __init__(self, loader, ttl: float, max_chats: int):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._entries = OrderedDict()   # chat_id -> (expires_at, frozenset)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, chat_id, user_id):
+        """True/False from cache, or None when the chat is not cached."""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self._stats["hits"] += 1
+            return user_id in entry[1]
+
+    def store(self, chat_id, members):
+        with self._lock:
+            self._entries[chat_id] = (time.monotonic() + self.ttl, frozenset(members))
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, chat_id=None):
+        with self._lock:
+            if chat_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(chat_id, None)
+            self._stats["invalidations"] += 1
+
+    async def is_member(self, chat_id, user_id) -> bool:
+        cached = self.lookup(chat_id, user_id)
+        if cached is not None:
+            return cached
+        members = await run_db(self.loader, chat_id)
+        self.store(chat_id, members)
+        return user_id in members
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["chats"] = len(self._entries)
+        return data
+
+
+def create_membership_cache(loader) -> MembershipCache:
+    return MembershipCache(loader, ttl=MEMBERSHIP_CACHE_TTL, max_chats=MEMBERSHIP_CACHE_MAX_CHATS)
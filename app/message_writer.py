@@ -0,0 +1,246 @@
+# app/message_writer.py
+import asyncio
+import json
+import time
+
+from app.config import (
+    MESSAGE_BATCH_SIZE, MESSAGE_FLUSH_INTERVAL_MS, MESSAGE_QUEUE_MAX,
+    MESSAGE_FLUSH_MAX_ATTEMPTS, MESSAGE_STOP_TIMEOUT, MESSAGE_DEAD_LETTER_FILE,
+)
+from app.db import RowError
+from app.executor import run_db, run_io
+
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+
+    submit() only enqueues, so the websocket loop can broadcast right away;
+    a single background task drains the queue and hands rows to `flush_func`
+    in batches of up to `batch_size`, or whatever arrived within
+    `flush_interval` seconds of the first queued row.
+
+    The queue is bounded: when MySQL falls behind, submit() waits for room,
+    which slows the senders down instead of growing memory. A failed batch is
+    written again row by row when the database rejects a row (RowError), so
+    one bad row cannot hold back the others; any other error (database
+    down) is retried with backoff, up to `max_attempts` times. Rows that
+    still fail are appended to `dead_letter_path` (JSON lines) instead of
+    blocking the queue forever.
+    stop() drains everything still queued, for at most `stop_timeout`
+    seconds; what is left then is dead-lettered as well. A write already
+    running in the executor cannot be cancelled and may still commit, so
+    stop() waits for it and only dead-letters its rows if it failed.
+
+    `on_flush(batch, result)`, if given, is awaited after each written batch
+    with whatever flush_func returned.
+    """
+
+    def __init__(self, flush_func, batch_size: int, flush_interval: float, max_queue: int, on_flush=None,
+                 max_attempts: int = 8, stop_timeout: float = 30, dead_letter_path: str = None):
+        self.flush_func = flush_func
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.stop_timeout = stop_timeout
+        self.dead_letter_path = dead_letter_path
+        self._queue = None
+        self._task = None
+        self._closing = False
+        self._inflight = []    # rows taken from the queue, not yet stored or dead-lettered
+        self._pending = None   # (rows, future) of the write running in the executor
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "flush_errors": 0,
+            "dead_lettered": 0,
+            "backpressure_waits": 0,
+            "last_batch_size": 0,
+            "flush_time_max": 0.0,
+        }
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.stop_timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            if self._pending is not None:
+                rows, future = self._pending
+                try:
+                    result = await future
+                except Exception:
+                    pass   # not stored: dead-lettered below
+                else:
+                    self._record(len(rows), 0.0)
+                    self._forget(rows)
+                    await self._flushed(rows, result)
+                self._pending = None
+            left = list(self._inflight)
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    left.append(item)
+            print(f"[MESSAGE_WRITER] Not drained within {self.stop_timeout}s")
+            await self._dead_letter(left)
+        self._task = None
+
+    # ---------- public ----------
+    async def submit(self, *row):
+        if self._closing:
+            raise RuntimeError("Message writer is shutting down")
+        self.start()
+        if self._queue.full():
+            self._stats["backpressure_waits"] += 1
+        await self._queue.put(row)
+        self._stats["submitted"] += 1
+
+    def stats(self) -> dict:
+        data = dict(self._stats)
+        data["queued"] = self._queue.qsize() if self._queue else 0
+        data["max_queue"] = self.max_queue
+        return data
+
+    # ---------- internals ----------
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._inflight = list(batch)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        delay = 0.2
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                result = await self._write(batch)
+            except RowError as e:
+                self._stats["flush_errors"] += 1
+                print(f"[MESSAGE_WRITER] Flush of {len(batch)} messages rejected: {e}")
+                if len(batch) == 1:
+                    await self._dead_letter(batch)
+                    return
+                # one bad row must not hold back the others
+                await self._flush_rows(batch)
+                return
+            except Exception as e:
+                self._stats["flush_errors"] += 1
+                print(f"[MESSAGE_WRITER] Flush of {len(batch)} messages failed: {e}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5.0)
+                continue
+
+            self._record(len(batch), time.monotonic() - started)
+            self._forget(batch)
+            await self._flushed(batch, result)
+            return
+
+        print(f"[MESSAGE_WRITER] Giving up on {len(batch)} messages after {self.max_attempts} attempts")
+        await self._dead_letter(batch)
+
+    async def _write(self, batch):
+        future = asyncio.ensure_future(run_db(self.flush_func, batch))
+        self._pending = (batch, future)
+        try:
+            # shielded: if stop() cancels us, the write goes on and stop() waits for it
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._pending = None
+
+    def _forget(self, rows):
+        """rows are stored or dead-lettered: no longer in flight"""
+        done = {id(row) for row in rows}
+        self._inflight = [row for row in self._inflight if id(row) not in done]
+
+    async def _flush_rows(self, batch):
+        """one INSERT per row; rejected rows are dead-lettered"""
+        for row in batch:
+            await self._flush([row])
+
+    def _record(self, count: int, elapsed: float):
+        self._stats["written"] += count
+        self._stats["batches"] += 1
+        self._stats["last_batch_size"] = count
+        self._stats["flush_time_max"] = max(self._stats["flush_time_max"], elapsed)
+
+    async def _flushed(self, batch, result):
+        if self.on_flush is not None:
+            try:
+                await self.on_flush(batch, result)
+            except Exception as e:
+                # the rows are stored; never retry them because of this
+                print(f"[MESSAGE_WRITER] on_flush failed: {e}")
+
+    async def _dead_letter(self, rows):
+        if not rows:
+            return
+        self._forget(rows)
+        self._stats["dead_lettered"] += len(rows)
+        if not self.dead_letter_path:
+            print(f"[MESSAGE_WRITER] Dropped {len(rows)} messages")
+            return
+        try:
+            await run_io(_append_lines, self.dead_letter_path, rows)
+            print(f"[MESSAGE_WRITER] {len(rows)} messages written to {self.dead_letter_path}")
+        except Exception as e:
+            print(f"[MESSAGE_WRITER] Dropped {len(rows)} messages ({self.dead_letter_path}: {e})")
+
+
+def _append_lines(path: str, rows):
+    with open(path, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(list(row), ensure_ascii=False, default=str) + "\n")
+
+
+def create_message_writer(flush_func, on_flush=None) -> MessageWriter:
+    return MessageWriter(
+        flush_func,
+        batch_size=MESSAGE_BATCH_SIZE,
+        flush_interval=MESSAGE_FLUSH_INTERVAL_MS / 1000,
+        max_queue=MESSAGE_QUEUE_MAX,
+        on_flush=on_flush,
+        max_attempts=MESSAGE_FLUSH_MAX_ATTEMPTS,
+        stop_timeout=MESSAGE_STOP_TIMEOUT,
+        dead_letter_path=MESSAGE_DEAD_LETTER_FILE,
+    )
@@ -0,0 +1,245 @@
+# app/metrics.py
+"""
+Prometheus text-format metrics, without a client library.
+
+Counters and histograms are updated on the hot path, so they are plain
+dicts keyed by label values: one lookup and an add per update, under a
+lock only where executor threads update them too. Everything that
+already keeps its own numbers (pool, executors, writer, caches, clients)
+is read by a collector at scrape time instead, costing nothing in between.
+
+    GET /metrics
+"""
+import bisect
+import os
+import threading
+import time
+
+# seconds; covers a 1 ms query up to a slow 10 s upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value == value and value not in (float("inf"), float("-inf")) else "NaN"
+    return str(value)
+
+
+# ================== METRIC TYPES ==================
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        names = self.labels + ("le",)
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+def collector(func):
+    """
+    Register func() -> [(name, type, help, [(labels dict, value), ...]), ...],
+    called on every scrape.
+    """
+    _collectors.append(func)
+    return func
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for func in _collectors:
+        try:
+            families = func()
+        except Exception as e:
+            print(f"[METRICS] Collector {func.__name__} failed: {e}")
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def stats_family(name: str, help: str, stats: dict, label: str = "stat"):
+    """A component's stats() dict as one gauge family, one sample per key."""
+    samples = [({label: key}, value) for key, value in stats.items() if isinstance(value, (int, float))]
+    return (name, "gauge", help, samples)
+
+
+# ================== HOT PATH METRICS ==================
+
+http_request_seconds = Histogram(
+    "mapsim_http_request_seconds", "HTTP request latency by route", labels=("method", "route", "status")
+)
+ws_messages_received = Counter("mapsim_ws_messages_received_total", "Messages received from websocket clients")
+ws_frames_broadcast = Counter("mapsim_ws_frames_broadcast_total", "Frames queued to websocket clients")
+broadcast_seconds = Histogram(
+    "mapsim_broadcast_seconds", "Time to serialize and queue one broadcast",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+)
+db_query_seconds = Histogram("mapsim_db_query_seconds", "MySQL statement latency")
+crypto_bytes = Counter("mapsim_file_crypto_bytes_total", "Plaintext bytes encrypted/decrypted", labels=("op",))
+crypto_seconds = Counter("mapsim_file_crypto_seconds_total", "Time spent encrypting/decrypting files", labels=("op",))
+
+
+def metered_chunks(chunks, op: str):
+    """Wrap a chunk iterator, counting its bytes and the time spent producing them."""
+    while True:
+        started = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            crypto_seconds.inc(op, amount=time.perf_counter() - started)
+        crypto_bytes.inc(op, amount=len(chunk))
+        yield chunk
+
+
+# ================== UPLOAD DIRECTORY ==================
+
+_dir_cache = {}   # path -> (measured_at, bytes, files)
+
+
+def directory_size(path: str, max_age: float = 60.0):
+    """
+    (bytes, files) under path; walked at most once per max_age seconds.
+    Blocking: call it on the I/O executor, collectors read last_directory_size.
+    """
+    cached = _dir_cache.get(path)
+    if cached and time.monotonic() - cached[0] < max_age:
+        return cached[1], cached[2]
+    total = files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+                files += 1
+            except OSError:
+                pass
+    _dir_cache[path] = (time.monotonic(), total, files)
+    return total, files
+
+
+def last_directory_size(path: str):
+    """(bytes, files) from the last directory_size() walk, (0, 0) before the first."""
+    cached = _dir_cache.get(path)
+    return (cached[1], cached[2]) if cached else (0, 0)
+
+
+# ================== ASGI MIDDLEWARE ==================
+
+class MetricsMiddleware:
+    """
+    Per-route latency histogram. Pure ASGI (no BaseHTTPMiddleware), so
+    streaming responses and websockets pass through untouched; the route is
+    the path template, which keeps label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_request_seconds.observe(time.perf_counter() - started, scope["method"], path, status[0])
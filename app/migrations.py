@@ -0,0 +1,347 @@
+# app/migrations.py
+"""
+Versioned schema migrations.
+
+Run once per deploy (setup_service.sh does it before restarting the
+service), not on import:
+
+    python -m app.migrations            # apply pending steps
+    python -m app.migrations --status   # show current / latest version
+    ./mapsim_chat --migrate             # same, from the PyInstaller binary
+
+A server that starts on an older schema (a fresh database, or a binary
+deploy that skipped the step) applies the pending steps itself in
+create_database(), before it reports ready.
+
+Each step runs at most once; its number is recorded in `schema_version`.
+Steps are still written to be idempotent (they check information_schema
+first), so a step interrupted half way can simply be re-run. Index and
+column changes use online DDL (ALGORITHM=INPLACE/INSTANT, LOCK=NONE) so
+the large `messages` table keeps serving reads and writes while it runs.
+
+With DB_BACKEND=sqlite the same steps run through the SQLite variants of
+the helpers below (create_database() applies them on startup).
+"""
+import os
+import sys
+
+from mysql.connector import Error
+
+from app.config import SQLITE_PATH
+from app.db import get_connection, DIALECT
+
+LOCK_NAME = "mapsim_chat_migrations"
+LOCK_TIMEOUT = 60
+
+
+# ================== HELPERS ==================
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    if DIALECT == "sqlite":
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND tbl_name=%s AND name=%s",
+            (table, index)
+        )
+        return cursor.fetchone() is not None
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    if DIALECT == "sqlite":
+        cursor.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name=%s", (table, column))
+        return cursor.fetchone() is not None
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def add_index(cursor, table: str, index: str, columns: str, unique: bool = False):
+    if index_exists(cursor, table, index):
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if DIALECT == "sqlite":
+        cursor.execute(f"CREATE {kind} {index} ON {table} ({columns})")
+        return
+    cursor.execute(
+        f"ALTER TABLE {table} ADD {kind} {index} ({columns}), ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+
+def add_column(cursor, table: str, column: str, definition: str):
+    if column_exists(cursor, table, column):
+        return
+    if DIALECT == "sqlite":
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return
+    try:
+        # metadata-only change on MySQL 8.0.12+ / MariaDB 10.3+
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}, ALGORITHM=INSTANT")
+    except Error:
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN {column} {definition}, ALGORITHM=INPLACE, LOCK=NONE"
+        )
+
+
+# ================== STEPS ==================
+
+def m001_messages_chat_timestamp(cursor):
+    # history paging and per-chat time scans
+    add_index(cursor, "messages", "idx_messages_chat_ts", "chat_id, timestamp")
+
+
+def m002_unique_chat_name(cursor):
+    # chats are looked up by name on every websocket connect and /messages/
+    # call; concurrent get_or_create calls may already have left duplicates,
+    # so fold them into the lowest id before adding the unique index.
+    cursor.execute("""
+        SELECT name, MIN(id) FROM chats
+        WHERE name IS NOT NULL
+        GROUP BY name HAVING COUNT(*) > 1
+    """)
+    for name, keep_id in cursor.fetchall():
+        cursor.execute("SELECT id FROM chats WHERE name=%s AND id<>%s", (name, keep_id))
+        dup_ids = [row[0] for row in cursor.fetchall()]
+        for dup_id in dup_ids:
+            cursor.execute("UPDATE messages SET chat_id=%s WHERE chat_id=%s", (keep_id, dup_id))
+            cursor.execute("UPDATE chat_members SET chat_id=%s WHERE chat_id=%s", (keep_id, dup_id))
+            cursor.execute("DELETE FROM chats WHERE id=%s", (dup_id,))
+    add_index(cursor, "chats", "uq_chats_name", "name", unique=True)
+
+
+def m003_unique_chat_member(cursor):
+    # membership is looked up per (chat_id, user_id) on private chats
+    if DIALECT == "sqlite":
+        cursor.execute("""
+            DELETE FROM chat_members
+            WHERE id NOT IN (SELECT MIN(id) FROM chat_members GROUP BY chat_id, user_id)
+        """)
+    else:
+        cursor.execute("""
+            DELETE a FROM chat_members a
+            JOIN chat_members b
+              ON a.chat_id = b.chat_id AND a.user_id = b.user_id AND a.id > b.id
+        """)
+    add_index(cursor, "chat_members", "uq_chat_members_chat_user", "chat_id, user_id", unique=True)
+
+
+def m004_message_seq(cursor):
+    # per-chat message numbers for gap-free websocket resume; older
+    # messages keep NULL and are simply not resumable
+    add_column(cursor, "messages", "seq", "BIGINT NULL")
+    add_column(cursor, "chats", "last_seq", "BIGINT NOT NULL DEFAULT 0")
+    add_index(cursor, "messages", "idx_messages_chat_seq", "chat_id, seq")
+
+
+def m005_upload_accounting(cursor):
+    # upload size kept in the table (no directory walks) and the LRU order
+    # auto_clear_uploads.py evicts by; messages.file_id lets eviction delete
+    # just the messages that point at an evicted file
+    add_column(cursor, "files", "size_bytes", "BIGINT NOT NULL DEFAULT 0")
+    add_column(cursor, "files", "last_accessed_at", "DATETIME NULL")
+    add_column(cursor, "messages", "file_id", "VARCHAR(255) NULL")
+
+    cursor.execute("UPDATE files SET last_accessed_at = created_at WHERE last_accessed_at IS NULL")
+    cursor.execute("SELECT id, enc_path FROM files WHERE size_bytes = 0")
+    for file_id, enc_path in cursor.fetchall():
+        try:
+            size = os.path.getsize(enc_path)
+        except OSError:
+            continue
+        cursor.execute("UPDATE files SET size_bytes=%s WHERE id=%s", (size, file_id))
+
+    # file messages carry "/file/<id>"; walk the primary key in ranges so no
+    # single statement scans the whole table
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+    max_id = cursor.fetchone()[0]
+    for start in range(0, max_id, 10000):
+        cursor.execute("""
+            UPDATE messages SET file_id = SUBSTR(content, 7)
+            WHERE id > %s AND id <= %s AND type = 'file' AND content LIKE %s AND file_id IS NULL
+        """, (start, start + 10000, "/file/%"))
+
+    add_index(cursor, "files", "idx_files_lru", "last_accessed_at, size_bytes")
+    add_index(cursor, "messages", "idx_messages_file", "file_id")
+
+
+def m006_blobs(cursor):
+    # content-addressed upload storage (app/blobs.py); files rows point at
+    # a refcounted blob instead of owning their .enc file
+    if DIALECT == "sqlite":
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            digest CHAR(64) NULL,
+            key_id INT NULL,
+            enc_path VARCHAR(255) NOT NULL,
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            refcount INT NOT NULL DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    else:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            digest CHAR(64) NULL,
+            key_id INT NULL,
+            enc_path VARCHAR(255) NOT NULL,
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            refcount INT NOT NULL DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    add_index(cursor, "blobs", "uq_blobs_digest_key", "digest, key_id", unique=True)
+    add_column(cursor, "files", "blob_id", "BIGINT NULL")
+
+    # existing uploads: one blob each, without a digest (never deduplicated)
+    cursor.execute("SELECT id, enc_path, size_bytes FROM files WHERE blob_id IS NULL")
+    for file_id, enc_path, size_bytes in cursor.fetchall():
+        cursor.execute(
+            "INSERT INTO blobs (enc_path, size_bytes, refcount) VALUES (%s, %s, 1)",
+            (enc_path, size_bytes)
+        )
+        cursor.execute("UPDATE files SET blob_id=%s WHERE id=%s", (cursor.lastrowid, file_id))
+
+
+def m007_file_key_id(cursor):
+    # the key version each upload was encrypted with (chat_keys.KeyRing);
+    # older uploads keep NULL until a download or the re-encrypt job finds it
+    add_column(cursor, "files", "key_id", "INT NULL")
+    cursor.execute("""
+        UPDATE files SET key_id = (SELECT key_id FROM blobs WHERE blobs.id = files.blob_id)
+        WHERE key_id IS NULL AND blob_id IS NOT NULL
+    """)
+    add_index(cursor, "blobs", "idx_blobs_key", "key_id")
+
+
+def m008_blob_thumbnails(cursor):
+    # encrypted thumbnail of an image blob (app/thumbnails.py); shared by
+    # every upload of the same content. thumb_mime '' = no thumbnail possible
+    add_column(cursor, "blobs", "thumb_path", "VARCHAR(255) NULL")
+    add_column(cursor, "blobs", "thumb_key_id", "INT NULL")
+    add_column(cursor, "blobs", "thumb_mime", "VARCHAR(50) NULL")
+
+
+
+def m009_key_deploy(cursor):
+    # workers of one deploy share the session key (chat_keys.KeyRing.start)
+    add_column(cursor, "key_versions", "deploy_id", "VARCHAR(100) NULL")
+    add_index(cursor, "key_versions", "uq_key_versions_deploy", "deploy_id", unique=True)
+
+
+MIGRATIONS = [
+    (1, "index messages(chat_id, timestamp)", m001_messages_chat_timestamp),
+    (2, "unique index chats(name)", m002_unique_chat_name),
+    (3, "unique index chat_members(chat_id, user_id)", m003_unique_chat_member),
+    (4, "messages.seq / chats.last_seq", m004_message_seq),
+    (5, "files.size_bytes / last_accessed_at, messages.file_id", m005_upload_accounting),
+    (6, "blobs table, files.blob_id", m006_blobs),
+    (7, "files.key_id", m007_file_key_id),
+    (8, "blobs.thumb_path / thumb_key_id / thumb_mime", m008_blob_thumbnails),
+    (9, "key_versions.deploy_id", m009_key_deploy),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ================== RUNNER ==================
+
+def ensure_version_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+class _MigrationLock:
+    """Only one deploy / worker may migrate at a time."""
+
+    def __init__(self, cursor, timeout: int = LOCK_TIMEOUT):
+        self.cursor = cursor
+        self.timeout = timeout
+        self._fd = None
+
+    def __enter__(self):
+        if DIALECT == "sqlite":
+            import fcntl
+
+            self._fd = os.open(SQLITE_PATH + ".migrate.lock", os.O_CREAT | os.O_RDWR, 0o600)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return self
+        self.cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, self.timeout))
+        if self.cursor.fetchone()[0] != 1:
+            raise RuntimeError("[MIGRATIONS] Another migration is running")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fd is not None:
+            os.close(self._fd)   # releases the flock
+            self._fd = None
+            return
+        self.cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        self.cursor.fetchone()
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(lock_timeout: int = LOCK_TIMEOUT) -> int:
+    """همه migrationهای اجرا نشده را به ترتیب اجرا می‌کند؛ نسخه نهایی را برمی‌گرداند"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            ensure_version_table(cursor)
+            conn.commit()
+
+            # only one deploy at a time may migrate
+            with _MigrationLock(cursor, lock_timeout):
+                version = current_version(cursor)
+                for number, description, step in MIGRATIONS:
+                    if number <= version:
+                        continue
+                    print(f"[MIGRATIONS] Applying {number}: {description}")
+                    step(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version(version, description) VALUES (%s, %s)",
+                        (number, description)
+                    )
+                    conn.commit()
+                    version = number
+    finally:
+        conn.close()
+
+    print(f"[MIGRATIONS] Schema is at version {version}")
+    return version
+
+
+def status() -> int:
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            ensure_version_table(cursor)
+            return current_version(cursor)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from app.create_db import create_database
+
+    create_database()
+    if "--status" in sys.argv:
+        print(f"[MIGRATIONS] current={status()} latest={LATEST_VERSION}")
+    else:
+        migrate()
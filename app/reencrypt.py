@@ -0,0 +1,144 @@
+# app/reencrypt.py
+"""
+Background re-encryption of uploads onto the current key.
+
+Every restart (deploy) starts a new key version; uploads written under
+older ones stay readable through the key ring. This job moves blobs onto
+the current key a few at a time: KEY_REENCRYPT_BATCH files every
+KEY_REENCRYPT_INTERVAL seconds, each decrypted and re-encrypted a chunk at
+a time on the I/O executor. Once nothing uses an old key any more (and the
+key that replaced it is KEY_RETIRE_AFTER_HOURS old), its key_versions row
+is deleted, so the ring does not grow by one key per restart forever.
+
+Only the worker that created the newest key re-encrypts, so workers never
+move the same blob back and forth. A replaced .enc file is unlinked one
+round later, so a download that already looked up the old path can
+finish; when the job is stopped, they are unlinked right away.
+"""
+import asyncio
+import os
+import uuid
+
+from app import blobs
+from app.chat_keys import key_ring, retire_unused_keys
+from app.config import FILE_CHUNK_SIZE, KEY_REENCRYPT_BATCH, KEY_REENCRYPT_INTERVAL, KEY_RETIRE_AFTER_HOURS
+from app.executor import run_db, run_io
+from app.file_crypto import opens_with, reencrypt_file
+
+_stats = {"rounds": 0, "reencrypted": 0, "failed": 0, "keys_retired": 0}
+
+
+def find_file_key(enc_path: str):
+    """key_id an upload from before key_id was recorded opens with, newest key first (None if none)."""
+    for key_id in key_ring.ids():
+        if opens_with(enc_path, key_ring.get(key_id)):
+            return key_id
+    return None
+
+
+def reencrypt_blob_file(enc_path: str, key_id, new_path: str) -> int:
+    """Write a copy of enc_path under the current key to new_path; returns its size on disk."""
+    if key_id is None:
+        key_id = find_file_key(enc_path)
+        if key_id is None:
+            raise ValueError("no known key opens this file")
+    try:
+        reencrypt_file(enc_path, new_path, key_ring.get(key_id), key_ring.current, FILE_CHUNK_SIZE)
+    except BaseException:
+        remove_files([new_path])
+        raise
+    return os.path.getsize(new_path)
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[REENCRYPT] Failed to remove {path}: {e}")
+
+
+async def _finish(step):
+    """
+    Await an executor call even if we are cancelled meanwhile: the thread
+    runs on regardless, and its outcome decides which files to remove.
+    """
+    task = asyncio.ensure_future(step)
+    try:
+        return await asyncio.shield(task), False
+    except asyncio.CancelledError:
+        try:
+            return await task, True
+        except Exception:
+            raise asyncio.CancelledError()
+
+
+async def reencrypt_round(failed: set, unused: list) -> bool:
+    """
+    One batch; paths that are no longer referenced are appended to `unused`.
+    Returns False when there was nothing (left) to re-encrypt.
+    """
+    batch = await run_db(blobs.blobs_to_reencrypt, key_ring.current_id, KEY_REENCRYPT_BATCH, failed)
+    for blob_id, enc_path, key_id in batch:
+        new_path = os.path.join(os.path.dirname(enc_path), f"{uuid.uuid4().hex}.enc")
+        try:
+            size, cancelled = await _finish(run_io(reencrypt_blob_file, enc_path, key_id, new_path))
+        except Exception as e:
+            # missing file or unknown key: not retried until restart
+            failed.add(blob_id)
+            _stats["failed"] += 1
+            print(f"[REENCRYPT] Blob {blob_id} ({enc_path}): {e}")
+            continue
+        if cancelled:
+            unused.append(new_path)   # never moved
+            raise asyncio.CancelledError()
+        try:
+            moved, cancelled = await _finish(
+                run_db(blobs.move_blob, blob_id, enc_path, new_path, key_ring.current_id, size)
+            )
+        except Exception:
+            unused.append(new_path)   # not committed: the blob still uses enc_path
+            raise
+        unused += moved
+        _stats["reencrypted"] += 1
+        if cancelled:
+            raise asyncio.CancelledError()
+    return bool(batch)
+
+
+async def retire_keys():
+    retired = await run_db(retire_unused_keys, key_ring.current_id, KEY_RETIRE_AFTER_HOURS * 3600)
+    if retired:
+        key_ring.forget(retired)
+        _stats["keys_retired"] += len(retired)
+        print(f"[REENCRYPT] Retired key versions {retired}")
+
+
+async def reencrypt_loop():
+    """در lifespan اجرا می‌شود؛ با cancel متوقف می‌شود"""
+    if KEY_REENCRYPT_BATCH <= 0:
+        return
+    failed = set()
+    replaced = []
+    try:
+        while True:
+            await asyncio.sleep(KEY_REENCRYPT_INTERVAL)
+            try:
+                await run_io(remove_files, replaced)
+                replaced = []
+                if await run_db(key_ring.is_newest) and not await reencrypt_round(failed, replaced):
+                    await retire_keys()
+                _stats["rounds"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[REENCRYPT] Round failed: {e}")
+    finally:
+        # stopping: nothing is waiting for the replaced files any more
+        remove_files(replaced)
+
+
+def reencrypt_stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,111 @@
+# app/sequences.py
+import asyncio
+from urllib.parse import urlparse
+
+from app.config import BROKER_URL
+from app.db import get_connection, DIALECT
+from app.executor import run_db
+
+
+def load_last_seq(chat_id: int) -> int:
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM messages WHERE chat_id=%s", (chat_id,))
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def increment_seq(chat_id: int) -> int:
+    """شماره بعدی chat از chats.last_seq (اتمیک، برای چند worker); fallback when the broker is down"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            if DIALECT == "sqlite":
+                # the write transaction holds the database lock until commit
+                cursor.execute("""
+                    UPDATE chats SET last_seq =
+                        MAX(last_seq, (SELECT COALESCE(MAX(seq), 0) FROM messages WHERE chat_id=%s)) + 1
+                    WHERE id=%s
+                """, (chat_id, chat_id))
+                cursor.execute("SELECT last_seq FROM chats WHERE id=%s", (chat_id,))
+                seq = cursor.fetchone()[0]
+                conn.commit()
+                return seq
+
+            # GREATEST: numbers handed out by a single-worker run are only in messages
+            cursor.execute("""
+                UPDATE chats SET last_seq = LAST_INSERT_ID(
+                    GREATEST(last_seq, (SELECT COALESCE(MAX(seq), 0) FROM messages WHERE chat_id=%s)) + 1
+                )
+                WHERE id=%s
+            """, (chat_id, chat_id))
+            seq = cursor.lastrowid
+            conn.commit()
+    finally:
+        conn.close()
+    return seq
+
+
+class SequenceAllocator:
+    """
+    Per-chat message numbers 1, 2, 3, ... stamped on every message as `seq`,
+    so clients can tell exactly which messages they missed.
+
+    With one worker (memory:// broker) the counters live in memory and are
+    seeded from MAX(messages.seq) the first time a chat is used. With
+    several workers every number comes from the broker's shared counter
+    (broker.incr: a Redis script, or the unix socket hub), so numbers stay
+    unique and gap-free across workers without a database write per
+    message. Each worker still seeds a chat from MAX(messages.seq) and
+    follows the numbers it sees on the bus (observe()); that is the floor a
+    counter lost with the broker resumes from. If the broker cannot answer,
+    the number comes from chats.last_seq as before.
+    """
+
+    def __init__(self, shared: bool, broker=None):
+        self.shared = shared
+        self.broker = broker
+        self._last = {}      # chat_id -> highest seq handed out / seen
+        self._seeding = {}   # chat_id -> Future while loading MAX(seq)
+
+    async def next(self, chat_id: int) -> int:
+        if chat_id not in self._last:
+            await self._seed(chat_id)
+        if not self.shared:
+            self._last[chat_id] += 1
+            return self._last[chat_id]
+
+        try:
+            seq = await self.broker.incr(f"seq:{chat_id}", self._last[chat_id])
+        except ConnectionError as e:
+            print(f"[SEQ] Broker counter unavailable ({e}), using chats.last_seq")
+            seq = max(await run_db(increment_seq, chat_id), self._last[chat_id] + 1)
+        self.observe(chat_id, seq)
+        return seq
+
+    def observe(self, chat_id: int, seq: int):
+        """A message numbered elsewhere (another worker) went by."""
+        if seq is not None and seq > self._last.get(chat_id, 0):
+            self._last[chat_id] = seq
+
+    async def _seed(self, chat_id: int):
+        # concurrent first messages of a chat wait for a single MAX(seq) query
+        while chat_id not in self._last:
+            pending = self._seeding.get(chat_id)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            pending = asyncio.get_running_loop().create_future()
+            self._seeding[chat_id] = pending
+            try:
+                self._last.setdefault(chat_id, await run_db(load_last_seq, chat_id))
+            finally:
+                del self._seeding[chat_id]
+                pending.set_result(None)
+
+
+def create_sequence_allocator(broker) -> SequenceAllocator:
+    shared = urlparse(BROKER_URL).scheme not in ("", "memory")
+    return SequenceAllocator(shared=shared, broker=broker)
@@ -161,34 +161,112 @@ function logout() {
 }
 
 // ================= Load Messages =================
+// History is paged newest-first; older pages load when scrolling to the top.
+let historyCursor = null;
+let historyLoading = false;
+
+// Every message carries a per-chat `seq`. lastSeq is the highest seq up to
+// which nothing is missing; a reconnect asks the server for what came after.
+let lastSeq = null;
+let seenSeqs = new Set();
+
+function resetSeq() {
+    lastSeq = null;
+    seenSeqs = new Set();
+}
+
+// false if this message was already shown (replayed after a reconnect)
+function trackSeq(seq) {
+    if (seq === null || seq === undefined) return true;
+    if ((lastSeq !== null && seq <= lastSeq) || seenSeqs.has(seq)) return false;
+    seenSeqs.add(seq);
+    if (lastSeq === null) lastSeq = seq - 1;
+    while (seenSeqs.has(lastSeq + 1)) {
+        lastSeq++;
+        seenSeqs.delete(lastSeq);
+    }
+    return true;
+}
+
+async function fetchHistoryPage(chatName, beforeId = null) {
+    let url = `/messages/?chat_id=${chatName}`;
+    if (beforeId !== null) url += `&before_id=${beforeId}`;
+
+    const res = await fetch(url, {
+        headers: { "Authorization": `Bearer ${token}` }
+    });
+    if (!res.ok) return null;
+    return res.json();
+}
+
 async function loadMessages(chatName = currentChatName) {
     const messagesDiv = document.getElementById("messages");
     messagesDiv.innerHTML = "";
+    historyCursor = null;
 
     try {
-        const res = await fetch(`/messages/?chat_id=${chatName}`, {
-            headers: { "Authorization": `Bearer ${token}` }
-        });
-        if (res.ok) {
-            const data = await res.json();
-            for (const msg of data.messages) {
-                displayMessage(msg);
+        const data = await fetchHistoryPage(chatName);
+        resetSeq();
+        if (data) {
+            // صفحه از جدید به قدیم است؛ برای نمایش برعکس می‌کنیم
+            for (const msg of [...data.messages].reverse()) {
+                if (trackSeq(msg.seq)) displayMessage(msg);
             }
+            historyCursor = data.next_cursor;
         }
     } catch (e) {
         console.error("Error loading messages", e);
     }
 }
 
+async function loadOlderMessages() {
+    if (historyLoading || historyCursor === null || !token) return;
+    historyLoading = true;
+
+    const chatName = currentChatName;
+    const messagesDiv = document.getElementById("messages");
+
+    try {
+        const data = await fetchHistoryPage(chatName, historyCursor);
+        if (data && chatName === currentChatName) {
+            const prevHeight = messagesDiv.scrollHeight;
+            for (const msg of data.messages) {
+                displayMessage(msg, { prepend: true });
+            }
+            // keep the viewport on the message the user was looking at
+            messagesDiv.scrollTop += messagesDiv.scrollHeight - prevHeight;
+            historyCursor = data.next_cursor;
+        }
+    } catch (e) {
+        console.error("Error loading older messages", e);
+    } finally {
+        historyLoading = false;
+    }
+}
+
 // ================= WebSocket =================
-function connectWS(chatName = currentChatName) {
+let reconnectDelay = 500;
+let reconnectTimer = null;
+
+function connectWS(chatName = currentChatName, resume = false) {
     //console.log("در حال اتصال به WebSocket، chatName =", chatName); // 🔹 این خط برای دیبا
     if (!token) return;
 
-    if (ws && ws.readyState === WebSocket.OPEN) ws.close();
+    clearTimeout(reconnectTimer);
+    if (ws) {
+        ws.onclose = null;
+        if (ws.readyState === WebSocket.OPEN) ws.close();
+    }
 
     const wsProto = location.protocol === "https:" ? "wss" : "ws";
-    ws = new WebSocket(`${wsProto}://${location.host}/ws?token=${token}&chat_name=${chatName}`);
+    let url = `${wsProto}://${location.host}/ws?token=${token}&chat_name=${chatName}`;
+    // فقط پیام‌های از دست رفته را بگیر، نه کل تاریخچه
+    if (resume && lastSeq !== null) url += `&resume_from=${lastSeq}`;
+    ws = new WebSocket(url);
+
+    ws.onopen = () => {
+        reconnectDelay = 500;
+    };
 
     ws.onmessage = e => {
         const msg = JSON.parse(e.data);
@@ -197,13 +275,31 @@ function connectWS(chatName = currentChatName) {
             log("کاربران آنلاین:", msg.users);
             onlineUsers = msg.users;
             renderOnlineUsers();
+        } else if (msg.type === "presence") {
+            // فقط تغییرات (joined / left) نسبت به لیست قبلی
+            const left = new Set(msg.left);
+            onlineUsers = onlineUsers.filter(name => !left.has(name));
+            msg.joined.forEach(name => {
+                if (!onlineUsers.includes(name)) onlineUsers.push(name);
+            });
+            renderOnlineUsers();
+        } else if (msg.type === "error") {
+            // the server refused what we sent (too long / malformed)
+            console.warn("Message rejected:", msg.detail);
+        } else if (msg.type === "resync") {
+            // too much was missed to replay; reload the newest page
+            loadMessages(chatName);
         } else {
-            displayMessage(msg);
+            if (trackSeq(msg.seq)) displayMessage(msg);
         }
     };
 
-    ws.onclose = () => {
+    ws.onclose = e => {
         console.warn("WebSocket closed.");
+        if (e.code === 4003) return;  // invalid token / not a member
+        // network blip: reconnect and resume from lastSeq
+        reconnectTimer = setTimeout(() => connectWS(chatName, true), reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 10000);
     };
 }
 
@@ -273,10 +369,19 @@ async function sendMessage() {
     }
 }
 // ================= Display Message =================
-async function displayMessage(msg) {
+async function displayMessage(msg, { prepend = false } = {}) {
     const messages = document.getElementById("messages");
     const wrap = document.createElement("div");
 
+    const place = () => {
+        if (prepend) {
+            messages.insertBefore(wrap, messages.firstChild);
+        } else {
+            messages.appendChild(wrap);
+            messages.scrollTop = messages.scrollHeight;
+        }
+    };
+
     wrap.className = "message " + (msg.username === username ? "me" : "other");
 
     // ================= FILE =================
@@ -291,8 +396,40 @@ async function displayMessage(msg) {
             <div class="time">${formatTime(msg.timestamp)}</div>
         `;
 
-        messages.appendChild(wrap);
-        messages.scrollTop = messages.scrollHeight;
+        place();
+
+        // تصویر: اول پیش‌نمایش کوچک؛ فایل کامل با کلیک
+        if (msg.mime && msg.mime.startsWith("image/")) {
+            try {
+                const thumb = await axios.get(fileUrl + "/thumb", {
+                    responseType: "blob",
+                    headers: {
+                        Authorization: `Bearer ${token}`
+                    }
+                });
+                const thumbUrl = URL.createObjectURL(thumb.data);
+                const bubble = wrap.querySelector(".bubble");
+                bubble.innerHTML = `<img src="${thumbUrl}" class="chat-image chat-thumb">`;
+                bubble.querySelector("img").addEventListener("click", async (e) => {
+                    try {
+                        const res = await axios.get(fileUrl, {
+                            responseType: "blob",
+                            headers: {
+                                Authorization: `Bearer ${token}`
+                            }
+                        });
+                        e.target.src = URL.createObjectURL(res.data);
+                        e.target.classList.remove("chat-thumb");
+                        URL.revokeObjectURL(thumbUrl);
+                    } catch (err) {
+                        console.error(err);
+                    }
+                }, { once: true });
+                return;
+            } catch (err) {
+                // 404: پیش‌نمایش هنوز آماده نیست → فایل کامل
+            }
+        }
 
         try {
             const res = await axios.get(fileUrl, {
@@ -350,8 +487,7 @@ async function displayMessage(msg) {
         <div class="time">${formatTime(msg.timestamp)}</div>
     `;
 
-    messages.appendChild(wrap);
-    messages.scrollTop = messages.scrollHeight;
+    place();
 
     e2ee.decryptMessage(msg.text)
         .then(plain => {
@@ -415,6 +551,9 @@ window.startPrivateChat = startPrivateChat;
 
 document.addEventListener("DOMContentLoaded", async () => {
     document.getElementById("loginBtn").addEventListener("click", login);
+    document.getElementById("messages").addEventListener("scroll", e => {
+        if (e.target.scrollTop < 80) loadOlderMessages();
+    });
     document.getElementById("showRegister").addEventListener("click", showRegister);
 
     token = localStorage.getItem("token");
@@ -0,0 +1,189 @@
+# app/thumbnails.py
+"""
+Small encrypted previews of image uploads, for the message list.
+
+After /upload/ stores a new image blob, a background task renders a
+thumbnail (longest side THUMB_SIZE) on the thumbnail executor and writes
+it, encrypted under the current key, next to the blob as
+<blob>.<random>.thumb.enc. The blob row records it (thumb_path /
+thumb_key_id / thumb_mime), so deduplicated uploads share one thumbnail. /file/{id}/thumb
+serves it; an image without one (older upload, or a blob moved by the
+re-encrypt job) is queued when its thumbnail is first asked for.
+
+File messages carry the upload's mime type, so chat.js only asks for
+/file/{id}/thumb for images. Needs Pillow (requirements.txt); without it
+thumbnails are off and /thumb answers 404, which chat.js treats as "load
+the full file".
+"""
+import asyncio
+import io
+import os
+import tempfile
+
+from nacl.secret import SecretBox
+
+from app.chat_keys import key_ring
+from app.config import FILE_CHUNK_SIZE, THUMB_SIZE, THUMB_MAX_SOURCE_MB, THUMB_MAX_PIXELS
+from app.db import get_connection
+from app.executor import run_db, run_io, run_thumb
+from app.file_crypto import encrypt_stream, decrypt_chunks, is_chunked, plain_size_of
+
+try:
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = THUMB_MAX_PIXELS
+except ImportError:
+    Image = None
+
+# blob ids with a thumbnail being rendered, and their tasks (kept referenced)
+_pending = set()
+_tasks = set()
+_stats = {"rendered": 0, "skipped": 0, "failed": 0}
+
+
+def enabled() -> bool:
+    return Image is not None
+
+
+def wanted(mime_type) -> bool:
+    return enabled() and bool(mime_type) and mime_type.startswith("image/") and mime_type != "image/svg+xml"
+
+
+# ================== RENDER ==================
+
+def read_source(enc_path: str, key_id: int):
+    """Decrypted image bytes, or None if it is too big to preview."""
+    limit = THUMB_MAX_SOURCE_MB * 1024 * 1024
+    if not is_chunked(enc_path):
+        # one sealed box: nonce and MAC on top of the plaintext
+        if os.path.getsize(enc_path) - SecretBox.NONCE_SIZE - SecretBox.MACBYTES > limit:
+            return None
+        with open(enc_path, "rb") as f:
+            return key_ring.box(key_id).decrypt(f.read())
+    if plain_size_of(enc_path) > limit:
+        return None
+    return b"".join(decrypt_chunks(enc_path, key_ring.get(key_id)))
+
+
+def render_thumbnail(data: bytes):
+    """
+    (image bytes, mime type) of the preview: PNG if it has transparency,
+    JPEG otherwise. None past THUMB_MAX_PIXELS.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # Pillow only raises past twice MAX_IMAGE_PIXELS (it warns below);
+        # the header is enough to check, nothing is decoded yet
+        if img.width * img.height > THUMB_MAX_PIXELS:
+            return None
+        # JPEG: let the decoder downscale while decoding (much less work for photos)
+        img.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img.save(out, "PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        img.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+        return out.getvalue(), "image/jpeg"
+
+
+def write_thumbnail(enc_path: str, key_id: int):
+    """Render and encrypt the thumbnail of a blob: (thumb_path, mime), or None if there can be none."""
+    data = read_source(enc_path, key_id)
+    if data is None:
+        return None
+    try:
+        rendered = render_thumbnail(data)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None   # not an image Pillow can read
+    if rendered is None:
+        return None
+    thumb, mime = rendered
+    # a name of its own: another worker may be rendering the same blob
+    base = os.path.splitext(enc_path)[0]
+    fd, thumb_path = tempfile.mkstemp(dir=os.path.dirname(base), prefix=os.path.basename(base) + ".", suffix=".thumb.enc")
+    os.close(fd)
+    try:
+        encrypt_stream(io.BytesIO(thumb), thumb_path, key_ring.current, FILE_CHUNK_SIZE)
+    except BaseException:
+        os.unlink(thumb_path)
+        raise
+    return thumb_path, mime
+
+
+async def _make(blob_id: int, enc_path: str, key_id: int):
+    try:
+        result = await run_thumb(write_thumbnail, enc_path, key_id)
+        if result is None:
+            _stats["skipped"] += 1
+            await run_db(set_thumbnail, blob_id, enc_path, None, None, "")
+            return
+        thumb_path, mime = result
+        if not await run_db(set_thumbnail, blob_id, enc_path, thumb_path, key_ring.current_id, mime):
+            # evicted, moved, or another worker stored its thumbnail first
+            await run_io(os.unlink, thumb_path)
+            return
+        _stats["rendered"] += 1
+    except Exception as e:
+        _stats["failed"] += 1
+        print(f"[THUMBS] Blob {blob_id} ({enc_path}): {e}")
+    finally:
+        _pending.discard(blob_id)
+
+
+def schedule(blob_id: int, enc_path: str, key_id, mime_type):
+    """Render the thumbnail of a blob in the background (no-op if not an image or already queued)."""
+    if not wanted(mime_type) or key_id is None or blob_id in _pending:
+        return
+    _pending.add(blob_id)
+    task = asyncio.create_task(_make(blob_id, enc_path, key_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def cancel_pending():
+    for task in list(_tasks):
+        task.cancel()
+
+
+def thumbnail_stats() -> dict:
+    return dict(_stats, pending=len(_pending))
+
+
+# ================== DB ==================
+
+def set_thumbnail(blob_id: int, enc_path: str, thumb_path, thumb_key_id, thumb_mime: str) -> bool:
+    """
+    Record a blob's thumbnail, unless the blob is gone, was moved to another
+    file or already has one. Only NULLs are overwritten, so a match always
+    changes the row and rowcount is 1 without CLIENT_FOUND_ROWS.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE blobs SET thumb_path=%s, thumb_key_id=%s, thumb_mime=%s
+                WHERE id=%s AND enc_path=%s AND thumb_path IS NULL AND thumb_mime IS NULL
+            """, (thumb_path, thumb_key_id, thumb_mime, blob_id, enc_path))
+            conn.commit()
+            return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+def get_thumb_row(file_id: str):
+    """(mime_type, blob_id, enc_path, key_id, thumb_path, thumb_key_id, thumb_mime) of an upload"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT f.mime_type, b.id, b.enc_path, b.key_id, b.thumb_path, b.thumb_key_id, b.thumb_mime
+                FROM files f JOIN blobs b ON b.id = f.blob_id
+                WHERE f.id=%s
+            """, (file_id,))
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def read_thumbnail(thumb_path: str, key_id: int) -> bytes:
+    return b"".join(decrypt_chunks(thumb_path, key_ring.get(key_id)))
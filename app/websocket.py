@@ -1,23 +1,39 @@
 # app/websocket.py
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPException
-from jose import jwt, JWTError, ExpiredSignatureError
+from jose import JWTError, ExpiredSignatureError
 import json
-from app.db import get_connection
-from app.auth import SECRET_KEY, ALGORITHM
+from app.db import get_connection, DIALECT
+from app.executor import run_db
+from app.message_writer import create_message_writer
+from app.fanout import Connection, fanout
+from app.broker import broker, MAX_FRAME
+from app.membership import create_membership_cache
+from app.history import create_recent_messages, create_live_tail, message_from_row
+from app.sequences import create_sequence_allocator
+from app.metrics import ws_messages_received, collector
+from app.config import PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_DEBOUNCE_MS, PRESENCE_SNAPSHOT_INTERVAL, RESUME_MAX_REPLAY
+from app.config import MESSAGE_MAX_BYTES
+from typing import Optional
+import asyncio
+import re
+import time
+from app.auth import decode_token
 from datetime import datetime, timezone
 
 router = APIRouter()
 
 # ================== GLOBAL STATE ==================
-clients = {}       # chat_id -> { user_id -> [ws1, ws2,...] }
-online_users = {}  # user_id -> username
+clients = {}       # chat_id -> { user_id -> [Connection, ...] }
+online_users = {}  # user_id -> username (this worker)
+user_connections = {}  # user_id -> number of open sockets on this worker
+remote_presence = {}  # node_id -> (last_seen, { user_id -> username }) other workers
 
 # ================== HELPERS ==================
 
 def verify_token(token: str):
     """JWT verification"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username = payload.get("username")
         user_id = payload.get("sub")
         if not username or not user_id:
@@ -51,67 +67,425 @@ def get_or_create_private_chat(user_ids: list):
                         (chat_id, uid)
                     )
                 conn.commit()
+                membership_cache.invalidate(chat_id)
     finally:
         conn.close()
     return chat_id, chat_name
 
-def check_membership(chat_id: int, user_id: int) -> bool:
+def get_or_create_global_chat():
+    # اتصال به دیتابیس
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT 1 FROM chat_members WHERE chat_id=%s AND user_id=%s", (chat_id, user_id)
-            )
-            res = cursor.fetchone()
+            cursor.execute("SELECT id FROM chats WHERE name='global'")
+            row = cursor.fetchone()
+            if row:
+                chat_id = row[0]
+            else:
+                cursor.execute(
+                    "INSERT INTO chats(name, is_group, is_private) VALUES(%s, %s, %s)",
+                    ("global", 0, 0)
+                )
+                chat_id = cursor.lastrowid
+                conn.commit()
+    finally:
+        conn.close()
+    return chat_id
+
+def load_chat_members(chat_id: int) -> set:
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM chat_members WHERE chat_id=%s", (chat_id,))
+            return {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+# per-message authorization without a DB round trip
+membership_cache = create_membership_cache(load_chat_members)
+
+def get_chat_id(name: str):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM chats WHERE name=%s", (name,))
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def fetch_messages(chat_id, limit: int, before_id=None, after_id=None):
+    """chat_id: id یا نام chat؛ (messages newest first, has_more)"""
+    chat_id = str(chat_id)
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            if chat_id.isdigit():
+                real_chat_id = int(chat_id)
+            else:
+                cursor.execute("SELECT id FROM chats WHERE name=%s", (chat_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return [], False
+                real_chat_id = row[0]
+
+            # (chat_id, id) is covered by the chat_id index (InnoDB appends the
+            # primary key), so each page is a short range scan.
+            if after_id is not None:
+                where, order, params = "AND m.id > %s", "ASC", (real_chat_id, after_id, limit + 1)
+            elif before_id is not None:
+                where, order, params = "AND m.id < %s", "DESC", (real_chat_id, before_id, limit + 1)
+            else:
+                where, order, params = "", "DESC", (real_chat_id, limit + 1)
+
+            cursor.execute(f"""
+                SELECT m.id, u.username, m.type, m.content, m.timestamp, m.seq, f.mime_type
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                LEFT JOIN files f ON f.id = m.file_id
+                WHERE m.chat_id=%s {where}
+                ORDER BY m.id {order}
+                LIMIT %s
+            """, params)
+
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is not None:
+        rows.reverse()
+
+    return [message_from_row(row) for row in rows], has_more
+
+def fetch_messages_since(chat_id: int, seq: int, limit: int) -> list:
+    """پیام‌های بعد از seq (قدیمی به جدید)، برای resume"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT m.id, u.username, m.type, m.content, m.timestamp, m.seq, f.mime_type
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                LEFT JOIN files f ON f.id = m.file_id
+                WHERE m.chat_id=%s AND m.seq > %s
+                ORDER BY m.seq
+                LIMIT %s
+            """, (chat_id, seq, limit))
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return [message_from_row(row) for row in rows]
+
+# newest messages of active chats, for /messages/ without MySQL
+recent_messages = create_recent_messages(fetch_messages, get_chat_id)
+# last broadcast frames per chat, for /ws?resume_from=
+live_tail = create_live_tail()
+sequences = create_sequence_allocator(broker)
+
+_autoinc_step = None
+
+# what /upload/ returns as file_url
+_FILE_URL = re.compile(r"/file/[0-9a-f]{32}")
+
+
+def parse_frame(data: str):
+    """
+    (msg_type, content) of a client frame, or None if it cannot be stored:
+    every frame goes through the shared write-behind batch, so a bad one is
+    rejected here instead of failing the INSERT for everybody's messages.
+    """
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    msg_type = payload.get("type", "text")
+    content = payload.get("text") or payload.get("file_path")
+    if not isinstance(content, str) or not content:
+        return None
+    if msg_type == "text":
+        if len(content.encode("utf-8")) > MESSAGE_MAX_BYTES:
+            return None
+    elif msg_type == "file":
+        if not _FILE_URL.fullmatch(content):
+            return None
+    else:
+        return None
+    return msg_type, content
+
+
+def file_id_of(msg_type: str, content: str):
+    """file messages carry "/file/<id>"; the id is stored so upload eviction can find them"""
+    if msg_type == "file" and content and content.startswith("/file/"):
+        return content[len("/file/"):]
+    return None
+
+def get_file_mime(file_id: str):
+    """mime type of an upload, or None if there is no such file"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT mime_type FROM files WHERE id=%s", (file_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
     finally:
         conn.close()
-    return bool(res)
 
-def save_message(chat_id: int, user_id: int, msg_type: str, content: str, ts: str):
+def save_messages(rows: list):
+    """
+    ذخیره دسته‌ای پیام‌ها با یک INSERT چند سطری
+    rows: [(chat_id, user_id, msg_type, content, ts, seq, username, mime), ...]
+    username and mime are not stored, they only travel along for the history cache.
+    Returns the new message ids, in row order.
+    """
+    global _autoinc_step
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+    params = []
+    for row in rows:
+        params.extend(row[:6])
+        params.append(file_id_of(row[2], row[3]))
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
+            if _autoinc_step is None:
+                if DIALECT == "sqlite":
+                    _autoinc_step = 1
+                else:
+                    cursor.execute("SELECT @@auto_increment_increment")
+                    _autoinc_step = cursor.fetchone()[0]
             cursor.execute(
-                """
-                INSERT INTO messages(chat_id, user_id, type, content, timestamp)
-                VALUES(%s, %s, %s, %s, %s)
+                f"""
+                INSERT INTO messages(chat_id, user_id, type, content, timestamp, seq, file_id)
+                VALUES {placeholders}
                 """,
-                (chat_id, user_id, msg_type, content, ts)
+                params
             )
+            # InnoDB reserves the ids of a multi-row INSERT ... VALUES in one
+            # go (the row count is known up front); lastrowid is the first
+            # one. SQLite (single writer) reports the last one instead.
+            first_id = cursor.lastrowid
+            if DIALECT == "sqlite":
+                first_id -= len(rows) - 1
             conn.commit()
     finally:
         conn.close()
+    return [first_id + i * _autoinc_step for i in range(len(rows))]
+
+async def on_messages_saved(rows, ids):
+    """پیام‌های ذخیره شده (با id) به history cache همه workerها"""
+    by_chat = {}
+    for (chat_id, _, msg_type, content, ts, seq, username, mime), msg_id in zip(rows, ids):
+        by_chat.setdefault(chat_id, []).append(
+            {"id": msg_id, "username": username, "type": msg_type, "text": content, "timestamp": ts, "seq": seq,
+             "mime": mime}
+        )
+    for chat_id, messages in by_chat.items():
+        for batch in frame_batches(messages, MAX_FRAME // 2):
+            await broker.publish("history", {"chat_id": chat_id, "messages": batch})
+
+def frame_batches(messages: list, budget: int):
+    """
+    Consecutive runs of messages whose JSON stays under `budget` bytes: a
+    flush of 200 long messages would not fit in one broker frame (the unix
+    hub drops a peer that sends a line past MAX_FRAME).
+    """
+    batch, size = [], 0
+    for message in messages:
+        length = len(json.dumps(message)) + 1
+        if batch and size + length > budget:
+            yield batch
+            batch, size = [], 0
+        batch.append(message)
+        size += length
+    if batch:
+        yield batch
+
+message_writer = create_message_writer(save_messages, on_flush=on_messages_saved)
 
 # ================== BROADCAST ==================
+def iter_connections(chat_id=None):
+    chats = clients.values() if chat_id is None else [clients.get(chat_id, {})]
+    for users in chats:
+        for conns in users.values():
+            yield from conns
+
+def online_users_map():
+    users = {}
+    for _, node_users in remote_presence.values():
+        users.update(node_users)
+    users.update(online_users)
+    return users
+
+def all_online_users():
+    return list(online_users_map().values())
+
 async def broadcast_online_users(exclude_ws=None):
-    data = {"type": "online_users", "users": list(online_users.values())}
-    
-    ws_lists = clients.get("global", {}).values()
-    
-    for ws_list in ws_lists:
-        for ws in ws_list.copy():
-            if ws == exclude_ws:
-                continue
-            try:
-                await ws.send_text(json.dumps(data))
-            except RuntimeError:
-                # حذف ws قطع شده
-                ws_list.remove(ws)
+    """snapshot کامل؛ فقط برای اتصال جدید و snapshot دوره‌ای"""
+    global presence_announced
+    data = {"type": "online_users", "users": all_online_users()}
+    presence_announced = online_users_map()
+    # presence goes to every connected socket, whatever chat it is in
+    fanout(list(iter_connections()), data, exclude=exclude_ws)
 
 async def broadcast_message(chat_id, payload):
     if chat_id not in clients:
         return
-    for ws_list in clients[chat_id].values():
-        for ws in ws_list.copy():
-            try:
-                await ws.send_text(json.dumps(payload))
-            except RuntimeError:
-                ws_list.remove(ws)
+    fanout(list(iter_connections(chat_id)), payload)
+
+# ================== PRESENCE ==================
+# Changes are not sent one by one: presence_changed() arms a short debounce
+# timer and flush_presence() then sends every socket one
+# {"type": "presence", "joined": [...], "left": [...]} frame with the net
+# difference since the last announcement. A reconnect storm of N users thus
+# costs one O(N) frame per window instead of N full lists.
+
+presence_announced = {}   # user_id -> username as last announced to sockets
+_presence_task = None
+_local_presence_dirty = False
+
+def presence_changed(local: bool = True):
+    global _presence_task, _local_presence_dirty
+    if local:
+        _local_presence_dirty = True
+    if _presence_task is None:
+        _presence_task = asyncio.create_task(_flush_presence_later())
+
+async def _flush_presence_later():
+    global _presence_task
+    try:
+        await asyncio.sleep(PRESENCE_DEBOUNCE_MS / 1000)
+    finally:
+        _presence_task = None
+    await flush_presence()
+
+async def flush_presence():
+    global presence_announced, _local_presence_dirty
+    current = online_users_map()
+    joined = [name for uid, name in current.items() if uid not in presence_announced]
+    left = [name for uid, name in presence_announced.items() if uid not in current]
+    presence_announced = current
+
+    if joined or left:
+        fanout(list(iter_connections()), {"type": "presence", "joined": joined, "left": left})
+
+    if _local_presence_dirty:
+        _local_presence_dirty = False
+        await publish_presence()
+
+# ================== PUB/SUB (between workers) ==================
+async def publish_presence(users=None):
+    if users is None:
+        users = list(online_users.items())
+    await broker.publish("presence", {"node": broker.node_id, "users": users})
+
+async def on_chat_message(message):
+    # tail and sockets are updated in one step, see replay_missed()
+    live_tail.add(message["chat_id"], message["payload"])
+    sequences.observe(message["chat_id"], message["payload"].get("seq"))
+    await broadcast_message(message["chat_id"], message["payload"])
+
+async def on_presence(message):
+    node = message["node"]
+    if node == broker.node_id:
+        return
+    users = {int(uid): name for uid, name in message["users"]}
+    previous = remote_presence.get(node, (0, {}))[1]
+    if users:
+        remote_presence[node] = (time.monotonic(), users)
+    else:
+        remote_presence.pop(node, None)
+    if users != previous:
+        presence_changed(local=False)
+
+async def on_history(message):
+    recent_messages.add(message["chat_id"], message["messages"])
+
+broker.subscribe("chat", on_chat_message)
+broker.subscribe("presence", on_presence)
+broker.subscribe("history", on_history)
+
+async def presence_heartbeat():
+    """
+    هر چند ثانیه لیست آنلاین‌های این worker را منتشر می‌کند، workerهایی که
+    دیگر heartbeat نمی‌فرستند را حذف می‌کند و هر از گاهی یک snapshot کامل
+    برای اصلاح deltaهای از دست رفته می‌فرستد
+    """
+    last_snapshot = time.monotonic()
+    while True:
+        await asyncio.sleep(PRESENCE_HEARTBEAT_INTERVAL)
+        await publish_presence()
+        cutoff = time.monotonic() - 3 * PRESENCE_HEARTBEAT_INTERVAL
+        stale = [node for node, (seen, _) in remote_presence.items() if seen < cutoff]
+        for node in stale:
+            del remote_presence[node]
+
+        if time.monotonic() - last_snapshot >= PRESENCE_SNAPSHOT_INTERVAL:
+            last_snapshot = time.monotonic()
+            await broadcast_online_users()
+        elif stale:
+            presence_changed(local=False)
+
+@collector
+def websocket_metrics():
+    connections = sum(len(conns) for users in clients.values() for conns in users.values())
+    return [
+        ("mapsim_ws_connections", "gauge", "Open websocket connections on this worker", [({}, connections)]),
+        ("mapsim_ws_active_chats", "gauge", "Chats with at least one local connection", [({}, len(clients))]),
+        ("mapsim_online_users", "gauge", "Online users", [
+            ({"scope": "local"}, len(online_users)),
+            ({"scope": "all"}, len(online_users_map())),
+        ]),
+    ]
+
+# ================== RESUME ==================
+async def replay_missed(conn, chat_id: int, chat_name: str, resume_from: int) -> bool:
+    """
+    پیام‌های بعد از resume_from را برای اتصال دوباره می‌فرستد.
+    Recent frames come from live_tail, older ones from MySQL. Returns False
+    when too much was missed (more than RESUME_MAX_REPLAY, or than the
+    connection's queue holds: the frames are queued in one go and the
+    writer cannot drain in between), or when neither can vouch for every
+    frame; the client then reloads history instead.
+
+    The caller registers the socket right after this returns: nothing awaits
+    between the last live_tail read and that, so no frame falls in between.
+    """
+    missed = live_tail.since(chat_id, resume_from)
+    if missed is None:
+        stored = await run_db(fetch_messages_since, chat_id, resume_from, RESUME_MAX_REPLAY + 1)
+        if len(stored) > RESUME_MAX_REPLAY:
+            return False
+        for message in stored:
+            message["chat_name"] = chat_name
+        last = stored[-1]["seq"] if stored else resume_from
+        # the writer flushes behind the broadcast: frames past the last stored
+        # row must all still be in the tail, or the client would skip them
+        newer = live_tail.since(chat_id, last)
+        if newer is None:
+            return False
+        missed = stored + newer
+    elif len(missed) > RESUME_MAX_REPLAY:
+        return False
+    # keep one slot for the "resync" the caller sends otherwise
+    if len(missed) >= conn.room():
+        return False
+
+    for payload in missed:
+        conn.send_json(payload)
+    return True
 
 # ================== WEBSOCKET ==================
 
 @router.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket, token: str = Query(...), chat_name: str = Query("global")):
+async def websocket_endpoint(
+    ws: WebSocket,
+    token: str = Query(...),
+    chat_name: str = Query("global"),
+    resume_from: Optional[int] = Query(None),
+):
     try:
         user_id, username = verify_token(token)
     except Exception:
@@ -119,84 +493,101 @@ async def websocket_endpoint(ws: WebSocket, token: str = Query(...), chat_name:
         return
 
     await ws.accept()
+    conn = Connection(ws)
+    chat_id = None
 
-    # ثبت کاربر آنلاین
-    online_users[user_id] = username
-
-    # ارسال آنلاین‌ها به خودش
-    await ws.send_text(json.dumps({
-        "type": "online_users",
-        "users": list(online_users.values())
-    }))
-    # اطلاع به دیگران
-    await broadcast_online_users(exclude_ws=ws)
-
-    # تعیین chat_id
-    
-    if chat_name == "global":
-        # اتصال به دیتابیس
-        conn = get_connection()
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT id FROM chats WHERE name='global'")
-                row = cursor.fetchone()
-                if row:
-                    chat_id = row[0]
-                else:
-                    cursor.execute(
-                        "INSERT INTO chats(name, is_group, is_private) VALUES(%s, %s, %s)",
-                        ("global", 0, 0)
-                    )
-                    chat_id = cursor.lastrowid
-                    conn.commit()
-        finally:
-            conn.close()
-    else:
-        chat_id, chat_name = get_or_create_private_chat([user_id])
+    try:
+        # ثبت کاربر آنلاین
+        online_users[user_id] = username
+        user_connections[user_id] = user_connections.get(user_id, 0) + 1
 
-    # ثبت ws در clients
-    if chat_id not in clients:
-        clients[chat_id] = {}
-    if user_id not in clients[chat_id]:
-        clients[chat_id][user_id] = []
-    clients[chat_id][user_id].append(ws)
+        # ارسال آنلاین‌ها به خودش (snapshot)، بقیه delta می‌گیرند
+        conn.send_json({
+            "type": "online_users",
+            "users": all_online_users()
+        })
+        presence_changed()
+
+        # تعیین chat_id
+        if chat_name == "global":
+            chat_id = await run_db(get_or_create_global_chat)
+        else:
+            chat_id, chat_name = await run_db(get_or_create_private_chat, [user_id])
+        recent_messages.remember_chat(chat_name, chat_id)
+
+        # reconnect: فقط پیام‌های از دست رفته
+        if resume_from is not None and not await replay_missed(conn, chat_id, chat_name, resume_from):
+            conn.send_json({"type": "resync"})
+
+        # ثبت ws در clients
+        if chat_id not in clients:
+            clients[chat_id] = {}
+        if user_id not in clients[chat_id]:
+            clients[chat_id][user_id] = []
+        clients[chat_id][user_id].append(conn)
 
-    try:
         while True:
             data = await ws.receive_text()
-            payload = json.loads(data)
-            msg_type = payload.get("type", "text")
-            content = payload.get("text") or payload.get("file_path")
+            ws_messages_received.inc()
+            frame = parse_frame(data)
+            if frame is None:
+                conn.send_json({"type": "error", "detail": "Invalid message"})
+                continue
+            msg_type, content = frame
+
+            # نوع فایل همراه پیام می‌رود تا کلاینت فقط برای تصویر پیش‌نمایش بخواهد
+            mime = None
+            if msg_type == "file":
+                mime = await run_db(get_file_mime, file_id_of(msg_type, content))
+                if mime is None:
+                    conn.send_json({"type": "error", "detail": "Invalid message"})
+                    continue
 
-            if chat_name != "global" and not check_membership(chat_id, user_id):
+            if chat_name != "global" and not await membership_cache.is_member(chat_id, user_id):
                 await ws.close(code=4003)
                 return
 
             ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-            
+            seq = await sequences.next(chat_id)
 
-            
-            save_message(chat_id, user_id, msg_type, content, ts)
+            # write-behind: فقط در صف قرار می‌گیرد، ذخیره دسته‌ای در پس‌زمینه
+            await message_writer.submit(chat_id, user_id, msg_type, content, ts, seq, username, mime)
 
             msg_payload = {
                 "username": username,
                 "type": msg_type,
                 "text": content,
                 "chat_name": chat_name,
-                "timestamp": ts
+                "timestamp": ts,
+                "seq": seq,
+                "mime": mime
             }
 
-            await broadcast_message(chat_id, msg_payload)
+            # به همه workerها (از جمله همین worker) می‌رسد
+            await broker.publish("chat", {"chat_id": chat_id, "payload": msg_payload})
 
     except WebSocketDisconnect:
+        pass
+    except RuntimeError:
+        # socket already closed by us (e.g. slow consumer disconnect)
+        if not conn.closed:
+            raise
+    finally:
+        conn.close()
+
         # حذف ws از clients
         if chat_id in clients and user_id in clients[chat_id]:
-            clients[chat_id][user_id] = [w for w in clients[chat_id][user_id] if w != ws]
+            clients[chat_id][user_id] = [c for c in clients[chat_id][user_id] if c is not conn]
             if not clients[chat_id][user_id]:
                 del clients[chat_id][user_id]
+            if not clients[chat_id]:
+                del clients[chat_id]
 
-        # حذف از online_users
-        if user_id in online_users:
-            del online_users[user_id]
-
-        await broadcast_online_users()
\ No newline at end of file
+        # حذف از online_users (فقط وقتی آخرین اتصال کاربر بسته شود)
+        remaining = user_connections.get(user_id, 1) - 1
+        if remaining > 0:
+            user_connections[user_id] = remaining
+        else:
+            user_connections.pop(user_id, None)
+            online_users.pop(user_id, None)
+            presence_changed()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Move messages older than MESSAGE_RETENTION_DAYS from the `messages` table
+into compressed segment files (app/archive.py), where /messages/ still
+pages through them.
+
+    python archive_messages.py          # every ARCHIVE_INTERVAL seconds
+    python archive_messages.py --once
+
+Rows are read and deleted in primary key order, ARCHIVE_BATCH at a time:
+each delete is a short range on the primary key, and a batch is only
+deleted after its blocks are on disk. With ARCHIVE_KEEP_MONTHS, archived
+months older than that are dropped as whole files.
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app.archive import append_block, drop_segments, last_archived_id
+from app.config import (
+    MESSAGE_RETENTION_DAYS, ARCHIVE_KEEP_MONTHS, ARCHIVE_BATCH, ARCHIVE_INTERVAL,
+)
+from app.db import get_connection
+from app.history import message_from_row
+
+
+# ================= LOGIC =================
+def fetch_batch(cursor, after_id: int, limit: int):
+    cursor.execute("""
+        SELECT m.id, u.username, m.type, m.content, m.timestamp, m.seq, f.mime_type, m.chat_id
+        FROM messages m
+        LEFT JOIN users u ON m.user_id = u.id
+        LEFT JOIN files f ON f.id = m.file_id
+        WHERE m.id > %s
+        ORDER BY m.id
+        LIMIT %s
+    """, (after_id, limit))
+    return cursor.fetchall()
+
+
+def archive_batch(rows):
+    """rows (ascending id) → one block per chat and month"""
+    blocks = {}
+    archived_upto = {}
+    for row in rows:
+        chat_id, ts = row[7], row[4]
+        if chat_id not in archived_upto:
+            archived_upto[chat_id] = last_archived_id(chat_id)
+        # a crash between writing a block and deleting its rows leaves them
+        # in the table; they are already archived, skip them
+        if row[0] <= archived_upto[chat_id]:
+            continue
+        blocks.setdefault((chat_id, ts.strftime("%Y-%m")), []).append(message_from_row(row))
+    for (chat_id, month), messages in blocks.items():
+        append_block(chat_id, messages, f"{month}.seg")
+
+
+def archive_old_messages(cutoff: datetime) -> int:
+    archived = 0
+    after_id = 0
+    while True:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                rows = fetch_batch(cursor, after_id, ARCHIVE_BATCH)
+                # ids grow with time: stop at the first message inside the retention window
+                old = []
+                for row in rows:
+                    if row[4] >= cutoff:
+                        break
+                    old.append(row)
+                if not old:
+                    return archived
+
+                archive_batch(old)
+                cursor.execute(
+                    "DELETE FROM messages WHERE id >= %s AND id <= %s",
+                    (old[0][0], old[-1][0])
+                )
+                conn.commit()
+        finally:
+            conn.close()
+
+        archived += len(old)
+        after_id = old[-1][0]
+        if len(old) < len(rows):
+            return archived
+        time.sleep(0.05)   # let the app's writes in between batches
+
+
+def run_once():
+    if MESSAGE_RETENTION_DAYS > 0:
+        cutoff = datetime.utcnow() - timedelta(days=MESSAGE_RETENTION_DAYS)
+        count = archive_old_messages(cutoff)
+        print(f"[ARCHIVE] Archived {count} messages older than {cutoff:%Y-%m-%d}")
+
+    if ARCHIVE_KEEP_MONTHS > 0:
+        now = datetime.utcnow()
+        months = now.year * 12 + now.month - 1 - ARCHIVE_KEEP_MONTHS
+        before = f"{months // 12:04d}-{months % 12 + 1:02d}"
+        print(f"[ARCHIVE] Dropped {drop_segments(before)} segments before {before}")
+
+
+# ================= MAIN LOOP =================
+if __name__ == "__main__":
+    print("[ARCHIVE] Service started")
+
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            print(f"[ARCHIVE] Runtime error: {e}")
+
+        if "--once" in sys.argv:
+            break
+        time.sleep(ARCHIVE_INTERVAL)
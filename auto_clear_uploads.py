@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import os
-import shutil
 import time
 from dotenv import load_dotenv
 from app.db import get_connection
+from app.blobs import release_files, stored_bytes
+from app.config import UPLOAD_LOW_WATER_PERCENT, UPLOAD_EVICT_BATCH
 
 # ================= ENV =================
 load_dotenv()
@@ -17,56 +18,76 @@ def require_env(name: str) -> str:
 
 
 UPLOAD_DIR = require_env("UPLOAD_DIR")
-MAX_SIZE_GB = float(require_env("UPLOAD_MAX_SIZE_GB"))
+MAX_SIZE_BYTES = float(require_env("UPLOAD_MAX_SIZE_GB")) * 1024 ** 3
 CHECK_INTERVAL = int(require_env("UPLOAD_CHECK_INTERVAL"))
+EVICT_PAUSE = 0.1   # seconds between eviction batches
 
 if not os.path.isdir(UPLOAD_DIR):
     raise RuntimeError(f"[AUTO_CLEAR] UPLOAD_DIR does not exist: {UPLOAD_DIR}")
 
-# ================= LOGIC =================
-def get_folder_size_gb(folder: str) -> float:
-    total_size = 0
-    for dirpath, _, filenames in os.walk(folder):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.isfile(fp):
-                total_size += os.path.getsize(fp)
-    return total_size / (1024 ** 3)
-
-
-def clear_uploads():
-    for name in os.listdir(UPLOAD_DIR):
-        path = os.path.join(UPLOAD_DIR, name)
-        try:
-            if os.path.isfile(path) or os.path.islink(path):
-                os.unlink(path)
-            elif os.path.isdir(path):
-                shutil.rmtree(path)
-        except Exception as e:
-            print(f"[AUTO_CLEAR] Failed to remove {path}: {e}")
+LOW_WATER_BYTES = MAX_SIZE_BYTES * UPLOAD_LOW_WATER_PERCENT / 100
 
-
-def clear_messages():
+# ================= LOGIC =================
+def get_uploads_size() -> int:
+    """
+    Bytes used by uploads, from blobs.size_bytes (recorded at upload time,
+    a deduplicated blob counted once) instead of an os.walk over UPLOAD_DIR.
+    """
+    conn = get_connection()
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM messages")
-        conn.commit()
-        cursor.close()
+        with conn.cursor() as cursor:
+            return stored_bytes(cursor)
+    finally:
         conn.close()
-    except Exception as e:
-        print(f"[AUTO_CLEAR] Failed to clear messages: {e}")
 
-def clear_files():
+
+def evict_batch(limit: int):
+    """
+    Delete the `limit` least recently used files: their rows and the
+    messages pointing at them in one short transaction (index lookups only,
+    no table scans). A blob is removed from disk once no files row uses it
+    any more. Returns (files, bytes freed).
+    """
+    conn = get_connection()
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM files")
-        conn.commit()
-        cursor.close()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id FROM files
+                ORDER BY last_accessed_at, id
+                LIMIT %s
+            """, (limit,))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return 0, 0
+
+            placeholders = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"DELETE FROM messages WHERE file_id IN ({placeholders})", ids)
+            unused = release_files(cursor, ids)
+            conn.commit()
+    finally:
         conn.close()
-    except Exception as e:
-        print(f"[AUTO_CLEAR] Failed to clear files: {e}")
+
+    # بعد از commit: فایلی که ردیفش هنوز هست هیچ‌وقت پاک نمی‌شود
+    for enc_path, _ in unused:
+        try:
+            os.unlink(enc_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[AUTO_CLEAR] Failed to remove {enc_path}: {e}")
+    return len(ids), sum(size for _, size in unused)
+
+
+def evict_until(target_bytes: float, size_bytes: int):
+    files = 0
+    while size_bytes > target_bytes:
+        count, freed = evict_batch(UPLOAD_EVICT_BATCH)
+        if not count:
+            break
+        files += count
+        size_bytes -= freed
+        time.sleep(EVICT_PAUSE)   # let the app's writes in between batches
+    print(f"[AUTO_CLEAR] Evicted {files} files, uploads now {size_bytes / 1024 ** 3:.2f} GB")
 
 
 # ================= MAIN LOOP =================
@@ -75,14 +96,12 @@ if __name__ == "__main__":
 
     while True:
         try:
-            size_gb = get_folder_size_gb(UPLOAD_DIR)
-            print(f"[AUTO_CLEAR] Uploads size: {size_gb:.2f} GB")
-
-            if size_gb >= MAX_SIZE_GB:
-                print("[AUTO_CLEAR] Limit reached → clearing uploads & messages & Files")
-                clear_uploads()
-                clear_messages()
-                clear_files()
+            size = get_uploads_size()
+            print(f"[AUTO_CLEAR] Uploads size: {size / 1024 ** 3:.2f} GB")
+
+            if size >= MAX_SIZE_BYTES:
+                print("[AUTO_CLEAR] Limit reached → evicting least recently used files")
+                evict_until(LOW_WATER_BYTES, size)
 
         except Exception as e:
             print(f"[AUTO_CLEAR] Runtime error: {e}")
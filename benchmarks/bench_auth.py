@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Per-request JWT verification cost: plain jwt.decode vs app.auth.decode_token
+(verified-token cache). No database needed.
+
+    python -m benchmarks.bench_auth [--requests 20000] [--tokens 50]
+"""
+import argparse
+import json
+import time
+
+from jose import jwt
+
+from app.auth import create_access_token, decode_token, token_cache, SECRET_KEY, ALGORITHM
+
+
+def run(fn, tokens, requests):
+    started = time.perf_counter()
+    for i in range(requests):
+        fn(tokens[i % len(tokens)])
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=50, help="distinct users presenting tokens")
+    args = parser.parse_args()
+
+    tokens = [create_access_token({"sub": str(i), "username": f"user{i}"}) for i in range(args.tokens)]
+
+    before = run(lambda t: jwt.decode(t, SECRET_KEY, algorithms=[ALGORITHM]), tokens, args.requests)
+    token_cache.clear()
+    after = run(decode_token, tokens, args.requests)
+
+    result = {
+        "requests": args.requests,
+        "tokens": args.tokens,
+        "jwt_decode_us": round(before * 1e6, 2),
+        "decode_token_cached_us": round(after * 1e6, 2),
+        "speedup": round(before / after, 1),
+        "cache": token_cache.stats,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Login storm vs websocket latency, against a running server.
+
+Registers one user, keeps a websocket open on the global chat sending a
+message every --interval seconds and timing its echo, then fires
+--logins concurrent /login/ requests. Prints echo latency before and
+during the storm plus login throughput as JSON.
+
+    uvicorn app.main:app --port 8000 &
+    python -m benchmarks.bench_login_storm --url http://127.0.0.1:8000 --logins 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+
+def post_form(url, data):
+    body = urllib.parse.urlencode(data).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=120) as res:
+            return res.status, json.loads(res.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+
+def summary(values):
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": round(max(values) * 1000, 2) if values else None,
+    }
+
+
+async def echo_probe(ws_url, interval, stop, samples):
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        while not stop.is_set():
+            marker = uuid.uuid4().hex
+            sent = time.perf_counter()
+            await ws.send(json.dumps({"type": "text", "text": marker}))
+            while True:
+                msg = json.loads(await ws.recv())
+                if msg.get("text") == marker:
+                    break
+            samples.append(time.perf_counter() - sent)
+            await asyncio.sleep(interval)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    args = parser.parse_args()
+
+    username, password = f"bench_{uuid.uuid4().hex[:8]}", uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=args.logins)
+
+    await loop.run_in_executor(pool, post_form, f"{args.url}/register/", {"username": username, "password": password})
+    status, data = await loop.run_in_executor(pool, post_form, f"{args.url}/login/", {"username": username, "password": password})
+    if status != 200:
+        raise SystemExit(f"login failed: {status}")
+
+    ws_url = args.url.replace("http", "ws", 1) + f"/ws?token={data['access_token']}&chat_name=global"
+    stop = asyncio.Event()
+    samples = []
+    probe = asyncio.create_task(echo_probe(ws_url, args.interval, stop, samples))
+
+    await asyncio.sleep(args.warmup)
+    baseline = list(samples)
+
+    started = time.perf_counter()
+    mark = len(samples)
+    results = await asyncio.gather(*[
+        loop.run_in_executor(pool, post_form, f"{args.url}/login/", {"username": username, "password": password})
+        for _ in range(args.logins)
+    ])
+    storm_time = time.perf_counter() - started
+    during = samples[mark:]
+
+    stop.set()
+    await probe
+
+    codes = {}
+    for code, _ in results:
+        codes[str(code)] = codes.get(str(code), 0) + 1
+
+    print(json.dumps({
+        "logins": args.logins,
+        "storm_seconds": round(storm_time, 3),
+        "logins_per_second": round(args.logins / storm_time, 1),
+        "status_codes": codes,
+        "echo_baseline": summary(baseline),
+        "echo_during_storm": summary(during),
+        "echo_mean_ratio": round(statistics.mean(during) / statistics.mean(baseline), 2) if during and baseline else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark: import time, time to live (/healthz) and time to
+ready (/readyz), for the source tree and for the PyInstaller binary.
+
+Each run starts a fresh process and polls the endpoints every 10 ms:
+
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --binary dist/mapsim_chat --runs 10
+    python -m benchmarks.bench_startup --workers 4    # multi-worker startup
+
+The server uses the DB_* / DB_BACKEND settings from the environment. Point
+them at a throwaway database (see bench_websocket.py), or use
+DB_BACKEND=sqlite SQLITE_PATH=/tmp/bench.db. Results are printed and saved
+as JSON (default: benchmarks/results/startup-<commit>.json).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "min_ms": round(values[0] * 1000, 1),
+        "p50_ms": round(values[len(values) // 2] * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure_import():
+    """Seconds to `import app.main` in a fresh interpreter (no server, no DB)."""
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, text=True)
+    return float(out.strip().splitlines()[-1])
+
+
+def status_of(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as res:
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_boot(cmd, env, port, timeout):
+    """(seconds to /healthz 200, seconds to /readyz 200) for one fresh process."""
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise SystemExit(f"[BENCH] Server exited with {proc.returncode}: {' '.join(cmd)}")
+            if live is None and status_of(base + "/healthz") == 200:
+                live = time.perf_counter() - started
+            if live is not None and status_of(base + "/readyz") == 200:
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    if ready is None:
+        raise SystemExit(f"[BENCH] Server not ready within {timeout}s: {' '.join(cmd)}")
+    return live, ready
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--binary", help="PyInstaller build of app/main.py (dist/mapsim_chat)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    env = dict(os.environ, SERVER_HOST="127.0.0.1", SERVER_PORT=str(args.port))
+    targets = {
+        "source": [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                   "--log-level", "warning", "--workers", str(args.workers)],
+    }
+    if args.binary:
+        targets["binary"] = [os.path.abspath(args.binary)]
+
+    result = {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": vars(args),
+        "import_app_main": summary([measure_import() for _ in range(args.runs)]),
+    }
+    print(f"[BENCH] import app.main: {result['import_app_main']}")
+
+    for name, cmd in targets.items():
+        live, ready = [], []
+        for _ in range(args.runs):
+            l, r = measure_boot(cmd, env, args.port, args.timeout)
+            live.append(l)
+            ready.append(r)
+        result[name] = {"live": summary(live), "ready": summary(ready)}
+        print(f"[BENCH] {name}: live {result[name]['live']} ready {result[name]['ready']}")
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"startup-{result['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(f"[BENCH] Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Websocket load generator: connect rate, fanout latency, throughput, server RSS.
+
+Opens --clients websockets (a --private share of them on their own private
+chat, the rest on global), has --senders of the global clients send
+--rate messages/second in total for --duration seconds, and measures the
+time from send to receipt on every receiving socket. Results are printed
+and saved as JSON (default: benchmarks/results/websocket-<commit>.json) so
+runs on different commits can be compared.
+
+With --boot the script starts `uvicorn app.main:app` itself and samples the
+server's RSS. With --sqlite it runs on a fresh SQLite file in a temp
+directory (DB_BACKEND=sqlite), nothing else needed:
+
+    python -m benchmarks.bench_websocket --boot --sqlite --clients 2000 --rate 200
+
+Otherwise it uses the DB_* settings from the environment; point those at a
+throwaway MySQL/MariaDB to measure that backend, e.g.
+
+    docker run -d -p 3307:3306 -e MARIADB_ROOT_PASSWORD=bench mariadb:11
+    DB_HOST=127.0.0.1 DB_PORT=3307 DB_USER=root DB_PASS=bench DB_NAME=bench \\
+        python -m benchmarks.bench_websocket --boot --clients 2000 --rate 200
+
+Without --boot it targets --url (pass --server-pid for RSS). All clients
+run in this one process; raise `ulimit -n` for large --clients, and keep an
+eye on "client_lag_ms": if the client loop itself falls behind, the
+latencies measure the client rather than the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def post_form(url, data):
+    body = urllib.parse.urlencode(data).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=120) as res:
+            return res.status, json.loads(res.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50),
+        "p99_ms": percentile(values, 0.99),
+        "p999_ms": percentile(values, 0.999),
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+def rss_mb(pid):
+    """Resident set size of pid and its children (uvicorn workers), in MB."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1) if total else None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# ================== SERVER ==================
+
+def boot_server(port, workers, sqlite=False):
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    env = dict(os.environ)
+    if sqlite:
+        # a fresh database per run; created and migrated on startup
+        env["DB_BACKEND"] = "sqlite"
+        env["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mapsim-bench-"), "bench.db")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"[BENCH] Server exited with {proc.returncode}")
+        try:
+            urllib.request.urlopen(url + "/", timeout=1)
+            return proc, url
+        except urllib.error.HTTPError:
+            return proc, url   # any HTTP answer means it is up
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("[BENCH] Server did not come up within 60s")
+
+
+async def create_users(url, count):
+    loop = asyncio.get_running_loop()
+    tokens = []
+    for _ in range(count):
+        username, password = f"bench_{uuid.uuid4().hex[:10]}", uuid.uuid4().hex
+        await loop.run_in_executor(None, post_form, f"{url}/register/", {"username": username, "password": password})
+        status, data = await loop.run_in_executor(None, post_form, f"{url}/login/", {"username": username, "password": password})
+        if status != 200:
+            raise SystemExit(f"[BENCH] Login failed: {status}")
+        tokens.append(data["access_token"])
+    return tokens
+
+
+# ================== CLIENTS ==================
+
+class Client:
+    def __init__(self, ws, chat):
+        self.ws = ws
+        self.chat = chat
+        self.received = 0
+
+
+async def reader(client, latencies, run_id):
+    try:
+        async for frame in client.ws:
+            msg = json.loads(frame)
+            text = msg.get("text")
+            if not isinstance(text, str) or not text.startswith(run_id):
+                continue
+            sent = float(text.split(":", 2)[1])
+            latencies.append(time.perf_counter() - sent)
+            client.received += 1
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def sender(client, interval, stop, run_id, counter):
+    # spread senders out so they do not all fire on the same tick
+    await asyncio.sleep(random.random() * interval)
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        await client.ws.send(json.dumps({"type": "text", "text": f"{run_id}:{time.perf_counter()}:x"}))
+        counter[0] += 1
+        next_at += interval
+        await asyncio.sleep(max(0, next_at - time.perf_counter()))
+
+
+async def lag_probe(stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.05)
+        samples.append(time.perf_counter() - started - 0.05)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--boot", action="store_true", help="start uvicorn app.main:app for the run")
+    parser.add_argument("--sqlite", action="store_true", help="with --boot: run on a temporary SQLite database")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--server-pid", type=int)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=20, help="distinct accounts; clients share their tokens")
+    parser.add_argument("--private", type=float, default=0.2, help="share of clients on a private chat")
+    parser.add_argument("--senders", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100, help="messages per second, all senders together")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if args.boot:
+        proc, url = boot_server(args.port, args.workers, args.sqlite)
+    server_pid = proc.pid if proc else args.server_pid
+    ws_base = url.replace("http", "ws", 1)
+
+    try:
+        tokens = await create_users(url, args.users)
+        rss_idle = rss_mb(server_pid) if server_pid else None
+
+        # ---------- connect ----------
+        gate = asyncio.Semaphore(args.connect_concurrency)
+        connect_times = []
+        failures = 0
+
+        async def connect(i):
+            nonlocal failures
+            chat = "private" if i < args.clients * args.private else "global"
+            token = tokens[i % len(tokens)]
+            async with gate:
+                started = time.perf_counter()
+                try:
+                    ws = await websockets.connect(f"{ws_base}/ws?token={token}&chat_name={chat}", max_size=None)
+                except (OSError, websockets.InvalidHandshake):
+                    failures += 1
+                    return None
+                connect_times.append(time.perf_counter() - started)
+                return Client(ws, chat)
+
+        started = time.perf_counter()
+        clients = [c for c in await asyncio.gather(*[connect(i) for i in range(args.clients)]) if c]
+        connect_seconds = time.perf_counter() - started
+        print(f"[BENCH] {len(clients)} clients connected in {connect_seconds:.2f}s ({failures} failed)")
+
+        # ---------- drive ----------
+        run_id = uuid.uuid4().hex[:8]
+        latencies, lag = [], []
+        sent = [0]
+        stop = asyncio.Event()
+        readers = [asyncio.create_task(reader(c, latencies, run_id)) for c in clients]
+        await asyncio.sleep(1)   # let presence traffic settle
+
+        global_clients = [c for c in clients if c.chat == "global"]
+        private_clients = [c for c in clients if c.chat == "private"]
+        # private chats have a single member; a few of them send to themselves
+        active = global_clients[:args.senders] + private_clients[:max(0, args.senders // 5)]
+        interval = len(active) / args.rate if args.rate > 0 else 1.0
+        tasks = [asyncio.create_task(sender(c, interval, stop, run_id, sent)) for c in active]
+        tasks.append(asyncio.create_task(lag_probe(stop, lag)))
+
+        rss_peak = rss_idle or 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < args.duration:
+            await asyncio.sleep(0.5)
+            if server_pid:
+                rss_peak = max(rss_peak, rss_mb(server_pid) or 0)
+        stop.set()
+        drive_seconds = time.perf_counter() - started
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(2)   # drain in-flight frames
+
+        received = sum(c.received for c in clients)
+        for c in clients:
+            await c.ws.close()
+        await asyncio.gather(*readers, return_exceptions=True)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    result = {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": vars(args),
+        "connect": {
+            "clients": len(clients),
+            "failed": failures,
+            "seconds": round(connect_seconds, 3),
+            "per_second": round(len(clients) / connect_seconds, 1) if connect_seconds else None,
+            "handshake": latency_summary(connect_times),
+        },
+        "messages": {
+            "sent": sent[0],
+            "sent_per_second": round(sent[0] / drive_seconds, 1),
+            "delivered": received,
+            "delivered_per_second": round(received / drive_seconds, 1),
+        },
+        "fanout_latency": latency_summary(latencies),
+        "client_lag_ms": latency_summary(lag),
+        "server_rss_mb": {"idle": rss_idle, "peak": rss_peak or None},
+    }
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"websocket-{result['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(f"[BENCH] Saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -58,13 +58,25 @@ def clear_files():
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM files")
+        cursor.execute("DELETE FROM blobs")
         conn.commit()
         cursor.close()
         conn.close()
-        print("[CLEAR_NOW] Files Table cleared")
+        print("[CLEAR_NOW] Files & Blobs Tables cleared")
     except Exception as e:
         print(f"[CLEAR_NOW] DB error: {e}")
 
+def clear_archive():
+    print("[CLEAR_NOW] Clearing archived messages...")
+
+    try:
+        from app.config import ARCHIVE_DIR
+        if os.path.isdir(ARCHIVE_DIR):
+            shutil.rmtree(ARCHIVE_DIR)
+        print("[CLEAR_NOW] Archive cleared")
+    except Exception as e:
+        print(f"[CLEAR_NOW] Failed to clear archive: {e}")
+
 def clear_KEY_version():
     print("[CLEAR_NOW] Clearing KEY Versions table...")
 
@@ -83,5 +95,6 @@ def clear_KEY_version():
 if __name__ == "__main__":
     clear_uploads()
     clear_messages()
+    clear_archive()
     clear_files()
     clear_KEY_version()
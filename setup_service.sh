@@ -5,6 +5,8 @@ APP_NAME="Mapsim_chat"
 APP_DIR="/root/Mapsim_chat"
 VENV_PATH="$APP_DIR/venv"
 SERVICE_FILE="/etc/systemd/system/${APP_NAME}.service"
+# more than 1 worker needs BROKER_URL=unix://... or redis://... in .env
+WORKERS="${WORKERS:-1}"
 
 echo "🚀 Setting up $APP_NAME service..."
 
@@ -24,6 +26,12 @@ fi
 
 echo "✅ uvicorn found in venv"
 
+# 2.1 Apply database migrations (once per deploy, not on every start)
+cd "$APP_DIR"
+"$VENV_PATH/bin/python3" -m app.migrations
+
+echo "✅ Database schema up to date"
+
 # 3. Create systemd service
 cat <<EOF > "$SERVICE_FILE"
 [Unit]
@@ -34,7 +42,7 @@ After=network.target
 Type=simple
 User=root
 WorkingDirectory=$APP_DIR
-ExecStart=$VENV_PATH/bin/uvicorn app.main:app --host 0.0.0.0 --port 8000
+ExecStart=$VENV_PATH/bin/uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers $WORKERS
 Restart=always
 RestartSec=3
 StandardOutput=journal
@@ -0,0 +1,13 @@
+import base64
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.chat_keys needs a master key at import; tests that touch the database
+# get a throwaway SQLite file instead of the configured one
+os.environ.setdefault("SECRET_KEY", base64.b64encode(b"\0" * 32).decode())
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mapsim-tests-"), "test.db")
@@ -0,0 +1,72 @@
+"""
+Minimal in-process Redis stand-in: PING, AUTH, SUBSCRIBE, PUBLISH and the
+one EVAL script RedisBroker.incr sends, over RESP, enough for
+app.broker.RedisBroker without a Redis server.
+"""
+import asyncio
+
+from app.broker import _resp_read
+
+
+def _bulk(data: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class RespStub:
+    def __init__(self):
+        self.subscribers = {}   # channel -> set of writers
+        self.published = 0
+        self.counters = {}
+        self.refuse_publish = False   # answer PUBLISH with -ERR
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def drop_subscribers(self):
+        """close every subscriber connection, like a Redis restart"""
+        for writers in self.subscribers.values():
+            for writer in list(writers):
+                writer.close()
+            writers.clear()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                command = await _resp_read(reader)
+                name = command[0].upper()
+                if name in (b"PING", b"AUTH"):
+                    writer.write(b"+OK\r\n")
+                elif name == b"SUBSCRIBE":
+                    for index, channel in enumerate(command[1:], 1):
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(b"*3\r\n" + _bulk(b"subscribe") + _bulk(channel) + b":%d\r\n" % index)
+                elif name == b"PUBLISH" and self.refuse_publish:
+                    writer.write(b"-NOAUTH Authentication required.\r\n")
+                elif name == b"PUBLISH":
+                    channel, message = command[1], command[2]
+                    receivers = self.subscribers.get(channel, set())
+                    for sub in list(receivers):
+                        sub.write(b"*3\r\n" + _bulk(b"message") + _bulk(channel) + _bulk(message))
+                    self.published += 1
+                    writer.write(b":%d\r\n" % len(receivers))
+                elif name == b"EVAL":
+                    # only broker._INCR_SCRIPT: max(counter, floor) + 1
+                    key, floor = command[3], int(command[4])
+                    value = self.counters[key] = max(self.counters.get(key, 0), floor) + 1
+                    writer.write(b":%d\r\n" % value)
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
@@ -0,0 +1,118 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+from app import blobs
+from app.chat_keys import key_ring
+from app.create_db import create_database
+from app.db import get_connection
+
+
+@pytest.fixture
+def auto_clear(tmp_path, monkeypatch):
+    # the service reads its settings from the environment at import
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setenv("UPLOAD_MAX_SIZE_GB", "1")
+    monkeypatch.setenv("UPLOAD_CHECK_INTERVAL", "60")
+    sys.modules.pop("auto_clear_uploads", None)
+    module = importlib.import_module("auto_clear_uploads")
+    monkeypatch.setattr(module, "EVICT_PAUSE", 0)
+
+    create_database()
+    if key_ring.current_id is None:
+        key_ring.start()
+    for table in ("messages", "files", "blobs"):
+        _query(f"DELETE FROM {table}")
+    yield module
+    sys.modules.pop("auto_clear_uploads", None)
+
+
+def _query(sql, params=()):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def _upload(tmp_path, file_id, accessed, size=100, digest=None):
+    """a files row last read at second `accessed`; same digest = same blob"""
+    digest = digest or file_id
+    if not blobs.add_file(file_id, file_id, "text/plain", digest):
+        path = str(tmp_path / f"{digest}.enc")
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        assert blobs.add_blob(file_id, file_id, "text/plain", digest, key_ring.current_id, path, size)
+    _query("UPDATE files SET last_accessed_at=%s WHERE id=%s", (f"2026-01-01 00:00:{accessed:02d}", file_id))
+
+
+def _file_ids():
+    return sorted(row[0] for row in _query("SELECT id FROM files"))
+
+
+def test_evict_batch_takes_the_least_recently_used(auto_clear, tmp_path):
+    for file_id, accessed in [("a", 30), ("b", 10), ("c", 40), ("d", 20)]:
+        _upload(tmp_path, file_id, accessed)
+
+    assert auto_clear.evict_batch(2) == (2, 200)
+    assert _file_ids() == ["a", "c"]
+    assert sorted(os.listdir(tmp_path)) == ["a.enc", "c.enc"]
+
+
+def test_evict_batch_removes_the_messages_of_a_file(auto_clear, tmp_path):
+    _upload(tmp_path, "a", 10)
+    _upload(tmp_path, "b", 20)
+    if not _query("SELECT id FROM users WHERE username='auto_clear'"):
+        _query("INSERT INTO users(username, password) VALUES ('auto_clear', 'x')")
+        _query("INSERT INTO chats(name) VALUES ('auto_clear')")
+    user_id = _query("SELECT id FROM users WHERE username='auto_clear'")[0][0]
+    chat_id = _query("SELECT id FROM chats WHERE name='auto_clear'")[0][0]
+    for file_id in ("a", "b"):
+        _query(
+            "INSERT INTO messages(chat_id, user_id, type, content, file_id) VALUES (%s, %s, 'file', %s, %s)",
+            (chat_id, user_id, f"/files/{file_id}", file_id)
+        )
+
+    auto_clear.evict_batch(1)
+    assert [row[0] for row in _query("SELECT file_id FROM messages")] == ["b"]
+
+
+def test_shared_blob_is_freed_with_its_last_file(auto_clear, tmp_path):
+    _upload(tmp_path, "old", 10, digest="same")
+    _upload(tmp_path, "other", 20)
+    _upload(tmp_path, "copy", 30, digest="same")
+
+    # the oldest file goes, its content is still used by "copy"
+    assert auto_clear.evict_batch(1) == (1, 0)
+    assert os.path.exists(tmp_path / "same.enc")
+    assert auto_clear.evict_batch(2) == (2, 200)
+    assert os.listdir(tmp_path) == []
+
+
+def test_evict_until_stops_under_the_budget(auto_clear, tmp_path, monkeypatch):
+    monkeypatch.setattr(auto_clear, "UPLOAD_EVICT_BATCH", 1)
+    for i, file_id in enumerate("abcde"):
+        _upload(tmp_path, file_id, i)
+
+    size = auto_clear.get_uploads_size()
+    assert size == 500
+    auto_clear.evict_until(250, size)
+    assert _file_ids() == ["d", "e"]
+    assert auto_clear.get_uploads_size() == 200
+
+
+def test_evict_until_ends_when_nothing_is_left(auto_clear, tmp_path, monkeypatch):
+    monkeypatch.setattr(auto_clear, "UPLOAD_EVICT_BATCH", 2)
+    for i, file_id in enumerate("abc"):
+        _upload(tmp_path, file_id, i)
+
+    # the recorded size overstates what is stored: stop once it is all gone
+    auto_clear.evict_until(0, 10_000)
+    assert _file_ids() == []
+    assert auto_clear.get_uploads_size() == 0
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from app import blobs
+from app.chat_keys import key_ring
+from app.create_db import create_database
+from app.db import get_connection
+
+
+@pytest.fixture(autouse=True)
+def fresh_blobs():
+    create_database()
+    if key_ring.current_id is None:
+        key_ring.start()
+    conn = get_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM files")
+        cursor.execute("DELETE FROM blobs")
+    conn.commit()
+    conn.close()
+
+
+def _query(sql, params=()):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def _write(tmp_path, name):
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        f.write(b"x" * 100)
+    return path
+
+
+def test_upload_racing_the_eviction_of_its_content_is_stored(tmp_path):
+    from app.main import store_blob
+
+    # eviction took the last reference and has not committed the delete yet
+    _query(
+        "INSERT INTO blobs (digest, key_id, enc_path, size_bytes, refcount) VALUES (%s, %s, %s, 100, 0)",
+        ("d1", key_ring.current_id, _write(tmp_path, "dead.enc"))
+    )
+    assert not blobs.add_file("f1", "a.txt", "text/plain", "d1")
+
+    def eviction_commits():
+        _query("DELETE FROM blobs WHERE digest=%s", ("d1",))
+
+    timer = threading.Timer(0.1, eviction_commits)
+    timer.start()
+    path = _write(tmp_path, "new.enc")
+    blob_id = asyncio.run(store_blob("f1", "a.txt", "text/plain", "d1", key_ring.current_id, path))
+    timer.join()
+
+    assert blob_id
+    assert _query("SELECT b.enc_path, b.refcount FROM files f JOIN blobs b ON b.id = f.blob_id WHERE f.id='f1'") == [(path, 1)]
+    assert os.path.exists(path)
+
+
+def _refcount(digest):
+    return [row[0] for row in _query("SELECT refcount FROM blobs WHERE digest=%s ORDER BY id", (digest,))]
+
+
+def _release(file_ids):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            unused = blobs.release_files(cursor, file_ids)
+        conn.commit()
+        return unused
+    finally:
+        conn.close()
+
+
+def test_duplicate_upload_bumps_the_refcount(tmp_path):
+    path = _write(tmp_path, "a.enc")
+    blob_id = blobs.add_blob("f1", "a.txt", "text/plain", "d1", key_ring.current_id, path, 100)
+    assert blob_id
+    # the same content again: no second blob, the first one is shared
+    assert blobs.add_blob("f2", "b.txt", "text/plain", "d1", key_ring.current_id, path, 100) is None
+    assert blobs.add_file("f2", "b.txt", "image/png", "d1")
+    assert blobs.add_file("f3", "c.txt", "text/plain", "d1")
+
+    assert _refcount("d1") == [3]
+    assert _query("SELECT id, mime_type, blob_id FROM files ORDER BY id") == [
+        ("f1", "text/plain", blob_id), ("f2", "image/png", blob_id), ("f3", "text/plain", blob_id),
+    ]
+    assert not blobs.add_file("f4", "d.txt", "text/plain", "other")
+
+
+def test_release_unlinks_only_at_zero(tmp_path):
+    path = _write(tmp_path, "a.enc")
+    blobs.add_blob("f1", "a.txt", "text/plain", "d1", key_ring.current_id, path, 100)
+    blobs.add_file("f2", "b.txt", "text/plain", "d1")
+    blobs.add_file("f3", "c.txt", "text/plain", "d1")
+
+    assert _release(["f1"]) == []
+    assert _refcount("d1") == [2]
+    # both remaining references in one call
+    assert _release(["f2", "f3"]) == [(path, 100)]
+    assert _query("SELECT COUNT(*) FROM blobs") == [(0,)]
+    assert _query("SELECT COUNT(*) FROM files") == [(0,)]
+
+
+def test_release_returns_the_thumbnail_too(tmp_path):
+    path = _write(tmp_path, "a.enc")
+    blob_id = blobs.add_blob("f1", "a.png", "image/png", "d1", key_ring.current_id, path, 100)
+    _query("UPDATE blobs SET thumb_path=%s WHERE id=%s", ("a.thumb.enc", blob_id))
+    assert sorted(_release(["f1"])) == [(path, 100), ("a.thumb.enc", 0)]
+
+
+def test_reencrypted_copy_is_merged_into_the_existing_one(tmp_path):
+    old_key = key_ring.current_id + 1000
+    old_path = _write(tmp_path, "old.enc")
+    current_path = _write(tmp_path, "current.enc")
+    new_path = _write(tmp_path, "new.enc")
+    # an upload from before a rotation, and the same content uploaded again after it
+    old_id = blobs.add_blob("f1", "a.txt", "text/plain", "d1", old_key, old_path, 100)
+    blobs.add_file("f2", "a.txt", "text/plain", "d1")
+    current_id = blobs.add_blob("f3", "a.txt", "text/plain", "d1", key_ring.current_id, current_path, 100)
+    assert _refcount("d1") == [2, 1]
+
+    # re-encrypting the old copy onto the current key finds the current copy there
+    unused = blobs.move_blob(old_id, old_path, new_path, key_ring.current_id, 100)
+    assert sorted(unused) == sorted([old_path, new_path])
+    assert _query("SELECT id, enc_path, refcount FROM blobs") == [(current_id, current_path, 3)]
+    assert _query("SELECT DISTINCT blob_id FROM files") == [(current_id,)]
+
+    assert _release(["f1", "f2"]) == []
+    assert _release(["f3"]) == [(current_path, 100)]
+
+
+def test_move_blob_after_eviction_drops_the_new_copy(tmp_path):
+    path = _write(tmp_path, "a.enc")
+    blob_id = blobs.add_blob("f1", "a.txt", "text/plain", "d1", key_ring.current_id + 1000, path, 100)
+    _release(["f1"])
+    assert blobs.move_blob(blob_id, path, "new.enc", key_ring.current_id, 100) == ["new.enc"]
@@ -0,0 +1,198 @@
+import asyncio
+import json
+
+from app.broker import RedisBroker, UnixSocketBroker
+from tests.resp_stub import RespStub
+
+
+async def _collect(broker, channel):
+    received = []
+
+    async def handler(message):
+        received.append(message)
+
+    broker.subscribe(channel, handler)
+    return received
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.01)
+
+
+def test_redis_round_trip():
+    async def scenario():
+        stub = RespStub()
+        await stub.start()
+        a = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        b = RedisBroker(f"redis://:secret@127.0.0.1:{stub.port}")
+        got_a = await _collect(a, "chat")
+        got_b = await _collect(b, "chat")
+        await a.start()
+        await b.start()
+        try:
+            await a.publish("chat", {"chat_id": 1, "payload": {"text": "hi"}})
+            await _wait_for(lambda: got_b)
+
+            # the publisher gets its own message once (locally), not back from the bus
+            assert got_a == [{"chat_id": 1, "payload": {"text": "hi"}}]
+            assert got_b == got_a
+            assert stub.published == 1
+
+            await b.publish("chat", {"chat_id": 2})
+            await _wait_for(lambda: len(got_a) == 2)
+            assert got_a[-1] == {"chat_id": 2}
+            assert len(got_b) == 2
+        finally:
+            await a.stop()
+            await b.stop()
+            await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_redis_resubscribes_after_disconnect():
+    async def scenario():
+        stub = RespStub()
+        await stub.start()
+        a = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        b = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        got_b = await _collect(b, "presence")
+        await a.start()
+        await b.start()
+        try:
+            await stub.drop_subscribers()
+            await _wait_for(lambda: b.stats["reconnects"] >= 1)
+            await _wait_for(lambda: sum(len(w) for w in stub.subscribers.values()) == 2)
+
+            await a.publish("presence", {"node": "a"})
+            await _wait_for(lambda: got_b)
+            assert got_b == [{"node": "a"}]
+        finally:
+            await a.stop()
+            await b.stop()
+            await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_unix_socket_round_trip(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "broker.sock")
+        brokers = [UnixSocketBroker(path) for _ in range(3)]
+        received = [await _collect(broker, "chat") for broker in brokers]
+        for broker in brokers:
+            await broker.start()
+        try:
+            # the non-hub workers connect to the hub in the background
+            await asyncio.sleep(0.3)
+            await brokers[2].publish("chat", {"n": 1})
+            await _wait_for(lambda: all(received))
+            assert received == [[{"n": 1}]] * 3
+        finally:
+            for broker in brokers:
+                await broker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_redis_incr_is_shared_and_respects_the_floor():
+    async def scenario():
+        stub = RespStub()
+        await stub.start()
+        a = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        b = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        try:
+            assert await a.incr("seq:1", 0) == 1
+            assert await b.incr("seq:1", 0) == 2
+            # the counter was lost (Redis restart) but 41 was already handed out
+            stub.counters.clear()
+            assert await a.incr("seq:1", 41) == 42
+            assert await b.incr("seq:1", 0) == 43
+        finally:
+            await a.stop()
+            await b.stop()
+            await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_unix_socket_incr_through_the_hub(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "broker.sock")
+        brokers = [UnixSocketBroker(path) for _ in range(3)]
+        for broker in brokers:
+            await broker.start()
+        try:
+            await asyncio.sleep(0.3)
+            values = await asyncio.gather(*(
+                broker.incr("seq:1", 0) for broker in brokers for _ in range(20)
+            ))
+            assert sorted(values) == list(range(1, 61))
+            assert await brokers[1].incr("seq:1", 100) == 101
+        finally:
+            for broker in brokers:
+                await broker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_redis_error_reply_does_not_escape_publish():
+    async def scenario():
+        stub = RespStub()
+        await stub.start()
+        a = RedisBroker(f"redis://127.0.0.1:{stub.port}")
+        got = await _collect(a, "chat")
+        await a.start()
+        try:
+            stub.refuse_publish = True
+            await a.publish("chat", {"n": 1})
+            # still delivered locally, and the next publish goes out again
+            assert got == [{"n": 1}]
+            stub.refuse_publish = False
+            await a.publish("chat", {"n": 2})
+            assert stub.published == 1
+        finally:
+            await a.stop()
+            await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_history_flush_is_split_under_the_frame_limit():
+    from app.broker import MAX_FRAME
+    from app.websocket import frame_batches
+
+    # 200 messages of 64 KB of Persian text: ~6x that once JSON-escaped
+    messages = [{"id": i, "text": "س" * 32767} for i in range(200)]
+    batches = list(frame_batches(messages, MAX_FRAME // 2))
+    assert [m for batch in batches for m in batch] == messages
+    assert len(batches) > 1
+    assert all(len(json.dumps(batch)) < MAX_FRAME // 2 for batch in batches)
+
+
+def test_hub_drops_a_worker_that_stops_reading(tmp_path, monkeypatch):
+    from app import broker as broker_module
+
+    monkeypatch.setattr(broker_module, "MAX_PEER_BUFFER", 64 * 1024)
+
+    async def scenario():
+        path = str(tmp_path / "broker.sock")
+        hub = UnixSocketBroker(path)
+        await hub.start()
+        # a worker that connects and never reads
+        reader, writer = await asyncio.open_unix_connection(path)
+        await _wait_for(lambda: hub._peers)
+        try:
+            for _ in range(200):
+                await hub.publish("chat", {"text": "x" * 10000})
+            assert hub.stats["slow_peers"] == 1
+            assert not hub._peers
+        finally:
+            writer.close()
+            await hub.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+import pytest
+
+from app import chat_keys
+from app.chat_keys import KeyRing, MASTER_KEY
+from app.create_db import create_database
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    create_database()
+
+
+def test_workers_of_one_deploy_share_the_key(monkeypatch):
+    monkeypatch.setattr(chat_keys, "DEPLOY_ID", "deploy-1")
+    first, second = KeyRing(MASTER_KEY), KeyRing(MASTER_KEY)
+    first.start()
+    second.start()
+
+    assert second.current_id == first.current_id
+    assert second.current == first.current
+    # only the worker that created the key runs the re-encryption job
+    assert first.owner and first.is_newest()
+    assert not second.owner and not second.is_newest()
+
+
+def test_new_deploy_gets_a_new_key(monkeypatch):
+    monkeypatch.setattr(chat_keys, "DEPLOY_ID", "deploy-2")
+    old = KeyRing(MASTER_KEY)
+    old.start()
+    monkeypatch.setattr(chat_keys, "DEPLOY_ID", "deploy-3")
+    new = KeyRing(MASTER_KEY)
+    new.start()
+
+    assert new.current_id > old.current_id
+    assert new.current != old.current
+    # the older deploy's key stays readable
+    assert new.get(old.current_id) == old.current
+
+
+def test_single_process_always_gets_a_new_key(monkeypatch):
+    monkeypatch.setattr(chat_keys, "DEPLOY_ID", None)
+    first, second = KeyRing(MASTER_KEY), KeyRing(MASTER_KEY)
+    first.start()
+    second.start()
+    assert first.current_id != second.current_id
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from app.executor import BoundedExecutor, run_db
+from app.fanout import Connection, fanout
+
+
+class RecordingSocket:
+    """stand-in websocket: records when each frame is sent"""
+
+    def __init__(self):
+        self.sent_at = []
+
+    async def send_text(self, frame):
+        self.sent_at.append(time.monotonic())
+
+    async def close(self, code=None):
+        pass
+
+
+async def _broadcast_latencies(duration: float, interval: float = 0.01):
+    """broadcast every `interval` to 20 sockets for `duration`; worst push -> send latency"""
+    sockets = [RecordingSocket() for _ in range(20)]
+    connections = [Connection(ws) for ws in sockets]
+    pushed_at = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        pushed_at.append(time.monotonic())
+        fanout(connections, {"type": "text", "text": "x"})
+        await asyncio.sleep(interval)
+    await asyncio.sleep(interval)
+    for conn in connections:
+        conn.close()
+    return max(
+        sent - pushed
+        for ws in sockets
+        for pushed, sent in zip(pushed_at, ws.sent_at)
+    ), len(pushed_at)
+
+
+def test_broadcast_latency_flat_during_slow_query():
+    async def scenario():
+        baseline, _ = await _broadcast_latencies(0.3)
+
+        # a 1 s query is in flight on the DB executor for the whole measurement
+        slow = asyncio.ensure_future(run_db(time.sleep, 1.0))
+        await asyncio.sleep(0.05)
+        during, broadcasts = await _broadcast_latencies(0.6)
+        assert not slow.done()
+        await slow
+
+        # a blocked loop would hold every frame back for the rest of the query
+        assert during < 0.05, f"broadcast latency {during:.3f}s while a query ran (baseline {baseline:.3f}s)"
+        assert broadcasts >= 30
+
+    asyncio.run(scenario())
+
+
+def test_saturated_executor_does_not_block_the_loop():
+    async def scenario():
+        executor = BoundedExecutor("test", max_workers=2, max_pending=4)
+        try:
+            # twice as many blocking calls as may be admitted at once
+            calls = [asyncio.ensure_future(executor.run(time.sleep, 0.3)) for _ in range(8)]
+            lag = 0.0
+            started = time.monotonic()
+            while not all(call.done() for call in calls):
+                before = time.monotonic()
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.monotonic() - before - 0.01)
+            assert lag < 0.05, f"event loop stalled for {lag:.3f}s"
+            assert time.monotonic() - started >= 1.2   # 8 calls, 2 at a time
+            assert executor.stats()["queue_time_max"] > 0
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
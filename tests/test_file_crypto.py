@@ -0,0 +1,157 @@
+import asyncio
+import io
+import os
+
+import pytest
+from nacl.exceptions import CryptoError
+
+from app.file_crypto import (
+    HEADER_SIZE, TAG_SIZE, FileTooLarge, decrypt_chunks, encrypt_stream, plain_size_of,
+)
+
+KEY = b"k" * 32
+CHUNK = 16
+PLAIN = bytes(range(256)) * 2 + b"tail"   # 516 bytes: 32 full chunks and a short one
+
+
+def _encrypt(tmp_path, data=PLAIN, name="f.enc"):
+    path = str(tmp_path / name)
+    assert encrypt_stream(io.BytesIO(data), path, KEY, CHUNK) == len(data)
+    return path
+
+
+def _read(path, start=0, end=None, key=KEY):
+    return b"".join(decrypt_chunks(path, key, start, end))
+
+
+def _chunk_offset(index):
+    return HEADER_SIZE + index * (CHUNK + TAG_SIZE)
+
+
+def _patch(path, offset, data):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def test_round_trip_across_chunk_boundaries(tmp_path):
+    path = _encrypt(tmp_path)
+    assert plain_size_of(path) == len(PLAIN)
+    assert _read(path) == PLAIN
+    for start, end in [(0, 0), (15, 16), (10, 40), (16, 31), (500, 515), (513, 10000), (0, len(PLAIN) - 1)]:
+        assert _read(path, start, end) == PLAIN[start:end + 1]
+
+
+def test_exact_multiple_of_the_chunk_size(tmp_path):
+    data = b"x" * (CHUNK * 4)
+    path = _encrypt(tmp_path, data)
+    assert plain_size_of(path) == len(data)
+    assert _read(path, CHUNK * 3 - 1, CHUNK * 3) == data[CHUNK * 3 - 1:CHUNK * 3 + 1]
+
+
+def test_max_size_leaves_no_file(tmp_path):
+    path = str(tmp_path / "big.enc")
+    with pytest.raises(FileTooLarge):
+        encrypt_stream(io.BytesIO(PLAIN), path, KEY, CHUNK, max_size=100)
+    assert os.listdir(tmp_path) == []
+
+
+def test_tampered_chunk_is_rejected(tmp_path):
+    path = _encrypt(tmp_path)
+    with open(path, "rb") as f:
+        f.seek(_chunk_offset(2) + 3)
+        byte = f.read(1)
+    _patch(path, _chunk_offset(2) + 3, bytes([byte[0] ^ 1]))
+    with pytest.raises(CryptoError):
+        _read(path)
+    # chunks that were not touched still read
+    assert _read(path, 0, CHUNK * 2 - 1) == PLAIN[:CHUNK * 2]
+
+
+def test_tampered_header_is_rejected(tmp_path):
+    path = _encrypt(tmp_path)
+    _patch(path, HEADER_SIZE - 1, b"\xff")   # last byte of the nonce prefix
+    with pytest.raises(CryptoError):
+        _read(path, 0, 0)
+
+    path = _encrypt(tmp_path, name="magic.enc")
+    _patch(path, 0, b"XXXX")
+    with pytest.raises(ValueError):
+        _read(path)
+
+
+def test_swapped_and_truncated_chunks_are_rejected(tmp_path):
+    path = _encrypt(tmp_path)
+    with open(path, "rb") as f:
+        data = f.read()
+    stride = CHUNK + TAG_SIZE
+    first, second = data[_chunk_offset(0):_chunk_offset(1)], data[_chunk_offset(1):_chunk_offset(2)]
+    with open(path, "wb") as f:
+        f.write(data[:HEADER_SIZE] + second + first + data[_chunk_offset(2):])
+    with pytest.raises(CryptoError):
+        _read(path, 0, 0)
+
+    # dropping the short last chunk: the one before it is not flagged as last
+    with open(path, "wb") as f:
+        f.write(data[:HEADER_SIZE + stride * 32])
+    with pytest.raises(CryptoError):
+        _read(path)
+
+
+def test_wrong_key_is_rejected(tmp_path):
+    path = _encrypt(tmp_path)
+    with pytest.raises(CryptoError):
+        _read(path, key=b"o" * 32)
+
+
+# ================== RANGE ==================
+
+def test_parse_range():
+    from app.main import parse_range
+
+    size = 100
+    assert parse_range("bytes=0-9", size) == (0, 9)                  # start
+    assert parse_range("bytes=40-59", size) == (40, 59)              # middle
+    assert parse_range("bytes=90-", size) == (90, 99)                # to the end
+    assert parse_range("bytes=90-500", size) == (90, 99)
+    assert parse_range("bytes=-10", size) == (90, 99)                # suffix
+    assert parse_range("bytes=-500", size) == (0, 99)
+    assert parse_range("bytes=100-", size) == "unsatisfiable"
+    assert parse_range("bytes=-0", size) == "unsatisfiable"
+    assert parse_range("bytes=0-9,20-29", size) is None              # multi-range: whole file
+    assert parse_range("bytes=9-0", size) is None
+    assert parse_range("items=0-9", size) is None
+
+
+def test_download_ranges(tmp_path):
+    from fastapi import HTTPException
+
+    from app import blobs
+    from app.chat_keys import key_ring
+    from app.create_db import create_database
+    from app.main import download_file
+
+    create_database()
+    if key_ring.current_id is None:
+        key_ring.start()
+    path = str(tmp_path / "r.enc")
+    encrypt_stream(io.BytesIO(PLAIN), path, key_ring.current, CHUNK)
+    assert blobs.add_blob("range1", "r.bin", "application/octet-stream", "range-digest", key_ring.current_id,
+                          path, os.path.getsize(path))
+
+    async def get(range_header):
+        response = await download_file("range1", user={}, range_header=range_header, if_none_match=None, if_range=None)
+        body = b""
+        if hasattr(response, "body_iterator"):
+            async for chunk in response.body_iterator:
+                body += chunk
+        return response.status_code, response.headers.get("content-range"), body
+
+    async def scenario():
+        assert await get(None) == (200, None, PLAIN)
+        assert await get("bytes=0-9") == (206, f"bytes 0-9/{len(PLAIN)}", PLAIN[:10])
+        assert await get("bytes=250-269") == (206, f"bytes 250-269/{len(PLAIN)}", PLAIN[250:270])
+        assert await get("bytes=-4") == (206, f"bytes 512-515/{len(PLAIN)}", b"tail")
+        assert await get(f"bytes={len(PLAIN)}-") == (416, f"bytes */{len(PLAIN)}", b"")
+
+    asyncio.run(scenario())
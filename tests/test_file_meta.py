@@ -0,0 +1,22 @@
+import time
+
+from app.file_meta import FileMetaCache, etag_for, etag_matches
+
+
+def test_entries_expire_so_evicted_files_stop_answering_304(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = FileMetaCache(max_files=10, ttl=60)
+    cache.store("a", "a.png", "image/png", '"e"')
+    assert cache.lookup("a") == ("a.png", "image/png", '"e"')
+    now[0] += 61
+    assert cache.lookup("a") is None
+
+
+def test_etag_does_not_expose_the_dedup_digest():
+    digest = "ab" * 32
+    first, second = etag_for("file1", digest), etag_for("file2", digest)
+    assert first != second
+    assert digest not in first
+    assert etag_matches(f'W/{first}, "other"', first)
+    assert not etag_matches(f"W/{first}", first, weak=False)
@@ -0,0 +1,163 @@
+import asyncio
+
+from app.history import LiveTail, RecentMessages
+
+
+class Table:
+    """in-memory messages table answering like fetch_messages"""
+
+    def __init__(self, count):
+        self.rows = [self.message(i) for i in range(1, count + 1)]
+        self.calls = []
+
+    @staticmethod
+    def message(i):
+        return {"id": i, "username": "u", "type": "text", "text": f"m{i}", "seq": i}
+
+    def fetch(self, chat_id, limit, before_id=None, after_id=None):
+        self.calls.append((limit, before_id, after_id))
+        if after_id is not None:
+            newer = [m for m in self.rows if m["id"] > after_id]
+            return newer[:limit][::-1], len(newer) > limit
+        older = [m for m in self.rows if before_id is None or m["id"] < before_id][::-1]
+        return older[:limit], len(older) > limit
+
+
+def _ids(page):
+    return None if page is None else ([m["id"] for m in page[0]], page[1])
+
+
+def _cache(table, per_chat=5):
+    return RecentMessages(table.fetch, lambda name: 1, per_chat=per_chat, max_bytes=1 << 20)
+
+
+def test_ring_buffer_wraps_around():
+    table = Table(20)
+    cache = _cache(table)
+
+    async def scenario():
+        assert _ids(await cache.page(1, 3)) == ([20, 19, 18], True)      # warmed with 16..20
+        new = [Table.message(i) for i in range(21, 28)]
+        table.rows += new
+        cache.add(1, new)                                                # 16..27 → 23..27
+        return [
+            _ids(await cache.page(1, 3)),
+            _ids(await cache.page(1, 3, before_id=27)),
+            _ids(await cache.page(1, 3, after_id=24)),
+            _ids(await cache.page(1, 2, after_id=23)),
+        ]
+
+    assert asyncio.run(scenario()) == [
+        ([27, 26, 25], True),
+        ([26, 25, 24], True),
+        ([27, 26, 25], False),
+        ([25, 24], True),
+    ]
+    assert table.calls == [(5, None, None)]
+    assert cache.stats()["hits"] == 5
+
+
+def test_requests_past_the_buffer_go_to_the_table():
+    table = Table(20)
+    cache = _cache(table)
+
+    async def scenario():
+        await cache.page(1, 3)                                           # 16..20 in memory
+        return [
+            await cache.page(1, 3, before_id=18),    # only 16, 17 are kept
+            await cache.page(1, 3, before_id=10),    # entirely older
+            await cache.page(1, 3, after_id=10),     # 11..15 were never kept
+        ]
+
+    assert asyncio.run(scenario()) == [None, None, None]
+    assert cache.stats()["misses"] == 3
+
+
+def test_complete_chat_is_answered_to_the_first_message():
+    table = Table(3)
+    cache = _cache(table)
+
+    async def scenario():
+        await cache.page(1, 2)
+        return _ids(await cache.page(1, 2, before_id=2)), _ids(await cache.page(1, 2, after_id=0))
+
+    assert asyncio.run(scenario()) == (([1], False), ([2, 1], True))
+
+
+def test_messages_added_while_warming_are_kept():
+    table = Table(3)
+    cache = _cache(table)
+    late = Table.message(4)
+
+    def slow_fetch(chat_id, limit, before_id=None, after_id=None):
+        # the broadcast of message 4 lands while the warm-up query runs
+        cache.add(1, [late])
+        return Table.fetch(table, chat_id, limit, before_id, after_id)
+
+    cache.loader = slow_fetch
+    assert _ids(asyncio.run(cache.page(1, 10))) == ([4, 3, 2, 1], False)
+
+
+def test_get_messages_falls_back_to_the_table(monkeypatch):
+    from app import main
+    from app.auth import create_access_token
+
+    table = Table(20)
+    cache = _cache(table)
+    monkeypatch.setattr(main, "recent_messages", cache)
+    monkeypatch.setattr(main, "fetch_messages", table.fetch)
+    monkeypatch.setattr(main.archive, "exists", lambda: False)
+    token = create_access_token({"sub": "1", "username": "u"})
+
+    async def scenario():
+        first = await main.get_messages(token, chat_id="1", limit=4)
+        second = await main.get_messages(token, chat_id="1", limit=4, before_id=first["next_cursor"])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert [m["id"] for m in first["messages"]] == [20, 19, 18, 17]
+    assert [m["id"] for m in second["messages"]] == [16, 15, 14, 13]
+    assert second["next_cursor"] == 13
+    # the warm-up, then the page that went past the five kept messages
+    assert table.calls == [(5, None, None), (4, 17, None)]
+
+
+# ================== LIVE TAIL ==================
+
+def _payload(seq):
+    return {"type": "text", "seq": seq}
+
+
+def _seqs(frames):
+    return None if frames is None else [f["seq"] for f in frames]
+
+
+def test_live_tail_wraps_around():
+    tail = LiveTail(per_chat=3, max_chats=10)
+    for seq in range(1, 6):
+        tail.add(1, _payload(seq))
+    assert _seqs(tail.since(1, 2)) == [3, 4, 5]
+    assert _seqs(tail.since(1, 4)) == [5]
+    assert _seqs(tail.since(1, 5)) == []
+    # 2 has been dropped: memory alone can't say what followed 1
+    assert tail.since(1, 1) is None
+
+
+def test_live_tail_waits_for_a_missing_frame():
+    tail = LiveTail(per_chat=5, max_chats=10)
+    for seq in (1, 2, 4):
+        tail.add(1, _payload(seq))
+    assert tail.since(1, 2) is None
+    tail.add(1, _payload(3))
+    assert _seqs(tail.since(1, 2)) == [3, 4]
+
+
+def test_live_tail_drops_the_least_recent_chat():
+    tail = LiveTail(per_chat=3, max_chats=2)
+    tail.add(1, _payload(1))
+    tail.add(2, _payload(1))
+    tail.add(1, _payload(2))
+    tail.add(3, _payload(1))
+    assert tail.since(2, 0) is None
+    assert _seqs(tail.since(1, 0)) == [1, 2]
+    assert _seqs(tail.since(3, 0)) == [1]
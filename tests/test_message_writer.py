@@ -0,0 +1,78 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+from app.message_writer import MessageWriter
+
+
+def _writer(flush_func, tmp_path, **kwargs):
+    return MessageWriter(
+        flush_func, batch_size=10, flush_interval=0.01, max_queue=100,
+        max_attempts=1, stop_timeout=0.1, dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs
+    )
+
+
+def _dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_write_that_commits_after_the_stop_timeout_is_not_dead_lettered(tmp_path):
+    stored = []
+
+    def slow_insert(rows):
+        time.sleep(0.5)   # still running when stop() gives up
+        stored.extend(rows)
+        return list(range(len(rows)))
+
+    async def scenario():
+        writer = _writer(slow_insert, tmp_path)
+        writer.start()
+        await writer.submit(1, "a")
+        await asyncio.sleep(0.05)
+        await writer.submit(1, "b")   # queued behind the slow write
+        await writer.stop()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stored == [(1, "a")]
+    assert _dead_letters(tmp_path) == [[1, "b"]]
+    assert stats["written"] == 1 and stats["dead_lettered"] == 1
+
+
+def test_write_that_fails_after_the_stop_timeout_is_dead_lettered(tmp_path):
+    def failing_insert(rows):
+        time.sleep(0.5)
+        raise ConnectionError("database gone")
+
+    async def scenario():
+        writer = _writer(failing_insert, tmp_path)
+        writer.start()
+        await writer.submit(1, "a")
+        await asyncio.sleep(0.05)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert _dead_letters(tmp_path) == [[1, "a"]]
+
+
+def test_rejected_row_does_not_hold_back_the_batch(tmp_path):
+    stored = []
+
+    def insert(rows):
+        if any(row[1] == "bad" for row in rows):
+            raise sqlite3.IntegrityError("UNIQUE constraint failed")
+        stored.extend(rows)
+        return list(range(len(rows)))
+
+    async def scenario():
+        writer = _writer(insert, tmp_path)
+        writer.start()
+        for text in ("a", "bad", "c"):
+            await writer.submit(1, text)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert stored == [(1, "a"), (1, "c")]
+    assert _dead_letters(tmp_path) == [[1, "bad"]]
@@ -0,0 +1,102 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+
+from app import blobs, chat_keys, reencrypt
+from app.chat_keys import key_ring, retire_unused_keys
+from app.create_db import create_database
+from app.db import get_connection
+from app.file_crypto import encrypt_stream, decrypt_chunks
+
+PLAIN = b"attachment " * 5000
+
+
+@pytest.fixture(autouse=True)
+def fresh_blobs(monkeypatch):
+    create_database()
+    monkeypatch.setattr(chat_keys, "DEPLOY_ID", None)
+    conn = get_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM files")
+        cursor.execute("DELETE FROM blobs")
+    conn.commit()
+    conn.close()
+
+
+def _store(tmp_path, file_id, digest):
+    """an upload under the current key"""
+    path = str(tmp_path / f"{file_id}.enc")
+    encrypt_stream(io.BytesIO(PLAIN), path, key_ring.current, 4096)
+    assert blobs.add_blob(file_id, "a.txt", "text/plain", digest, key_ring.current_id, path, os.path.getsize(path))
+    return path
+
+
+def _blob_of(file_id):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT b.enc_path, b.key_id FROM files f JOIN blobs b ON b.id = f.blob_id WHERE f.id=%s",
+                (file_id,)
+            )
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def test_moved_blob_serves_every_file_and_old_key_retires(tmp_path):
+    key_ring.start()
+    old_key = key_ring.current_id
+    old_path = _store(tmp_path, "f1", "d1")
+
+    key_ring.start()   # next deploy
+    # shares the blob; must follow it when it moves
+    assert blobs.add_file("f2", "b.txt", "text/plain", "d1")
+
+    replaced = []
+    assert asyncio.run(reencrypt.reencrypt_round(set(), replaced))
+    assert replaced == [old_path]
+    for file_id in ("f1", "f2"):
+        enc_path, key_id = _blob_of(file_id)
+        assert enc_path != old_path and key_id == key_ring.current_id
+        assert b"".join(decrypt_chunks(enc_path, key_ring.get(key_id))) == PLAIN
+
+    assert not asyncio.run(reencrypt.reencrypt_round(set(), []))
+    retired = retire_unused_keys(key_ring.current_id, 0)
+    assert old_key in retired and key_ring.current_id not in retired
+    # replaced less than an hour ago: kept
+    key_ring.start()
+    assert retire_unused_keys(key_ring.current_id, 3600) == []
+
+
+def test_cancelled_round_leaves_no_orphan_copy(tmp_path, monkeypatch):
+    key_ring.start()
+    old_path = _store(tmp_path, "f1", "d1")
+    key_ring.start()
+
+    real = reencrypt.reencrypt_blob_file
+
+    def slow_copy(*args):
+        time.sleep(0.3)
+        return real(*args)
+
+    monkeypatch.setattr(reencrypt, "reencrypt_blob_file", slow_copy)
+
+    async def scenario():
+        replaced = []
+        task = asyncio.ensure_future(reencrypt.reencrypt_round(set(), replaced))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return replaced
+
+    replaced = asyncio.run(scenario())
+    # the copy finished after the cancel but was never moved: only it is dropped
+    assert len(replaced) == 1 and replaced[0] != old_path
+    assert _blob_of("f1")[0] == old_path
+    reencrypt.remove_files(replaced)
+    assert sorted(os.listdir(tmp_path)) == ["f1.enc"]
@@ -0,0 +1,83 @@
+import asyncio
+
+from app import websocket
+from app.config import FANOUT_QUEUE_MAX
+from app.fanout import Connection
+from app.history import LiveTail
+
+
+class SentFrames:
+    """stand-in Connection: keeps what would be sent"""
+
+    def __init__(self):
+        self.frames = []
+
+    def room(self):
+        return 1000
+
+    def send_json(self, payload):
+        self.frames.append(payload)
+
+
+class SlowSocket:
+    """stand-in websocket that never finishes a send"""
+
+    def __init__(self):
+        self.close_code = None
+
+    async def send_text(self, frame):
+        await asyncio.sleep(3600)
+
+    async def close(self, code=None):
+        self.close_code = code
+
+
+def _frame(seq):
+    return {"type": "text", "text": f"m{seq}", "seq": seq}
+
+
+def _resume(monkeypatch, stored, tail_seqs, resume_from):
+    tail = LiveTail(per_chat=3, max_chats=10)
+    for seq in tail_seqs:
+        tail.add(1, _frame(seq))
+    monkeypatch.setattr(websocket, "live_tail", tail)
+    monkeypatch.setattr(websocket, "fetch_messages_since", lambda chat_id, seq, limit: [_frame(s) for s in stored])
+    conn = SentFrames()
+    ok = asyncio.run(websocket.replay_missed(conn, 1, "global", resume_from))
+    return ok, [frame["seq"] for frame in conn.frames]
+
+
+def test_resume_from_the_tail(monkeypatch):
+    assert _resume(monkeypatch, [], [5, 6, 7], 5) == (True, [6, 7])
+
+
+def test_resume_joins_stored_rows_and_the_tail(monkeypatch):
+    # 1..5 missed, only 3..5 still in the tail
+    assert _resume(monkeypatch, [2, 3], [3, 4, 5], 1) == (True, [2, 3, 4, 5])
+
+
+def test_resume_reloads_when_rows_are_not_stored_yet(monkeypatch):
+    # 3 is still in the writer's queue and has left the tail: neither has it
+    assert _resume(monkeypatch, [2], [4, 5, 6], 1) == (False, [])
+
+
+def test_resume_past_the_connection_queue_resyncs(monkeypatch):
+    # more missed frames than a connection can queue: replaying them would
+    # trip the slow-consumer close, and the client would resume again forever
+    missed = FANOUT_QUEUE_MAX + 100
+    tail = LiveTail(per_chat=missed + 1, max_chats=10)
+    for seq in range(1, missed + 2):
+        tail.add(1, _frame(seq))
+    monkeypatch.setattr(websocket, "live_tail", tail)
+
+    async def scenario():
+        ws = SlowSocket()
+        conn = Connection(ws)
+        ok = await websocket.replay_missed(conn, 1, "global", 1)
+        assert conn.send_json({"type": "resync"})
+        await asyncio.sleep(0)
+        closed = conn.closed
+        conn.close()
+        return ok, closed, ws.close_code
+
+    assert asyncio.run(scenario()) == (False, False, None)
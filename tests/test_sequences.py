@@ -0,0 +1,47 @@
+import asyncio
+
+from app import sequences
+from app.sequences import SequenceAllocator
+
+
+class CountingBroker:
+    """stand-in for broker.incr: one shared counter, remembers the floors it was given"""
+
+    def __init__(self):
+        self.value = 0
+        self.floors = []
+
+    async def incr(self, name, floor):
+        self.floors.append(floor)
+        self.value = max(self.value, floor) + 1
+        return self.value
+
+
+class DownBroker:
+    async def incr(self, name, floor):
+        raise ConnectionError("down")
+
+
+def test_shared_numbers_come_from_the_broker(monkeypatch):
+    monkeypatch.setattr(sequences, "load_last_seq", lambda chat_id: 10)
+    broker = CountingBroker()
+    allocator = SequenceAllocator(shared=True, broker=broker)
+
+    async def scenario():
+        first = await allocator.next(1)
+        # another worker numbered up to 30 meanwhile
+        allocator.observe(1, 30)
+        broker.value = 0   # and the broker lost its counter
+        return first, await allocator.next(1)
+
+    assert asyncio.run(scenario()) == (11, 31)
+    assert broker.floors == [10, 30]
+
+
+def test_database_fallback_when_the_broker_is_down(monkeypatch):
+    monkeypatch.setattr(sequences, "load_last_seq", lambda chat_id: 5)
+    monkeypatch.setattr(sequences, "increment_seq", lambda chat_id: 3)
+    allocator = SequenceAllocator(shared=True, broker=DownBroker())
+
+    # chats.last_seq lags behind what this worker has seen: never go back
+    assert asyncio.run(allocator.next(1)) == 6
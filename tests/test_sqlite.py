@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_db, db, migrations
+from app.create_db import create_database
+from app.db import IntegrityError, close_pool, get_connection
+from app.migrations import LATEST_VERSION, column_exists, index_exists
+from app.websocket import fetch_messages, fetch_messages_since, save_messages
+
+
+@pytest.fixture(autouse=True)
+def fresh_file(tmp_path, monkeypatch):
+    """a brand-new database file instead of the one shared by the other tests"""
+    path = str(tmp_path / "fresh.db")
+    close_pool()
+    for module in (db, create_db, migrations):
+        monkeypatch.setattr(module, "SQLITE_PATH", path)
+    yield path
+    close_pool()
+
+
+def _execute(sql, params=()):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if sql.lstrip().upper().startswith("SELECT") else cursor.lastrowid
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def test_create_database_migrates_a_new_file(fresh_file):
+    assert not create_db.schema_is_current()
+    create_database()
+    assert create_db.schema_is_current()
+    assert migrations.status() == LATEST_VERSION
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            assert column_exists(cursor, "messages", "seq")
+            assert column_exists(cursor, "blobs", "thumb_path")
+            assert index_exists(cursor, "chats", "uq_chats_name")
+    finally:
+        conn.close()
+
+    # a second start does nothing
+    create_database()
+    assert migrations.status() == LATEST_VERSION
+
+    _execute("INSERT INTO chats(name) VALUES (%s)", ("global",))
+    with pytest.raises(IntegrityError):
+        _execute("INSERT INTO chats(name) VALUES (%s)", ("global",))
+
+
+def test_insert_and_keyset_pages():
+    create_database()
+    user_id = _execute("INSERT INTO users(username, password) VALUES (%s, %s)", ("ali", "x"))
+    chat_id = _execute("INSERT INTO chats(name, is_group) VALUES (%s, 1)", ("room",))
+
+    started = datetime(2026, 1, 1, 12, 0, 0)
+    rows = [
+        (chat_id, user_id, "text", f"m{seq}", started + timedelta(seconds=seq), seq, "ali", None)
+        for seq in range(1, 8)
+    ]
+    ids = save_messages(rows[:4]) + save_messages(rows[4:])
+    assert len(set(ids)) == 7
+    assert [r[0] for r in _execute("SELECT id FROM messages ORDER BY seq")] == ids
+
+    newest, has_more = fetch_messages(chat_id, 3)
+    assert [m["text"] for m in newest] == ["m7", "m6", "m5"] and has_more
+    assert newest[0]["timestamp"] == "2026-01-01 12:00:07.000000"
+    assert newest[0]["username"] == "ali" and newest[0]["mime"] is None
+
+    older, has_more = fetch_messages("room", 3, before_id=newest[-1]["id"])
+    assert [m["text"] for m in older] == ["m4", "m3", "m2"] and has_more
+    oldest, has_more = fetch_messages("room", 3, before_id=older[-1]["id"])
+    assert [m["text"] for m in oldest] == ["m1"] and not has_more
+
+    newer, has_more = fetch_messages(chat_id, 2, after_id=ids[2])
+    assert [m["text"] for m in newer] == ["m5", "m4"] and has_more
+
+    assert [m["seq"] for m in fetch_messages_since(chat_id, 5, 10)] == [6, 7]
+    assert fetch_messages("missing", 3) == ([], False)
@@ -0,0 +1,99 @@
+import datetime
+import time
+import types
+
+import pytest
+from jose import JWTError, jwt
+
+from app import auth
+from app.auth import TokenCache
+
+
+class Clock:
+    """time.time() and jose's datetime.now() moved to a chosen instant"""
+
+    def __init__(self, monkeypatch):
+        self.now = time.time()
+        clock = self
+
+        class FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.datetime.fromtimestamp(clock.now, tz)
+
+        monkeypatch.setattr(auth, "time", types.SimpleNamespace(time=lambda: clock.now))
+        monkeypatch.setattr(jwt, "datetime", FrozenDatetime)
+
+
+def _token(exp, **claims):
+    return jwt.encode({"sub": "1", "exp": int(exp), **claims}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fresh = TokenCache(4)
+    monkeypatch.setattr(auth, "token_cache", fresh)
+    return fresh
+
+
+def test_cached_token_is_rejected_after_exp(monkeypatch, cache):
+    clock = Clock(monkeypatch)
+    token = _token(clock.now + 60)
+    assert auth.decode_token(token)["sub"] == "1"
+    assert auth.decode_token(token)["sub"] == "1"
+    assert cache.stats["hits"] == 1
+
+    clock.now += 61
+    with pytest.raises(JWTError):
+        auth.decode_token(token)
+    assert cache.stats["hits"] == 1
+    assert len(cache._entries) == 0
+
+
+def test_entry_dies_at_its_exp(monkeypatch):
+    clock = Clock(monkeypatch)
+    cache = TokenCache(4)
+    cache.put(b"a", "signer", {"exp": clock.now + 10})
+    assert cache.get(b"a", "signer") is not None
+    clock.now += 10
+    assert cache.get(b"a", "signer") is None
+    assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_expired_token_is_never_cached(cache):
+    with pytest.raises(JWTError):
+        auth.decode_token(_token(time.time() - 5))
+    assert len(cache._entries) == 0
+
+
+def test_tokens_without_exp_are_not_cached(cache):
+    token = jwt.encode({"sub": "1"}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert auth.decode_token(token)["sub"] == "1"
+    assert len(cache._entries) == 0
+
+
+def test_signer_change_drops_the_cache(monkeypatch, cache):
+    token = _token(time.time() + 60)
+    auth.decode_token(token)
+    monkeypatch.setattr(auth, "SECRET_KEY", "rotated")
+    with pytest.raises(JWTError):
+        auth.decode_token(token)
+    assert len(cache._entries) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TokenCache(2)
+    exp = time.time() + 60
+    cache.put(b"a", "s", {"exp": exp})
+    cache.put(b"b", "s", {"exp": exp})
+    cache.get(b"a", "s")
+    cache.put(b"c", "s", {"exp": exp})
+    assert cache.get(b"b", "s") is None
+    assert cache.get(b"a", "s") is not None
+    assert cache.stats["evictions"] == 1
+
+
+def test_callers_get_a_copy(cache):
+    token = _token(time.time() + 60)
+    auth.decode_token(token)["sub"] = "2"
+    assert auth.decode_token(token)["sub"] == "1"